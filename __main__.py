@@ -3,17 +3,22 @@ import os
 import shutil
 import logging
 import argparse
+import time
 from rdkit import RDLogger
 from os.path import join, basename, abspath
 
-from .molecular import Molecule, CACHE_SETTINGS
+from .molecular import Molecule, set_energy_store
 from .ga import GAPopulation, GAInput
 from .convenience_tools import (tar_output,
                                 errorhandler,
                                 streamhandler,
                                 archive_output,
-                                kill_macromodel)
+                                kill_macromodel,
+                                WorkerPool,
+                                worker_pool,
+                                ResultStore)
 from .ga import plotting as plot
+from .optimization.macromodel import set_macromodel_licenses
 
 warnings.filterwarnings("ignore")
 RDLogger.logger().setLevel(RDLogger.CRITICAL)
@@ -59,16 +64,13 @@ class GAProgress:
         if ga_tools.input.progress_load:
             # The version of the molecule loaded from databases may not
             # have the properties calculated that the version loaded
-            # from the previous GA run may have. As a result, first
-            # turn the cache of to load the GA produced version and
-            # then update the cache.
-            CACHE_SETTINGS['ON'] = False
-            for m in GAPopulation.load(ga_tools.input.progress_load,
-                                       Molecule.from_dict):
-                m.update_cache()
-            CACHE_SETTINGS['ON'] = True
-            self.progress = GAPopulation.load(ga_tools.input.progress_load,
-                                              Molecule.from_dict)
+            # from the previous GA run may have. As a result, the GA
+            # produced version overwrites any cached one.
+            self.progress = GAPopulation.load(
+                                ga_tools.input.progress_load,
+                                Molecule.from_dict,
+                                processes=ga_tools.input.processes,
+                                overwrite_cache=True)
             self.progress.ga_tools = ga_tools
         else:
             self.progress = GAPopulation(ga_tools=ga_tools)
@@ -206,6 +208,39 @@ class GAProgress:
             pop.dump(join('..', 'pop_dumps', dump_name))
 
 
+def set_up_workers(ga_input):
+    """
+    Applies the settings of `ga_input` which worker processes inherit.
+
+    The settings are held in environment variables, so this must be
+    called before the worker processes are started.
+
+    Parameters
+    ----------
+    ga_input : :class:`.GAInput`
+        The GA input file.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # Input files may set ``macromodel_licenses``, the number of
+    # MacroModel license seats.
+    macromodel_licenses = getattr(ga_input, 'macromodel_licenses', None)
+    if macromodel_licenses is not None:
+        set_macromodel_licenses(macromodel_licenses)
+
+    # If ``energy_store`` is set, the results of energy calculations
+    # are kept in that directory and reused by later runs. Its size
+    # in bytes can be limited with ``energy_store_size``.
+    energy_store = getattr(ga_input, 'energy_store', None)
+    if energy_store is not None:
+        set_energy_store(abspath(energy_store),
+                         getattr(ga_input, 'energy_store_size', None))
+
+
 def ga_run(ga_input):
     """
     Runs the GA.
@@ -244,116 +279,194 @@ def ga_run(ga_input):
     os.chdir('scratch')
     open('errors.log', 'w').close()
 
-    # 2. Initialize the population.
-
-    progress = GAProgress(ga_input.ga_tools())
-
-    logger.info('Generating initial population.')
-    init_func = getattr(GAPopulation, ga_input.initer().name)
-    if init_func.__name__ != 'load':
-        pop = init_func(**ga_input.initer().params,
-                        size=ga_input.pop_size,
-                        ga_tools=ga_input.ga_tools())
-    else:
-        # The version of the molecule loaded from databases may not
-        # have the properties calculated that the version loaded from
-        # the previous GA run may have. As a result, first turn the
-        # cache off to load the GA produced version and then update the
-        # cache.
-        CACHE_SETTINGS['ON'] = False
-        for m in init_func(**ga_input.initer().params):
-            m.update_cache()
-        CACHE_SETTINGS['ON'] = True
-        pop = init_func(**ga_input.initer().params)
-        pop.ga_tools = ga_input.ga_tools()
-
-    id_ = pop.assign_names_from(progress.first_mol_name)
-
-    progress.debug_dump(pop, 'init_pop.json')
+    # The pool started by the caller is used for everything, up to
+    # writing the final population. If there is none, a pool is
+    # started for this run.
+    with worker_pool(ga_input.processes):
+        # Input files may set ``opt_timeout``, the maximum number of
+        # seconds the optimization of a single molecule may take, and
+        # ``opt_threads``, the number of threads used to run
+        # optimizations which use external programs.
+        opt_timeout = getattr(ga_input, 'opt_timeout', None)
+        opt_threads = getattr(ga_input, 'opt_threads', None)
+        # If ``streaming`` is set, each molecule has its fitness
+        # calculated as soon as it is optimized, instead of after the
+        # whole population is optimized.
+        streaming = getattr(ga_input, 'streaming', False)
+        mode = 'streaming' if streaming else 'phased'
+        # If ``opt_store`` is set, optimized structures are kept in
+        # that directory and reused by later runs. Its size in bytes
+        # can be limited with ``opt_store_size``.
+        opt_store = getattr(ga_input, 'opt_store', None)
+        if opt_store is not None:
+            opt_store = ResultStore(
+                            join(launch_dir, opt_store),
+                            getattr(ga_input, 'opt_store_size', None))
+        # If ``opt_batch_size`` is set, molecules are optimized in
+        # batches of that size, each with a single job where the
+        # optimization function supports it.
+        opt_batch_size = getattr(ga_input, 'opt_batch_size', None)
+        # In streaming mode each molecule is optimized and evaluated
+        # in its own task, so threads and batches are not used.
+        if streaming and opt_threads is not None:
+            logger.warning('opt_threads is not used in streaming mode.')
+        if streaming and opt_batch_size is not None:
+            logger.warning('opt_batch_size is not used in streaming '
+                           'mode.')
+
+        def evaluate(pop):
+            if streaming:
+                logger.info('Optimizing the population and calculating '
+                            'the fitness of population members.')
+                pop.optimize_and_evaluate(ga_input.opter(),
+                                          ga_input.processes,
+                                          opt_timeout,
+                                          opt_store)
+                return
+
+            logger.info('Optimizing the population.')
+            pop.optimize(ga_input.opter(),
+                         ga_input.processes,
+                         opt_timeout,
+                         opt_threads,
+                         opt_store,
+                         opt_batch_size)
+
+            logger.info('Calculating the fitness of population members.')
+            pop.calculate_member_fitness(ga_input.processes)
+
+        # 2. Initialize the population.
+
+        progress = GAProgress(ga_input.ga_tools())
+
+        logger.info('Generating initial population.')
+        init_func = getattr(GAPopulation, ga_input.initer().name)
+        if init_func.__name__ != 'load':
+            pop = init_func(**ga_input.initer().params,
+                            size=ga_input.pop_size,
+                            ga_tools=ga_input.ga_tools())
+        else:
+            # The version of the molecule loaded from databases may
+            # not have the properties calculated that the version
+            # loaded from the previous GA run may have. As a result,
+            # the GA produced version overwrites any cached one.
+            params = {'processes': ga_input.processes,
+                      'overwrite_cache': True,
+                      **ga_input.initer().params}
+            pop = init_func(**params)
+            pop.ga_tools = ga_input.ga_tools()
+
+        id_ = pop.assign_names_from(progress.first_mol_name)
+
+        progress.debug_dump(pop, 'init_pop.json')
+
+        evaluate(pop)
+
+        # Molecules rejected by an optimization pipeline are removed
+        # from the population. New molecules are made in their place,
+        # so that the population keeps its size. Loaded populations
+        # cannot be refilled.
+        refill = init_func.__name__ != 'load'
+        for _ in range(10 if refill else 0):
+            missing = ga_input.pop_size - len(pop)
+            if missing <= 0:
+                break
+            logger.info(f'Replacing {missing} rejected molecules.')
+            new = init_func(**ga_input.initer().params,
+                            size=missing,
+                            ga_tools=ga_input.ga_tools())
+            id_ = new.assign_names_from(id_)
+            evaluate(new)
+            pop.add_members(new)
+
+        if refill and len(pop) < ga_input.pop_size:
+            raise RuntimeError(
+                f'The initial population has {len(pop)} molecules '
+                f'instead of {ga_input.pop_size}. Too many were '
+                'rejected during optimization.')
 
-    logger.info('Optimizing the population.')
-    pop.optimize(ga_input.opter(), ga_input.processes)
+        logger.info('Normalizing fitness values.')
+        pop.normalize_fitness_values()
 
-    logger.info('Calculating the fitness of population members.')
-    pop.calculate_member_fitness(ga_input.processes)
+        progress.log_pop(logger, pop)
 
-    logger.info('Normalizing fitness values.')
-    pop.normalize_fitness_values()
+        logger.info('Recording progress.')
+        progress.progress.add_subpopulation(pop)
+        progress.db(pop)
 
-    progress.log_pop(logger, pop)
+        # 3. Run the GA.
 
-    logger.info('Recording progress.')
-    progress.progress.add_subpopulation(pop)
-    progress.db(pop)
+        for x in range(progress.start_gen, ga_input.num_generations+1):
+            # Check that the population has the correct size.
+            assert len(pop) == ga_input.pop_size
 
-    # 3. Run the GA.
+            logger.info(
+                    f'Generation {x} of {ga_input.num_generations}.')
+            gen_start = time.perf_counter()
 
-    for x in range(progress.start_gen, ga_input.num_generations+1):
-        # Check that the population has the correct size.
-        assert len(pop) == ga_input.pop_size
+            logger.info('Starting crossovers.')
+            offspring = pop.gen_offspring(ccounter.format(x))
 
-        logger.info(f'Generation {x} of {ga_input.num_generations}.')
+            logger.info('Starting mutations.')
+            mutants = pop.gen_mutants(mcounter.format(x))
 
-        logger.info('Starting crossovers.')
-        offspring = pop.gen_offspring(ccounter.format(x))
+            logger.debug('Population size is {}.'.format(len(pop)))
 
-        logger.info('Starting mutations.')
-        mutants = pop.gen_mutants(mcounter.format(x))
+            logger.info('Adding offsping and mutants to population.')
+            pop += offspring + mutants
 
-        logger.debug('Population size is {}.'.format(len(pop)))
+            logger.debug('Population size is {}.'.format(len(pop)))
 
-        logger.info('Adding offsping and mutants to population.')
-        pop += offspring + mutants
+            logger.info('Removing duplicates, if any.')
+            pop.remove_duplicates()
 
-        logger.debug('Population size is {}.'.format(len(pop)))
+            logger.debug('Population size is {}.'.format(len(pop)))
 
-        logger.info('Removing duplicates, if any.')
-        pop.remove_duplicates()
+            id_ = pop.assign_names_from(id_)
+            progress.debug_dump(pop, f'gen_{x}_unselected.json')
 
-        logger.debug('Population size is {}.'.format(len(pop)))
+            evaluate(pop)
 
-        id_ = pop.assign_names_from(id_)
-        progress.debug_dump(pop, f'gen_{x}_unselected.json')
+            logger.info('Normalizing fitness values.')
+            pop.normalize_fitness_values()
 
-        logger.info('Optimizing the population.')
-        pop.optimize(ga_input.opter(), ga_input.processes)
+            progress.log_pop(logger, pop)
+            progress.db(pop)
 
-        logger.info('Calculating the fitness of population members.')
-        pop.calculate_member_fitness(ga_input.processes)
+            logger.info('Selecting members of the next generation.')
+            pop = pop.gen_next_gen(ga_input.pop_size,
+                                   gcounter.format(x))
 
-        logger.info('Normalizing fitness values.')
-        pop.normalize_fitness_values()
+            logger.info('Recording progress.')
+            progress.progress.add_subpopulation(pop)
+            progress.debug_dump(progress.progress, 'progress.json')
+            progress.debug_dump(progress.db_pop, 'database.json')
+            progress.debug_dump(pop, f'gen_{x}_selected.json')
 
-        progress.log_pop(logger, pop)
-        progress.db(pop)
+            logger.info(f'Generation {x} took '
+                        f'{time.perf_counter()-gen_start:.2f} s in '
+                        f'{mode} mode.')
 
-        logger.info('Selecting members of the next generation.')
-        pop = pop.gen_next_gen(ga_input.pop_size, gcounter.format(x))
+            # Check if any user-defined exit criterion has been
+            # fulfilled.
+            if pop.exit(progress.progress):
+                break
 
-        logger.info('Recording progress.')
-        progress.progress.add_subpopulation(pop)
-        progress.debug_dump(progress.progress, 'progress.json')
-        progress.debug_dump(progress.db_pop, 'database.json')
-        progress.debug_dump(pop, f'gen_{x}_selected.json')
+        kill_macromodel()
+        os.chdir(root_dir)
+        os.rename('scratch/errors.log', 'errors.log')
+        progress.progress.normalize_fitness_values()
+        progress.dump()
+        logger.info('Plotting EPP.')
+        plot.fitness_epp(progress.progress, ga_input.plot_epp, 'epp.dmp')
+        progress.progress.remove_members(
+                        lambda x:
+                        pop.ga_tools.fitness.name not in x.progress_params)
+        plot.parameter_epp(progress.progress, ga_input.plot_epp, 'epp.dmp')
 
-        # Check if any user-defined exit criterion has been fulfilled.
-        if pop.exit(progress.progress):
-            break
+        shutil.rmtree('scratch')
+        pop.write('final_pop', True, ga_input.processes)
 
-    kill_macromodel()
-    os.chdir(root_dir)
-    os.rename('scratch/errors.log', 'errors.log')
-    progress.progress.normalize_fitness_values()
-    progress.dump()
-    logger.info('Plotting EPP.')
-    plot.fitness_epp(progress.progress, ga_input.plot_epp, 'epp.dmp')
-    progress.progress.remove_members(
-                    lambda x:
-                    pop.ga_tools.fitness.name not in x.progress_params)
-    plot.parameter_epp(progress.progress, ga_input.plot_epp, 'epp.dmp')
-
-    shutil.rmtree('scratch')
-    pop.write('final_pop', True)
     os.chdir(launch_dir)
     if ga_input.tar_output:
         logger.info('Compressing output.')
@@ -373,10 +486,21 @@ if __name__ == '__main__':
     ifile = abspath(args.input_file)
     ga_input = GAInput(ifile)
     rootlogger.setLevel(ga_input.logging_level)
-    logger.info('Loading molecules from any provided databases.')
-    dbs = []
-    for db in ga_input.databases:
-        dbs.append(GAPopulation.load(db, Molecule.from_dict))
-
-    for x in range(args.loops):
-        ga_run(ga_input)
+    set_up_workers(ga_input)
+
+    # All parallel operations share one pool of worker processes, so
+    # that the workers are only started once, however many runs are
+    # done. The pool is shut down at the end, even if a run fails.
+    with WorkerPool(ga_input.processes) as pool:
+        logger.info(f'Started {pool.processes} worker processes in '
+                    f'{pool.startup_time:.2f} s.')
+
+        logger.info('Loading molecules from any provided databases.')
+        dbs = []
+        for db in ga_input.databases:
+            dbs.append(GAPopulation.load(db,
+                                         Molecule.from_dict,
+                                         ga_input.processes))
+
+        for x in range(args.loops):
+            ga_run(ga_input)
@@ -1,2 +1,6 @@
 from .convenience_tools import *
 from .mplogging import *
+from .worker_pool import *
+from .program_runner import *
+from .waiting import *
+from .result_store import *
@@ -15,8 +15,9 @@ import os
 import subprocess as sp
 import gzip
 import re
-from collections import deque
+import heapq
 import tarfile
+import ast
 
 # Holds the elements Van der Waals radii in Angstroms.
 atom_vdw_radii = {
@@ -46,6 +47,10 @@ bond_dict = {'1': rdkit.rdchem.BondType.SINGLE,
              '3': rdkit.rdchem.BondType.TRIPLE,
              'ar': rdkit.rdchem.BondType.AROMATIC}
 
+# Names which :func:`eval_literal` may encounter in ``repr`` strings.
+_literal_names = {'nan': np.nan, 'inf': np.inf,
+                  'None': None, 'True': True, 'False': False}
+
 # A dictionary which matches atomic number to elemental symbols.
 periodic_table = {
               1: 'H', 2: 'He', 3: 'Li', 4: 'Be', 5: 'B', 6: 'C',
@@ -74,6 +79,11 @@ periodic_table = {
               117: 'Uus', 118: 'Uuo'}
 
 
+# The header of ``.mae`` files. It is followed by a "f_m_ct" block
+# for each structure in the file.
+MAE_HEADER = '{\n s_m_m2io_version\n :::\n 2.0.0\n}\n\n'
+
+
 class Cell:
     """
     Represents an individual cell in a supercell.
@@ -117,6 +127,19 @@ class MolFileError(Exception):
         self.msg = msg
 
 
+class AtomMismatchError(Exception):
+    def __init__(self, mol_file, msg):
+        self.mol_file = mol_file
+        self.msg = msg
+        super().__init__(f'{mol_file}: {msg}')
+
+
+class AtomTypeError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+        super().__init__(msg)
+
+
 class PopulationSizeError(Exception):
     def __init__(self, msg):
         self.msg = msg
@@ -186,16 +209,16 @@ class LazyAttr:
 
 class MAEExtractor:
     """
-    Extracts the lowest energy conformer from a .maegz file.
+    Extracts the lowest energy conformers from a .maegz file.
 
     Macromodel conformer searches produce -out.maegz files containing
     all of the conformers found during the search and their energies
     and other data.
 
     Initializing this class with a MacroMolecule finds that
-    MacroMolecules -out.maegz file and converts it to a .mae file. It
-    then creates and additional .mae file holding only the lowest
-    energy conformer found.
+    MacroMolecules -out.maegz file and reads it once, keeping only the
+    `n` lowest energy conformers in memory. By default, it then creates
+    a .mae file for each of them.
 
     Attributes
     ----------
@@ -204,59 +227,121 @@ class MAEExtractor:
         conformer search.
 
     mae_path : :class:`str`
-        The path to the ``.mae`` file holding the conformers generated by
-        the macromodel conformer search.
+        The path of the ``.mae`` file which the names of the files
+        holding the extracted conformers are based on.
 
-    content : :class:`str`
-        The content of the ``.mae`` file hodling all the conformers from
-        the macromodel conformer search. This holds other data such as
-        their energies too.
+    header : :class:`str`
+        The content of the ``-out.maegz`` file before the first
+        structure. It is written at the start of every extracted
+        ``.mae`` file.
 
     energies : :class:`list`
         The :class:`list` has the form
 
         .. code-block:: python
 
-            energies = [(0, 231.0), (1, 144.4), ...]
+            energies = [(231.0, 1), (144.4, 2), ...]
 
-        Each :class:`tuple` holds the id and energy of every conformer in the
+        Each :class:`tuple` holds the energy and id of every conformer in the
         ``.mae`` file, respectively.
 
     min_energy : :class:`float`
         The minimum energy found in the ``.mae`` file.
 
+    conformers : :class:`list` of :class:`tuple`
+        The extracted conformers, lowest energy first. Each
+        :class:`tuple` holds the energy and id of the conformer,
+        followed by a :class:`numpy.ndarray` of the atomic numbers and
+        an ``(n, 3)`` :class:`numpy.ndarray` of the coordinates of its
+        atoms.
+
     path : :class:`str`
         The full path of the ``.mae`` file holding the extracted lowest
-        energy conformer.
+        energy conformer. ``None`` if no files were written.
 
     """
 
-    def __init__(self, file, n=1):
+    def __init__(self, file, n=1, write=True):
+        """
+        Initializes a :class:`MAEExtractor`.
+
+        Parameters
+        ----------
+        file : :class:`str`
+            The path of the input file of the conformer search. The
+            ``-out.maegz`` file is found from it.
+
+        n : :class:`int`, optional
+            The number of lowest energy conformers to extract.
+
+        write : :class:`bool`, optional
+            If ``True``, a ``.mae`` file is written for each extracted
+            conformer. If ``False``, the conformers are only held in
+            :attr:`conformers`.
+
+        """
 
         name, ext = os.path.splitext(file)
         self.maegz_path = name + '-out.maegz'
-        self.maegz_to_mae()
-        self.extract_conformers(n)
+        self.mae_path = name + '-out.mae'
+        self.path = None
+        self.extract_conformers(n, write)
 
-    def extract_conformers(self, n):
+    def extract_conformers(self, n, write=True):
         """
-        Creates a series of ``.mae`` files holding the lowest energy conformers.
+        Extracts the `n` lowest energy conformers.
+
+        The ``-out.maegz`` file is read once. Only the `n` lowest energy
+        structure blocks found so far are kept, in a heap, so the
+        memory used does not depend on the number of conformers.
+
+        Parameters
+        ----------
+        n : :class:`int`
+            The number of lowest energy conformers to extract.
+
+        write : :class:`bool`, optional
+            If ``True``, a ``.mae`` file is written for each extracted
+            conformer.
+
+        Returns
+        -------
+        None : :class:`NoneType`
 
         """
 
-        for i in range(n):
-            # Get the id of the lowest energy conformer.
-            num = self.lowest_energy_conformers(n)[i][1]
-            # Get the structure block corresponding to the lowest energy
-            # conformer.
-            content = self.content.split("f_m_ct")
-            new_mae = "f_m_ct".join([content[0], content[num]])
+        blocks = _mae_blocks(self.maegz_path)
+        self.header = next(blocks)
 
-            # Write the structure block in its own .mae file, named after
-            # conformer extracted.
+        # The heap holds the negated energy and id of each kept
+        # conformer, so that the conformer with the highest energy is
+        # the one removed. Negating the id means that, of conformers
+        # with equal energies, the earlier ones are kept.
+        heap = []
+        self.energies = []
+        for index, block in enumerate(blocks, 1):
+            energy = self.extract_energy(block)
+            if energy is None:
+                continue
+            self.energies.append((energy, index))
+            if len(heap) < n:
+                heapq.heappush(heap, (-energy, -index, block))
+            elif -heap[0][0] > energy:
+                heapq.heapreplace(heap, (-energy, -index, block))
+
+        kept = sorted((-energy, -index, block) for
+                      energy, index, block in heap)
+        self.min_energy = kept[0][0]
+
+        self.conformers = []
+        for i, (energy, num, block) in enumerate(kept):
+            self.conformers.append((energy, num, *_mae_atoms(block)))
+            if not write:
+                continue
+
+            # Write the structure block in its own .mae file, named
+            # after conformer extracted.
             if n == 1:
-                # Write the structure block in its own .mae file, named after
-                # conformer extracted.
                 new_name = self.mae_path.replace(
                                             '.mae',
                                             'EXTRACTED_{}.mae'.format(num))
@@ -265,7 +350,7 @@ class MAEExtractor:
                               '.mae', 'EXTRACTED_{}_conf_{}.mae'.format(num, i))
 
             with open(new_name, 'w') as mae_file:
-                mae_file.write(new_mae)
+                mae_file.write(self.header + block)
 
             if i == 0:
                 # Save the path of the newly created file.
@@ -273,19 +358,27 @@ class MAEExtractor:
 
     def extract_energy(self, block):
         """
-        Extracts the energy value from a .mae energy data block.
+        Extracts the energy value from a "f_m_ct" block.
+
+        Parameters
+        ----------
+        block : :class:`str`
+            A "f_m_ct" block of a ``.mae`` file.
+
+        Returns
+        -------
+        :class:`float`
+            The potential energy of the structure. ``None`` if the
+            block holds no energy.
 
         """
 
-        block = block.split(":::")
-        for name, value in zip(block[0].split('\n'),
-                               block[1].split('\n')):
-            if 'r_mmod_Potential_Energy' in name:
-                return float(value)
+        energy = _mae_properties(block).get('r_mmod_Potential_Energy')
+        return None if energy is None else float(energy)
 
     def lowest_energy_conformers(self, n):
         """
-        Returns the id and energy of the lowest energy conformers.
+        Returns the energy and id of the lowest energy conformers.
 
         Parameters
         ----------
@@ -299,51 +392,24 @@ class MAEExtractor:
 
             .. code-block:: python
 
-                returned = [(23, 123.3), (1, 143.89), (12, 150.6), ...]
+                returned = [(123.3, 23), (143.89, 1), (150.6, 12), ...]
 
-            Where each :class:`tuple` holds the id and energy of the `n`
+            Where each :class:`tuple` holds the energy and id of the `n`
             lowest energy conformers, respectively
 
         """
 
-        # Open the .mae file holding all the conformers and load its
-        # content.
-        with open(self.mae_path, 'r') as mae_file:
-            self.content = mae_file.read()
-            # Split the content across curly braces. This divides the
-            # various sections of the .mae file.
-            content_split = re.split(r"[{}]", self.content)
-
-        # Go through all the datablocks in the the .mae file. For each
-        # energy block extract the energy and store it in the
-        # `energies` list. Store the `index`  (conformer id) along with
-        # each extracted energy.
-        self.energies = []
-        prev_block = deque([""], maxlen=1)
-        index = 1
-        for block in content_split:
-            if ("f_m_ct" in prev_block[0] and
-               "r_mmod_Potential_Energy" in block):
-                energy = self.extract_energy(block)
-                self.energies.append((energy, index))
-                index += 1
-
-            prev_block.append(block)
-
-        # Selecting the lowest energy n conformers
-        confs = sorted(self.energies)[:n]
-        # Define the energy of the lowest energy conformer
-        self.min_energy = confs[0][0]
-        # Return a list with id and energy of the lowest energy conformers.
-        return confs
+        return heapq.nsmallest(n, self.energies)
 
     def maegz_to_mae(self):
         """
         Converts the .maegz file to a .mae file.
 
+        This is not needed to extract conformers, which are read from
+        the ``-out.maegz`` file directly.
+
         """
 
-        self.mae_path = self.maegz_path.replace('.maegz', '.mae')
         with gzip.open(self.maegz_path, 'r') as maegz_file:
             with open(self.mae_path, 'wb') as mae_file:
                 mae_file.write(maegz_file.read())
@@ -478,6 +544,77 @@ def centroid(*coords):
     return np.divide(total, len(coords))
 
 
+def coords_from_mae_file(mae_path):
+    """
+    Reads the atomic numbers and coordinates in a ``.mae`` file.
+
+    This is a faster alternative to :func:`mol_from_mae_file` for
+    when the bonds are not needed, for example when updating the
+    coordinates of a molecule whose bonds have not changed. If the
+    file holds multiple structures, the last one is used.
+
+    Parameters
+    ----------
+    mae_path : :class:`str`
+        The full path of the ``.mae`` file. Compressed ``.maegz``
+        files are read too.
+
+    Returns
+    -------
+    :class:`tuple`
+        The first element is a :class:`numpy.ndarray` holding the
+        atomic number of every atom. The second element is a
+        :class:`numpy.ndarray` of shape ``(n, 3)`` holding the
+        coordinates of every atom.
+
+    Raises
+    ------
+    :class:`RuntimeError`
+        If the number of labels does not match the number of columns
+        in the file.
+
+    """
+
+    return _mae_atoms(_read_mae(mae_path))
+
+
+def coords_from_mol_file(mol_file):
+    """
+    Reads the atomic numbers and coordinates in a V3000 ``.mol`` file.
+
+    This is a faster alternative to :func:`mol_from_mol_file` for
+    when the bonds are not needed, for example when updating the
+    coordinates of a molecule whose bonds have not changed.
+
+    Parameters
+    ----------
+    mol_file : :class:`str`
+        The full path of the ``.mol`` file.
+
+    Returns
+    -------
+    :class:`tuple`
+        The first element is a :class:`numpy.ndarray` holding the
+        atomic number of every atom. The second element is a
+        :class:`numpy.ndarray` of shape ``(n, 3)`` holding the
+        coordinates of every atom.
+
+    Raises
+    ------
+    :class:`ChargedMolError`
+        If an atom has a charge.
+
+    :class:`MolFileError`
+        If the file is not a V3000 .mol file or an atom row does not
+        have 8 columns, for example because it sets other properties
+        of the atom.
+
+    """
+
+    with open(mol_file, 'r') as f:
+        return _mol_file_atoms(f.read(), mol_file)
+
+
 def dedupe(iterable, seen=None, key=None):
     """
     Yields items from `iterable` barring duplicates.
@@ -515,6 +652,87 @@ def dedupe(iterable, seen=None, key=None):
             yield x
 
 
+def eval_literal(expr):
+    """
+    Safely evaluates the ``repr`` of literals and ``numpy`` arrays.
+
+    This works like :func:`ast.literal_eval` but also accepts
+    ``array(...)`` calls, ``nan``, ``inf`` and ``numpy`` scalar calls
+    such as ``np.float64(1.0)``, which appear in the ``repr`` of
+    ``numpy`` objects. Nothing else is evaluated, so it is safe to use
+    on untrusted strings.
+
+    Parameters
+    ----------
+    expr : :class:`str` or :class:`ast.AST`
+        The string, or a node of its parsed expression, to evaluate.
+
+    Returns
+    -------
+    :class:`object`
+        The value represented by `expr`.
+
+    Raises
+    ------
+    :class:`ValueError`
+        If `expr` holds anything other than a literal.
+
+    """
+
+    if isinstance(expr, str):
+        expr = ast.parse(expr.strip(), mode='eval').body
+
+    if isinstance(expr, ast.Constant):
+        return expr.value
+
+    if isinstance(expr, ast.Tuple):
+        return tuple(eval_literal(x) for x in expr.elts)
+
+    if isinstance(expr, ast.List):
+        return [eval_literal(x) for x in expr.elts]
+
+    if isinstance(expr, ast.Set):
+        return {eval_literal(x) for x in expr.elts}
+
+    if isinstance(expr, ast.Dict):
+        return {eval_literal(key): eval_literal(val) for
+                key, val in zip(expr.keys, expr.values)}
+
+    if (isinstance(expr, ast.UnaryOp) and
+            isinstance(expr.op, (ast.USub, ast.UAdd))):
+        val = eval_literal(expr.operand)
+        return -val if isinstance(expr.op, ast.USub) else +val
+
+    if isinstance(expr, ast.Name) and expr.id in _literal_names:
+        return _literal_names[expr.id]
+
+    if isinstance(expr, ast.Call):
+        # Get the name of the called function, ignoring any module
+        # prefix such as ``np.`` or ``numpy.``.
+        if isinstance(expr.func, ast.Name):
+            name = expr.func.id
+        elif isinstance(expr.func, ast.Attribute):
+            name = expr.func.attr
+        else:
+            name = None
+
+        args = [eval_literal(x) for x in expr.args]
+        kwargs = {x.arg: (x.value.id if isinstance(x.value, ast.Name)
+                          else eval_literal(x.value)) for
+                  x in expr.keywords}
+
+        if name == 'array':
+            return np.array(*args, **kwargs)
+
+        if (name is not None and
+                name in np.sctypeDict and
+                not kwargs and
+                len(args) == 1):
+            return np.dtype(name).type(args[0])
+
+    raise ValueError(f'Unable to evaluate "{ast.dump(expr)}".')
+
+
 def flatten(iterable, excluded_types={str}):
     """
     Transforms an nested iterable into a flat one.
@@ -558,6 +776,39 @@ def flatten(iterable, excluded_types={str}):
             yield x
 
 
+def from_json_value(value):
+    """
+    Converts a value made by :func:`to_json_value` back.
+
+    Parameters
+    ----------
+    value : :class:`object`
+        A value made by :func:`to_json_value`, after it has been
+        through :func:`json.dump` and :func:`json.load`.
+
+    Returns
+    -------
+    :class:`object`
+        The value originally given to :func:`to_json_value`.
+
+    """
+
+    if isinstance(value, list):
+        return [from_json_value(x) for x in value]
+
+    if isinstance(value, dict):
+        if '__tuple__' in value:
+            return tuple(from_json_value(x) for x in value['__tuple__'])
+        if '__ndarray__' in value:
+            return np.array(value['__ndarray__'], dtype=value['dtype'])
+        if '__dict__' in value:
+            return {from_json_value(key): from_json_value(val) for
+                    key, val in value['__dict__']}
+        return {key: from_json_value(val) for key, val in value.items()}
+
+    return value
+
+
 def kabsch(coords1, coords2):
     """
     Return a rotation matrix to minimize dstance between 2 coord sets.
@@ -657,86 +908,37 @@ def mol_from_mae_file(mae_path):
     """
     Creates a rdkit molecule from a ``.mae`` file.
 
+    If the file holds multiple structures, the last one is used.
+
     Parameters
     ----------
-    mol2_file : str
+    mae_path : :class:`str`
         The full path of the ``.mae`` file from which an rdkit molecule
         should be instantiated.
 
     Returns
     -------
-    rdkit.Chem.rdchem.Mol
-        An rdkit instance of the molecule held in `mae_file`.
-
-    """
-
-    mol = rdkit.EditableMol(rdkit.Mol())
-    conf = rdkit.Conformer()
-
-    with open(mae_path, 'r') as mae:
-        content = re.split(r'[{}]', mae.read())
-
-    prev_block = deque([''], maxlen=1)
-    for block in content:
-        if 'm_atom[' in prev_block[0]:
-            atom_block = block
-        if 'm_bond[' in prev_block[0]:
-            bond_block = block
-        prev_block.append(block)
-
-    labels, data_block, *_ = atom_block.split(':::')
-    labels = [l for l in labels.split('\n') if
-              not l.isspace() and l != '']
-
-    data_block = [a.split() for a in data_block.split('\n') if
-                  not a.isspace() and a != '']
-
-    for line in data_block:
-        line = [word for word in line if word != '"']
-        if len(labels) != len(line):
-            raise RuntimeError(('Number of labels does'
-                                ' not match number of columns'
-                                ' in .mae file.'))
-
-        for label, data in zip(labels, line):
-            if 'x_coord' in label:
-                x = float(data)
-            if 'y_coord' in label:
-                y = float(data)
-            if 'z_coord' in label:
-                z = float(data)
-            if 'atomic_number' in label:
-                atom_num = int(data)
-
-        atom_sym = periodic_table[atom_num]
-        atom_coord = Point3D(x, y, z)
-        atom_id = mol.AddAtom(rdkit.Atom(atom_sym))
-        conf.SetAtomPosition(atom_id, atom_coord)
-
-    labels, data_block, *_ = bond_block.split(':::')
-    labels = [l for l in
-              labels.split('\n') if not l.isspace() and l != '']
-    data_block = [a.split() for a in
-                  data_block.split('\n') if not a.isspace() and a != '']
-
-    for line in data_block:
-        if len(labels) != len(line):
-            raise RuntimeError(('Number of labels does'
-                                ' not match number of '
-                                'columns in .mae file.'))
-
-        for label, data in zip(labels, line):
-            if 'from' in label:
-                atom1 = int(data) - 1
-            if 'to' in label:
-                atom2 = int(data) - 1
-            if 'order' in label:
-                bond_order = str(int(data))
-        mol.AddBond(atom1, atom2, bond_dict[bond_order])
+    :class:`rdkit.Chem.rdchem.Mol`
+        An rdkit instance of the molecule held in `mae_path`.
 
-    mol = mol.GetMol()
-    mol.AddConformer(conf)
-    return mol
+    Raises
+    ------
+    :class:`RuntimeError`
+        If the number of labels does not match the number of columns
+        in the file.
+
+    """
+
+    content = _read_mae(mae_path)
+    atomic_nums, coords = _mae_atoms(content)
+
+    labels, data = _mae_table(content, 'm_bond')
+    bonds = data[:, [labels.index('i_m_from'),
+                     labels.index('i_m_to'),
+                     labels.index('i_m_order')]].astype(int)
+    bonds[:, :2] -= 1
+
+    return _make_mol(atomic_nums, coords, bonds)
 
 
 def mol_from_mol_file(mol_file):
@@ -745,79 +947,41 @@ def mol_from_mol_file(mol_file):
 
     Parameters
     ----------
-    mol_file : str
+    mol_file : :class:`str`
         The full of the .mol file from which an rdkit molecule should
         be instantiated.
 
     Returns
     -------
-    rdkit.Chem.rdchem.Mol
-        An rdkit instance of the molecule held in `mol2_file`.
+    :class:`rdkit.Chem.rdchem.Mol`
+        An rdkit instance of the molecule held in `mol_file`.
 
     Raises
     ------
-    ChargedMolError
-        If an atom row has more than 8 coloumns it is usually because
-        there is a 9th coloumn indicating atomic charge. Such molecules
-        are not currently supported, so an error is raised.
-    MolFileError
-        If the file is not a V3000 .mol file.
+    :class:`ChargedMolError`
+        If an atom has a charge. Such molecules are not currently
+        supported, so an error is raised.
 
-    """
+    :class:`MolFileError`
+        If the file is not a V3000 .mol file, an atom row does not
+        have 8 columns, for example because it sets other properties
+        of the atom, or a bond row does not have 6 columns.
 
-    e_mol = rdkit.EditableMol(rdkit.Mol())
-    conf = rdkit.Conformer()
+    """
 
     with open(mol_file, 'r') as f:
-        take_atom = False
-        take_bond = False
-        v3000 = False
-
-        for line in f:
-            if 'V3000' in line:
-                v3000 = True
-
-            if 'M  V30 BEGIN ATOM' in line:
-                take_atom = True
-                continue
-
-            if 'M  V30 END ATOM' in line:
-                take_atom = False
-                continue
-
-            if 'M  V30 BEGIN BOND' in line:
-                take_bond = True
-                continue
-
-            if 'M  V30 END BOND' in line:
-                take_bond = False
-                continue
+        content = f.read()
 
-            if take_atom:
-                words = line.split()
-                if len(words) > 8:
-                    raise ChargedMolError(mol_file,
-                                          ('Atom row has more'
-                                           ' than 8 coloumns. Likely '
-                                           'due to a charged atom.'))
-                _, _, _, atom_sym, *coords, _ = words
-                coords = [float(x) for x in coords]
-                atom_coord = Point3D(*coords)
-                atom_id = e_mol.AddAtom(rdkit.Atom(atom_sym))
-                conf.SetAtomPosition(atom_id, atom_coord)
-                continue
+    atomic_nums, coords = _mol_file_atoms(content, mol_file)
 
-            if take_bond:
-                *_, bond_id,  bond_order, atom1, atom2 = line.split()
-                e_mol.AddBond(int(atom1)-1, int(atom2)-1,
-                              bond_dict[bond_order])
-                continue
-    if not v3000:
-        raise MolFileError(mol_file, 'Not a V3000 .mol file.')
+    # Each bond row has the form "M  V30 id order atom1 atom2".
+    words = _mol_file_block(content, 'BOND').split()
+    if len(words) % 6:
+        raise MolFileError(mol_file, 'Bond rows must have 6 columns.')
+    bonds = np.array(words).reshape(-1, 6)[:, [4, 5, 3]].astype(int)
+    bonds[:, :2] -= 1
 
-    mol = e_mol.GetMol()
-    mol.AddConformer(conf)
-    return mol
+    return _make_mol(atomic_nums, coords, bonds)
 
 
 def normalize_vector(vector):
@@ -944,6 +1108,65 @@ def rotation_matrix_arbitrary_axis(angle, axis):
                      [e31, e32, e33]])
 
 
+def set_conformer_positions(conformer, positions):
+    """
+    Sets the positions of all atoms in a conformer at once.
+
+    Parameters
+    ----------
+    conformer : :class:`rdkit.Chem.rdchem.Conformer`
+        The conformer whose atom positions are set.
+
+    positions : :class:`numpy.ndarray`
+        An array of shape ``(n, 3)`` holding the new positions of the
+        atoms, ordered by atom id.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    positions = np.asarray(positions, dtype=np.float64)
+    # Older versions of rdkit cannot set all positions in one call.
+    if hasattr(conformer, 'SetPositions'):
+        conformer.SetPositions(positions)
+    else:
+        for atom_id, position in enumerate(positions.tolist()):
+            conformer.SetAtomPosition(atom_id, Point3D(*position))
+
+
+def structures_from_mae_file(mae_path):
+    """
+    Reads every structure in a multi-structure ``.mae`` file.
+
+    Parameters
+    ----------
+    mae_path : :class:`str`
+        The full path of the ``.mae`` file.
+
+    Returns
+    -------
+    :class:`list` of :class:`tuple`
+        A :class:`tuple` for each structure, in the order of the
+        file. Each holds a :class:`dict` of the properties of the
+        structure, such as ``'s_m_title'``, followed by the atomic
+        numbers and the coordinates of its atoms, as returned by
+        :func:`coords_from_mae_file`.
+
+    """
+
+    content = _read_mae(mae_path)
+
+    # Each structure is held in a "f_m_ct" block, which holds the
+    # properties of the structure followed by its atom and bond
+    # blocks.
+    structures = []
+    for block in content.split('f_m_ct')[1:]:
+        structures.append((_mae_properties(block), *_mae_atoms(block)))
+    return structures
+
+
 def tar_output():
     """
     Places all the content in the `output` folder into a .tgz file.
@@ -985,6 +1208,65 @@ def time_it():
                                                     int(h), int(m), s))
 
 
+def to_json_value(value):
+    """
+    Converts a value into one which can be written as JSON.
+
+    Unlike writing the ``repr`` of `value`, the converted value can be
+    loaded back with :func:`from_json_value` without using
+    :func:`eval`. :class:`tuple`, ``numpy`` arrays and :class:`dict`
+    with non-:class:`str` keys are tagged so that they are restored
+    with the correct type.
+
+    Parameters
+    ----------
+    value : :class:`object`
+        A value made of ``None``, :class:`bool`, :class:`int`,
+        :class:`float`, :class:`str`, :class:`list`, :class:`tuple`,
+        :class:`dict` and ``numpy`` arrays or scalars.
+
+    Returns
+    -------
+    :class:`object`
+        A value which can be given to :func:`json.dump`.
+
+    Raises
+    ------
+    :class:`TypeError`
+        If `value` holds an object which cannot be converted.
+
+    """
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    if isinstance(value, list):
+        return [to_json_value(x) for x in value]
+
+    if isinstance(value, tuple):
+        return {'__tuple__': [to_json_value(x) for x in value]}
+
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(),
+                'dtype': value.dtype.str}
+
+    if isinstance(value, dict):
+        # Dicts with keys which are not strings or which could be
+        # confused with a tag are stored as a list of pairs.
+        if all(isinstance(key, str) and not key.startswith('__') for
+               key in value):
+            return {key: to_json_value(val) for
+                    key, val in value.items()}
+        return {'__dict__': [[to_json_value(key), to_json_value(val)]
+                             for key, val in value.items()]}
+
+    raise TypeError(('Unable to convert object of type '
+                     f'"{value.__class__.__name__}" to JSON.'))
+
+
 def vector_theta(vector1, vector2):
     """
     Returns the angle between two vectors in radians.
@@ -1012,3 +1294,293 @@ def vector_theta(vector1, vector2):
     if np.isclose(numerator, denominator, atol=1e-8):
         return 0.0
     return np.arccos(numerator/denominator)
+
+
+def _mae_atoms(content):
+    """
+    Reads the atomic numbers and coordinates in ``.mae`` content.
+
+    Parameters
+    ----------
+    content : :class:`str`
+        The content of a ``.mae`` file.
+
+    Returns
+    -------
+    :class:`tuple`
+        The atomic numbers and an ``(n, 3)`` array of coordinates.
+
+    """
+
+    labels, data = _mae_table(content, 'm_atom')
+    atomic_nums = data[:, labels.index('i_m_atomic_number')].astype(int)
+    coords = data[:, [labels.index('r_m_x_coord'),
+                      labels.index('r_m_y_coord'),
+                      labels.index('r_m_z_coord')]].astype(np.float64)
+    return atomic_nums, coords
+
+
+def _read_mae(mae_path):
+    """
+    Returns the content of a ``.mae`` or ``.maegz`` file.
+
+    ``.maegz`` files, written by MacroModel, are decompressed in
+    memory, so no conversion with ``structconvert`` is needed.
+
+    Parameters
+    ----------
+    mae_path : :class:`str`
+        The full path of the file.
+
+    Returns
+    -------
+    :class:`str`
+        The content of the file.
+
+    """
+
+    with open(mae_path, 'rb') as mae:
+        content = mae.read()
+
+    # Compressed files are recognized by their content rather than
+    # their extension.
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    return content.decode()
+
+
+def _mae_blocks(mae_path):
+    """
+    Yields the structure blocks of a ``.mae`` or ``.maegz`` file.
+
+    The file is read line by line, so that only one block is held in
+    memory at a time.
+
+    Parameters
+    ----------
+    mae_path : :class:`str`
+        The full path of the file.
+
+    Yields
+    ------
+    :class:`str`
+        First the content of the file before the first structure,
+        then each "f_m_ct" block of the file, in order.
+
+    """
+
+    with open(mae_path, 'rb') as mae:
+        compressed = mae.read(2) == b'\x1f\x8b'
+
+    opener = gzip.open if compressed else open
+    with opener(mae_path, 'rt') as mae:
+        lines = []
+        for line in mae:
+            # Each structure block starts on a new line.
+            if line.startswith('f_m_ct'):
+                yield ''.join(lines)
+                lines = []
+            lines.append(line)
+        yield ''.join(lines)
+
+
+def _mae_properties(content):
+    """
+    Reads the properties at the start of a "f_m_ct" block.
+
+    Parameters
+    ----------
+    content : :class:`str`
+        The content of a "f_m_ct" block, starting after its name.
+
+    Returns
+    -------
+    :class:`dict`
+        Maps the label of each property to its value, as a
+        :class:`str`. Quotes around strings are removed.
+
+    """
+
+    start = content.index('{') + 1
+    labels, data = content[start:].split(':::', 2)[:2]
+    labels = [label.strip() for label in labels.split('\n') if
+              label.strip() and not label.strip().startswith('#')]
+    # Quoted strings can hold spaces, so they are kept as one token.
+    # Only the first tokens are values of properties, the rest belong
+    # to the blocks which follow.
+    tokens = re.findall(r'"[^"]*"|\S+', data)[:len(labels)]
+    return {label: token.strip('"') for
+            label, token in zip(labels, tokens)}
+
+
+def _mae_table(content, block_name):
+    """
+    Tokenizes the last `block_name` block in ``.mae`` content.
+
+    Parameters
+    ----------
+    content : :class:`str`
+        The content of a ``.mae`` file.
+
+    block_name : :class:`str`
+        The name of the block, for example ``'m_atom'``.
+
+    Returns
+    -------
+    :class:`tuple`
+        The first element is a :class:`list` of the column labels of
+        the block. The second element is a :class:`numpy.ndarray` of
+        strings, holding a row for each row in the block.
+
+    Raises
+    ------
+    :class:`RuntimeError`
+        If the block is missing or if the number of labels does not
+        match the number of columns in the block.
+
+    """
+
+    start = content.rfind(block_name + '[')
+    if start == -1:
+        raise RuntimeError(f'No "{block_name}" block in .mae file.')
+
+    num_rows = int(content[start+len(block_name)+1:
+                           content.index(']', start)])
+    block_start = content.index('{', start) + 1
+    block = content[block_start:content.index('}', block_start)]
+
+    labels, data, *_ = block.split(':::')
+    labels = [label.strip() for label in labels.split('\n') if
+              label.strip()]
+    # Quoted strings can hold spaces, so they are kept as one token.
+    tokens = re.findall(r'"[^"]*"|\S+', data)
+
+    if len(tokens) != num_rows*len(labels):
+        raise RuntimeError(('Number of labels does'
+                            ' not match number of columns'
+                            ' in .mae file.'))
+
+    return labels, np.array(tokens).reshape(num_rows, len(labels))
+
+
+def _make_mol(atomic_nums, coords, bonds):
+    """
+    Creates a rdkit molecule from atom and bond arrays.
+
+    Parameters
+    ----------
+    atomic_nums : :class:`numpy.ndarray`
+        The atomic number of every atom.
+
+    coords : :class:`numpy.ndarray`
+        An ``(n, 3)`` array holding the coordinates of every atom.
+
+    bonds : :class:`numpy.ndarray`
+        An ``(m, 3)`` array where each row holds the ids of the two
+        bonded atoms and the integer bond order.
+
+    Returns
+    -------
+    :class:`rdkit.Chem.rdchem.Mol`
+        The molecule.
+
+    """
+
+    mol = rdkit.RWMol()
+    for atomic_num in atomic_nums.tolist():
+        mol.AddAtom(rdkit.Atom(atomic_num))
+    for atom1, atom2, order in bonds.tolist():
+        mol.AddBond(atom1, atom2, bond_dict[str(order)])
+
+    mol = mol.GetMol()
+    conf = rdkit.Conformer(len(atomic_nums))
+    set_conformer_positions(conf, coords)
+    mol.AddConformer(conf)
+    return mol
+
+
+def _mol_file_atoms(content, mol_file):
+    """
+    Reads the atomic numbers and coordinates in V3000 ``.mol`` content.
+
+    Parameters
+    ----------
+    content : :class:`str`
+        The content of a ``.mol`` file.
+
+    mol_file : :class:`str`
+        The path of the file, used in error messages.
+
+    Returns
+    -------
+    :class:`tuple`
+        The atomic numbers and an ``(n, 3)`` array of coordinates.
+
+    Raises
+    ------
+    :class:`ChargedMolError`
+        If an atom has a charge.
+
+    :class:`MolFileError`
+        If the file is not a V3000 .mol file or an atom row does not
+        have 8 columns, for example because it sets other properties
+        of the atom.
+
+    """
+
+    if 'V3000' not in content:
+        raise MolFileError(mol_file, 'Not a V3000 .mol file.')
+
+    block = _mol_file_block(content, 'ATOM')
+    # Each atom row has the form "M  V30 id symbol x y z 0".
+    words = block.split()
+    if len(words) != 8*block.count('\n'):
+        # Find the row at fault, so that the error names it.
+        for row in block.splitlines():
+            columns = row.split()
+            if len(columns) == 8:
+                continue
+            if any(x.startswith('CHG=') for x in columns[8:]):
+                raise ChargedMolError(
+                            mol_file,
+                            f'Atom row "{row.strip()}" has a charge.')
+            raise MolFileError(
+                        mol_file,
+                        f'Atom row "{row.strip()}" does not have 8 '
+                        'columns.')
+
+    table = np.array(words).reshape(-1, 8)
+    pt = rdkit.GetPeriodicTable()
+    symbols, indices = np.unique(table[:, 3], return_inverse=True)
+    atomic_nums = np.array([pt.GetAtomicNumber(str(x)) for
+                            x in symbols], dtype=int)[indices]
+    return atomic_nums, table[:, 4:7].astype(np.float64)
+
+
+def _mol_file_block(content, block_name):
+    """
+    Returns the rows of a block in V3000 ``.mol`` content.
+
+    Parameters
+    ----------
+    content : :class:`str`
+        The content of a ``.mol`` file.
+
+    block_name : :class:`str`
+        Either ``'ATOM'`` or ``'BOND'``.
+
+    Returns
+    -------
+    :class:`str`
+        The rows between the ``BEGIN`` and ``END`` lines of the block.
+        Empty if the block is missing.
+
+    """
+
+    start = content.find(f'M  V30 BEGIN {block_name}')
+    if start == -1:
+        return ''
+    # The rows start on the line after the BEGIN line.
+    start = content.index('\n', start) + 1
+    return content[start:content.index(f'M  V30 END {block_name}',
+                                       start)]
@@ -0,0 +1,522 @@
+"""
+Defines tools for running external programs, such as ``bmin``.
+
+External programs are run by an :mod:`asyncio` event loop, which runs
+in a background thread of the process. Code which needs a program to
+be run calls :func:`run_program`, which hands the program to the event
+loop and waits for it to finish. Waiting does not use the event loop,
+so one process can drive many programs at the same time by calling
+:func:`run_program` from many threads. For example, many MacroModel
+optimizations can be run at once by a single process, rather than
+by one Python process per optimization, each holding its own copy of
+the population.
+
+The number of programs of a kind which may run at the same time is set
+with :func:`set_program_limit`. For example, to make sure that no more
+than 8 MacroModel jobs run at a time
+
+.. code-block:: python
+
+    set_program_limit('macromodel', 8)
+    run_program([bmin, file_root, '-WAIT', '-LOCAL'],
+                group='macromodel')
+
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProgramResult:
+    """
+    The outcome of running an external program.
+
+    Attributes
+    ----------
+    args : :class:`list` of :class:`str`
+        The command which was run.
+
+    returncode : :class:`int`
+        The exit code of the program.
+
+    stdout : :class:`str`
+        The output of the program, with stderr merged in.
+
+    timed_out : :class:`bool`
+        ``True`` if the program was stopped because it ran for longer
+        than its timeout.
+
+    """
+
+    __slots__ = ['args', 'returncode', 'stdout', 'timed_out']
+
+    def __init__(self, args, returncode, stdout, timed_out):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.timed_out = timed_out
+
+    def __repr__(self):
+        return (f'ProgramResult(args={self.args!r}, '
+                f'returncode={self.returncode!r}, '
+                f'timed_out={self.timed_out!r})')
+
+
+class ProgramRunner:
+    """
+    Runs external programs on an event loop in a background thread.
+
+    Attributes
+    ----------
+    limits : :class:`dict`
+        Maps the name of a group of programs to the maximum number of
+        programs in that group which may run at the same time.
+
+    """
+
+    def __init__(self):
+        self.limits = {}
+        self._loop = None
+        self._thread = None
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the event loop, if it is not running.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._loop = asyncio.new_event_loop()
+            # Semaphores belong to the loop they are used on.
+            self._semaphores = {}
+            self._thread = threading.Thread(target=self._loop.run_forever,
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the event loop, killing any programs still running.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        with self._lock:
+            if self._thread is None:
+                return
+            self.cancel_all()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._thread = None
+
+    def set_limit(self, group, limit):
+        """
+        Sets how many programs in `group` may run at the same time.
+
+        The limit applies to programs started after it is set.
+
+        Parameters
+        ----------
+        group : :class:`str`
+            The name of a group of programs.
+
+        limit : :class:`int`
+            The maximum number of programs in `group` which may run at
+            the same time.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self.limits[group] = limit
+        self._semaphores.pop(group, None)
+
+    def submit(self,
+               cmd,
+               timeout=None,
+               group=None,
+               stop=None,
+               grace=0):
+        """
+        Starts running a program.
+
+        Parameters
+        ----------
+        cmd : :class:`list` of :class:`str`
+            The program and its arguments.
+
+        timeout : :class:`float`, optional
+            The number of seconds the program may run for. ``None``
+            means there is no timeout.
+
+        group : :class:`str`, optional
+            The name of the group the program belongs to. If a limit
+            is set for the group, the program waits until it can run
+            without breaking the limit.
+
+        stop : :class:`callable`, optional
+            Called, in a separate thread, to ask the program to stop
+            if it runs past `timeout`. If the program is still running
+            `grace` seconds later, or if `stop` is ``None``, the
+            program and any programs it started are killed.
+
+        grace : :class:`float`, optional
+            The number of seconds the program has to exit after `stop`
+            is called.
+
+        Returns
+        -------
+        :class:`concurrent.futures.Future`
+            Holds the :class:`ProgramResult` once the program exits.
+
+        """
+
+        self.start()
+        return asyncio.run_coroutine_threadsafe(
+                        self._run(cmd, timeout, group, stop, grace),
+                        self._loop)
+
+    def run(self, cmd, timeout=None, group=None, stop=None, grace=0):
+        """
+        Runs a program and waits for it to exit.
+
+        Parameters
+        ----------
+        cmd : :class:`list` of :class:`str`
+            The program and its arguments.
+
+        timeout : :class:`float`, optional
+            The number of seconds the program may run for. ``None``
+            means there is no timeout.
+
+        group : :class:`str`, optional
+            The name of the group the program belongs to.
+
+        stop : :class:`callable`, optional
+            Asks the program to stop if it runs past `timeout`.
+
+        grace : :class:`float`, optional
+            The number of seconds the program has to exit after `stop`
+            is called.
+
+        Returns
+        -------
+        :class:`ProgramResult`
+            The outcome of running the program.
+
+        Raises
+        ------
+        :class:`FileNotFoundError`
+            If the program does not exist.
+
+        """
+
+        future = self.submit(cmd, timeout, group, stop, grace)
+        try:
+            return future.result()
+        # If the caller is interrupted, do not leave the program
+        # running.
+        except BaseException:
+            future.cancel()
+            raise
+
+    def cancel_all(self):
+        """
+        Cancels every program which is running or waiting to run.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        def cancel():
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(cancel)
+
+    async def _run(self, cmd, timeout, group, stop, grace):
+        """
+        Runs a program on the event loop.
+
+        Parameters
+        ----------
+        cmd : :class:`list` of :class:`str`
+            The program and its arguments.
+
+        timeout : :class:`float`
+            The number of seconds the program may run for. ``None``
+            means there is no timeout.
+
+        group : :class:`str`
+            The name of the group the program belongs to.
+
+        stop : :class:`callable`
+            Asks the program to stop if it runs past `timeout`.
+
+        grace : :class:`float`
+            The number of seconds the program has to exit after `stop`
+            is called.
+
+        Returns
+        -------
+        :class:`ProgramResult`
+            The outcome of running the program.
+
+        """
+
+        semaphore = self._semaphore(group)
+        if semaphore is None:
+            return await self._run_program(cmd, timeout, stop, grace)
+
+        async with semaphore:
+            return await self._run_program(cmd, timeout, stop, grace)
+
+    async def _run_program(self, cmd, timeout, stop, grace):
+        """
+        Runs a program on the event loop, ignoring group limits.
+
+        Parameters
+        ----------
+        cmd : :class:`list` of :class:`str`
+            The program and its arguments.
+
+        timeout : :class:`float`
+            The number of seconds the program may run for. ``None``
+            means there is no timeout.
+
+        stop : :class:`callable`
+            Asks the program to stop if it runs past `timeout`.
+
+        grace : :class:`float`
+            The number of seconds the program has to exit after `stop`
+            is called.
+
+        Returns
+        -------
+        :class:`ProgramResult`
+            The outcome of running the program.
+
+        """
+
+        # The program is started in a new session, so that it and any
+        # programs it starts can be killed together.
+        proc = await asyncio.create_subprocess_exec(
+                                    *cmd,
+                                    stdout=asyncio.subprocess.PIPE,
+                                    stderr=asyncio.subprocess.STDOUT,
+                                    start_new_session=True)
+        # Reading the output in a separate task means it is not lost
+        # if the program times out.
+        chunks = []
+        reader = asyncio.ensure_future(self._read(proc.stdout, chunks))
+        timed_out = False
+
+        try:
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                logger.warning(f'"{cmd[0]}" ran for more than '
+                               f'{timeout} s and was stopped.')
+                await self._stop(proc, stop, grace)
+            await reader
+
+        except asyncio.CancelledError:
+            self._kill(proc)
+            await proc.wait()
+            reader.cancel()
+            raise
+
+        stdout = b''.join(chunks).decode(errors='replace')
+        return ProgramResult(cmd, proc.returncode, stdout, timed_out)
+
+    async def _stop(self, proc, stop, grace):
+        """
+        Stops a program which ran past its timeout.
+
+        Parameters
+        ----------
+        proc : :class:`asyncio.subprocess.Process`
+            The program.
+
+        stop : :class:`callable`
+            Asks the program to stop. If ``None``, the program is
+            killed straight away.
+
+        grace : :class:`float`
+            The number of seconds the program has to exit after `stop`
+            is called.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        if stop is not None:
+            await self._loop.run_in_executor(None, stop)
+            try:
+                await asyncio.wait_for(proc.wait(), grace)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        self._kill(proc)
+        await proc.wait()
+
+    @staticmethod
+    async def _read(stream, chunks):
+        """
+        Reads `stream` into `chunks` until it closes.
+
+        Parameters
+        ----------
+        stream : :class:`asyncio.StreamReader`
+            The output of a program.
+
+        chunks : :class:`list` of :class:`bytes`
+            The output read so far.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    @staticmethod
+    def _kill(proc):
+        """
+        Kills a program and any programs it started.
+
+        Parameters
+        ----------
+        proc : :class:`asyncio.subprocess.Process`
+            The program.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _semaphore(self, group):
+        """
+        Returns the semaphore which limits the programs in `group`.
+
+        Parameters
+        ----------
+        group : :class:`str`
+            The name of a group of programs.
+
+        Returns
+        -------
+        :class:`asyncio.Semaphore`
+            The semaphore, or ``None`` if `group` has no limit.
+
+        """
+
+        if group not in self.limits:
+            return None
+        if group not in self._semaphores:
+            self._semaphores[group] = asyncio.Semaphore(
+                                                    self.limits[group])
+        return self._semaphores[group]
+
+
+# The runner used by :func:`run_program`. Each process has its own.
+_runner = ProgramRunner()
+
+
+def run_program(cmd, timeout=None, group=None, stop=None, grace=0):
+    """
+    Runs an external program and waits for it to exit.
+
+    Can be called from many threads at the same time. See
+    :meth:`ProgramRunner.run`.
+
+    Parameters
+    ----------
+    cmd : :class:`list` of :class:`str`
+        The program and its arguments.
+
+    timeout : :class:`float`, optional
+        The number of seconds the program may run for. ``None`` means
+        there is no timeout.
+
+    group : :class:`str`, optional
+        The name of the group the program belongs to. Used to limit
+        the number of programs running at the same time, see
+        :func:`set_program_limit`.
+
+    stop : :class:`callable`, optional
+        Called to ask the program to stop if it runs past `timeout`.
+        If ``None``, the program is killed.
+
+    grace : :class:`float`, optional
+        The number of seconds the program has to exit after `stop` is
+        called, before it is killed.
+
+    Returns
+    -------
+    :class:`ProgramResult`
+        The outcome of running the program.
+
+    """
+
+    return _runner.run(cmd, timeout, group, stop, grace)
+
+
+def set_program_limit(group, limit):
+    """
+    Sets how many programs in `group` may run at the same time.
+
+    Parameters
+    ----------
+    group : :class:`str`
+        The name of a group of programs, such as ``'macromodel'``.
+
+    limit : :class:`int`
+        The maximum number of programs in `group` which may run at the
+        same time in this process.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    _runner.set_limit(group, limit)
@@ -0,0 +1,287 @@
+"""
+Defines :class:`ResultStore`, an on-disk cache of results.
+
+Expensive results, such as optimized structures, are kept in a
+directory so that they can be reused by later runs and by other
+processes. Each result is stored in its own file, named after the
+hash of its key. Files are written to a temporary name and then
+renamed, so a result is either fully written or absent, even if many
+processes write to the store at the same time.
+
+If the store grows beyond its size limit, the results which have not
+been used for the longest time are deleted.
+
+.. code-block:: python
+
+    store = ResultStore('/home/user/stk_cache', max_size=10e9)
+    key = store.key(mol.key, 'macromodel_opt', coords)
+    result = store.get(key)
+    if result is None:
+        result = optimize(mol)
+        store.put(key, result)
+
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResultStore:
+    """
+    An on-disk, content-addressed cache of results.
+
+    Attributes
+    ----------
+    path : :class:`str`
+        The directory holding the results.
+
+    max_size : :class:`int`
+        The maximum total size of the results, in bytes. ``None`` if
+        there is no limit.
+
+    """
+
+    def __init__(self, path, max_size=None):
+        """
+        Initializes a :class:`ResultStore`.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The directory holding the results. It is created if it
+            does not exist.
+
+        max_size : :class:`int`, optional
+            The maximum total size of the results, in bytes. If
+            ``None``, there is no limit.
+
+        """
+
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        # An estimate of the size of the store. It is found by
+        # scanning the store when it is first needed and only updated
+        # by this process afterwards.
+        self._size = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def __getstate__(self):
+        # The size estimate is not valid in other processes.
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.max_size = state['max_size']
+        self._size = None
+
+    @staticmethod
+    def key(*parts):
+        """
+        Creates a key from `parts`.
+
+        Parameters
+        ----------
+        *parts : :class:`object`
+            Objects identifying the result. Their :func:`repr` is
+            hashed, so it must be the same for equal objects.
+            :class:`bytes` are hashed as they are.
+
+        Returns
+        -------
+        :class:`str`
+            The key.
+
+        """
+
+        sha = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = repr(part).encode()
+            # The length separates the parts, so that moving bytes
+            # from one part to the next changes the key.
+            sha.update(len(part).to_bytes(8, 'little'))
+            sha.update(part)
+        return sha.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the result stored under `key`.
+
+        Parameters
+        ----------
+        key : :class:`str`
+            A key made by :meth:`key`.
+
+        Returns
+        -------
+        :class:`object`
+            The result, or ``None`` if no result is stored under
+            `key`.
+
+        """
+
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        # A file which is partially written, by a bug or a full disk,
+        # or which holds classes which have since changed, is treated
+        # as missing. Unpickling such files can raise almost any
+        # exception.
+        except Exception as ex:
+            logger.warning(f'Result "{path}" could not be read: {ex!r}')
+            return None
+
+        # Mark the result as recently used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Stores `result` under `key`.
+
+        Parameters
+        ----------
+        key : :class:`str`
+            A key made by :meth:`key`.
+
+        result : :class:`object`
+            A picklable result.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp_path)
+            # A result which is replaced no longer adds to the size.
+            try:
+                size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self.evict()
+
+    def evict(self, target=None):
+        """
+        Deletes the least recently used results.
+
+        Parameters
+        ----------
+        target : :class:`int`, optional
+            The size, in bytes, the store is reduced to. If ``None``,
+            90% of :attr:`max_size` is used, so that eviction does not
+            run on every :meth:`put`.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        if target is None:
+            target = 0.9*self.max_size
+
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= target:
+                break
+            # Another process may have deleted the file already.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        self._size = size
+
+    def _file(self, key):
+        """
+        Returns the path of the file holding the result of `key`.
+
+        Parameters
+        ----------
+        key : :class:`str`
+            A key made by :meth:`key`.
+
+        Returns
+        -------
+        :class:`str`
+            The path of the file.
+
+        """
+
+        # The files are split between subdirectories so that no
+        # directory holds too many files.
+        return os.path.join(self.path, key[:2], key + '.pkl')
+
+    def _files(self):
+        """
+        Yields the paths of all stored results.
+
+        Yields
+        ------
+        :class:`str`
+            The path of a file holding a result.
+
+        """
+
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.pkl'):
+                    yield os.path.join(directory, name)
+
+    def _scan_size(self):
+        """
+        Returns the total size of the stored results.
+
+        Returns
+        -------
+        :class:`int`
+            The size in bytes.
+
+        """
+
+        size = 0
+        for path in self._files():
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return size
@@ -0,0 +1,169 @@
+"""
+Defines tools for waiting on files written by external programs.
+
+On Linux, :func:`wait_for_file` sleeps until the kernel reports, via
+``inotify``, that the directory of the file has changed. On other
+systems it checks for the file at intervals, which start short and
+grow, so that waiting for a file which takes long to appear costs
+almost no CPU time.
+
+"""
+
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# inotify event flags, see ``man inotify``.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+def _load_libc():
+    """
+    Loads the C library, if it provides ``inotify``.
+
+    Returns
+    -------
+    :class:`ctypes.CDLL`
+        The C library. ``None`` if ``inotify`` is not available.
+
+    """
+
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def wait_for_file(path, timeout=10):
+    """
+    Waits until a file exists or `timeout` expires.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path of the file.
+
+    timeout : :class:`float`, optional
+        The maximum number of seconds to wait.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if the file exists.
+
+    """
+
+    if os.path.exists(path):
+        return True
+
+    deadline = time.monotonic() + timeout
+    if _libc is not None:
+        found = _wait_by_inotify(path, deadline)
+        if found is not None:
+            return found
+    return _wait_by_polling(path, deadline)
+
+
+def _wait_by_inotify(path, deadline):
+    """
+    Waits for a file using ``inotify``.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path of the file.
+
+    deadline : :class:`float`
+        The value of :func:`time.monotonic` at which to stop waiting.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if the file exists. ``None`` if ``inotify`` could not
+        be used.
+
+    """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+
+    try:
+        wd = _libc.inotify_add_watch(
+                        fd,
+                        os.fsencode(directory),
+                        _IN_CREATE | _IN_MOVED_TO | _IN_CLOSE_WRITE)
+        if wd < 0:
+            return None
+
+        # The file may have been made before the watch was added.
+        while not os.path.exists(path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if readable:
+                # Empty the queue of events. Which file the events are
+                # about does not matter, the path is checked anyway.
+                try:
+                    os.read(fd, 65536)
+                except BlockingIOError:
+                    pass
+        return True
+
+    finally:
+        os.close(fd)
+
+
+def _wait_by_polling(path, deadline, start=0.001, cap=0.5):
+    """
+    Waits for a file by checking for it at growing intervals.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The path of the file.
+
+    deadline : :class:`float`
+        The value of :func:`time.monotonic` at which to stop waiting.
+
+    start : :class:`float`, optional
+        The first interval, in seconds.
+
+    cap : :class:`float`, optional
+        The longest interval, in seconds.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if the file exists.
+
+    """
+
+    interval = start
+    while not os.path.exists(path):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(2*interval, cap)
+    return True
@@ -0,0 +1,710 @@
+"""
+Defines :class:`WorkerPool`, a process pool which is reused.
+
+Creating a ``spawn`` process pool is slow. Every worker process has to
+import the package, and with it ``rdkit``, ``scipy``, ``sklearn``,
+``networkx`` and ``matplotlib``, before it can do any work. When a new
+pool is made for every parallel operation, such as every optimization
+in every generation of the GA, this start up cost is paid again and
+again.
+
+A :class:`WorkerPool` is started once, for example at the beginning of
+a GA run, and its workers are then reused by every parallel operation
+until it is closed. While it is running it is held by
+:attr:`WorkerPool.active`. Code which needs a pool should get one from
+:func:`worker_pool`, which returns the active pool if there is one and
+otherwise a temporary pool which is closed once it is no longer
+needed.
+
+.. code-block:: python
+
+    with WorkerPool(processes=8):
+        # All parallel operations in here reuse the same 8 workers.
+        pop.optimize(func_data, 8)
+        pop.optimize(func_data, 8)
+
+Unlike :class:`multiprocessing.pool.Pool`, a :class:`WorkerPool`
+isolates tasks from each other. If a worker dies, for example because
+``rdkit`` segfaulted, or if a task runs for longer than its timeout,
+the worker and any programs it launched are killed and replaced by a
+new worker. The task is reported as a :class:`TaskFailure` and the
+remaining tasks carry on.
+
+"""
+
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import logging
+import time
+import importlib
+import os
+import traceback
+import psutil
+from threading import Thread
+from contextlib import contextmanager
+
+from .mplogging import logged_call, daemon_logger
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+        super().__init__(msg)
+
+
+class TaskFailure:
+    """
+    Reports a task which did not finish.
+
+    Attributes
+    ----------
+    args : :class:`tuple`
+        The arguments the task was given.
+
+    reason : :class:`str`
+        Why the task failed. Either the traceback of an exception
+        raised by the task, a note that the worker process died or a
+        note that the task timed out.
+
+    """
+
+    __slots__ = ['args', 'reason']
+
+    def __init__(self, args, reason):
+        self.args = args
+        self.reason = reason
+
+    def __repr__(self):
+        return f'TaskFailure(reason={self.reason!r})'
+
+
+class WorkerPool:
+    """
+    A pool of worker processes which is reused between operations.
+
+    Log messages emitted in the workers are passed back to the main
+    process and handled there.
+
+    Attributes
+    ----------
+    active : :class:`WorkerPool`
+        A class attribute holding the pool which is currently running.
+        ``None`` if no pool is running.
+
+    processes : :class:`int`
+        The number of worker processes.
+
+    startup_time : :class:`float`
+        The number of seconds it took to start the workers. ``None``
+        if the pool has not been started.
+
+    """
+
+    active = None
+
+    def __init__(self, processes=None):
+        """
+        Initializes a :class:`WorkerPool`.
+
+        The worker processes are not created until :meth:`start` is
+        called.
+
+        Parameters
+        ----------
+        processes : :class:`int`, optional
+            The number of worker processes. If ``None``, the number of
+            CPUs is used.
+
+        """
+
+        self.processes = (processes if processes is not None else
+                          psutil.cpu_count())
+        self.startup_time = None
+        self._workers = None
+        self._manager = None
+        self._log_queue = None
+        self._log_thread = None
+
+    def start(self):
+        """
+        Creates the worker processes.
+
+        The workers import the package as soon as they are created.
+        This method returns once the workers are ready to take tasks.
+        Once started, the pool becomes :attr:`active`.
+
+        Returns
+        -------
+        :class:`WorkerPool`
+            The pool.
+
+        """
+
+        if self._workers is not None:
+            return self
+
+        start = time.perf_counter()
+        self._manager = mp.Manager()
+        self._log_queue = self._manager.Queue()
+        self._log_thread = Thread(target=daemon_logger,
+                                  args=(self._log_queue, ))
+        self._log_thread.start()
+
+        self._workers = [_Worker(self._log_queue) for
+                         _ in range(self.processes)]
+        # Wait for the package imports to finish before the pool is
+        # used.
+        for worker in self._workers:
+            worker.wait_until_ready()
+
+        self.startup_time = time.perf_counter() - start
+        logger.debug(f'Started {self.processes} worker processes in '
+                     f'{self.startup_time:.2f} s.')
+
+        if WorkerPool.active is None:
+            WorkerPool.active = self
+        return self
+
+    def close(self):
+        """
+        Shuts the worker processes down.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self._shut_down(_Worker.stop)
+
+    def terminate(self):
+        """
+        Kills the worker processes immediately.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self._shut_down(_Worker.kill)
+
+    def _shut_down(self, stop):
+        """
+        Stops the workers and the logging thread.
+
+        Parameters
+        ----------
+        stop : :class:`function`
+            Takes a :class:`_Worker` and stops it.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        if self._workers is None:
+            return
+
+        for worker in self._workers:
+            stop(worker)
+        self._workers = None
+        self._log_queue.put(None)
+        self._log_thread.join()
+        self._manager.shutdown()
+
+        if WorkerPool.active is self:
+            WorkerPool.active = None
+
+    def map(self, func, iterable, chunksize=None, timeout=None):
+        """
+        Applies `func` to every item of `iterable` in the workers.
+
+        Parameters
+        ----------
+        func : :class:`callable`
+            A picklable callable.
+
+        iterable : :class:`iterable`
+            The arguments given to `func`.
+
+        chunksize : :class:`int`, optional
+            The number of items sent to a worker at a time.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds a chunk may take.
+
+        Returns
+        -------
+        :class:`list`
+            The results, in the order of `iterable`.
+
+        Raises
+        ------
+        :class:`WorkerError`
+            If any of the tasks fails.
+
+        """
+
+        return self.starmap(func,
+                            ((x, ) for x in iterable),
+                            chunksize,
+                            timeout)
+
+    def starmap(self, func, iterable, chunksize=None, timeout=None):
+        """
+        Like :meth:`map` but each item of `iterable` is unpacked.
+
+        Parameters
+        ----------
+        func : :class:`callable`
+            A picklable callable.
+
+        iterable : :class:`iterable` of :class:`tuple`
+            The arguments given to `func`.
+
+        chunksize : :class:`int`, optional
+            The number of items sent to a worker at a time. If
+            ``None``, the items are split into about 4 chunks per
+            worker.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds a chunk may take.
+
+        Returns
+        -------
+        :class:`list`
+            The results, in the order of `iterable`.
+
+        Raises
+        ------
+        :class:`WorkerError`
+            If any of the tasks fails.
+
+        """
+
+        items = list(iterable)
+        if chunksize is None:
+            chunksize = max(1, len(items) // (4*self.processes))
+
+        chunks = ((func, items[i:i+chunksize]) for
+                  i in range(0, len(items), chunksize))
+
+        results = []
+        for task_id, _, ok, value in self._run(_call_chunk,
+                                               chunks,
+                                               timeout):
+            if not ok:
+                raise WorkerError(value)
+            results.append((task_id, value))
+
+        results.sort(key=lambda x: x[0])
+        return [x for _, chunk in results for x in chunk]
+
+    def imap_unordered(self, func, iterable, timeout=None):
+        """
+        Like :meth:`starmap` but yields results as they finish.
+
+        Tasks are sent to the workers one at a time, in the order of
+        `iterable`, as workers become free. Failed tasks do not raise,
+        they are yielded as :class:`TaskFailure` instances.
+
+        Parameters
+        ----------
+        func : :class:`callable`
+            A picklable callable.
+
+        iterable : :class:`iterable` of :class:`tuple`
+            The arguments given to `func`.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds a task may take. This
+            includes the time taken by any programs the task runs.
+
+        Yields
+        ------
+        :class:`object`
+            The results, in the order in which they finish, or a
+            :class:`TaskFailure` for each task which failed.
+
+        """
+
+        for _, args, ok, value in self._run(func, iterable, timeout):
+            yield value if ok else TaskFailure(args, value)
+
+    def _run(self, func, iterable, timeout):
+        """
+        Runs tasks in the workers.
+
+        Parameters
+        ----------
+        func : :class:`callable`
+            A picklable callable.
+
+        iterable : :class:`iterable` of :class:`tuple`
+            The arguments given to `func`.
+
+        timeout : :class:`float`
+            The maximum number of seconds a task may take. ``None``
+            for no limit.
+
+        Yields
+        ------
+        :class:`tuple`
+            For each task, its id, which is its index in `iterable`,
+            its arguments, ``True`` if it finished or ``False`` if it
+            failed and finally its result or the reason it failed.
+
+        """
+
+        self.start()
+        # Workers keep the working directory they were started in, so
+        # send them the current one with every task.
+        cwd = os.getcwd()
+        tasks = enumerate(iterable)
+        idle = list(self._workers)
+        # Maps a busy worker to the id, arguments and deadline of its
+        # task.
+        running = {}
+
+        try:
+            while True:
+                # Give a task to every idle worker.
+                while idle:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    task_id, args = task
+                    worker = idle.pop()
+                    worker.send(task_id, cwd, func, args)
+                    deadline = (None if timeout is None else
+                                time.monotonic() + timeout)
+                    running[worker] = task_id, args, deadline
+
+                if not running:
+                    break
+
+                # Sleep until a worker finishes, dies or runs out of
+                # time.
+                deadlines = [d for *_, d in running.values() if
+                             d is not None]
+                wait([w.conn for w in running] +
+                     [w.process.sentinel for w in running],
+                     (max(0, min(deadlines)-time.monotonic()) if
+                      deadlines else None))
+
+                now = time.monotonic()
+                for worker in list(running):
+                    task_id, args, deadline = running[worker]
+                    # The pipe of a worker which died is closed
+                    # before the process is reaped, so the worker is
+                    # replaced as soon as either happens.
+                    try:
+                        result = worker.poll()
+                        died = False
+                    except (EOFError, OSError):
+                        result, died = None, True
+
+                    if result is not None:
+                        ok, value = result
+                    elif died or not worker.process.is_alive():
+                        worker.process.join(1)
+                        ok, value = False, (
+                            'Worker process died with exit code '
+                            f'{worker.process.exitcode}.')
+                    elif deadline is not None and now >= deadline:
+                        ok, value = False, f'Timed out after {timeout} s.'
+                    else:
+                        continue
+
+                    del running[worker]
+                    if result is None:
+                        logger.error(f'Task {task_id} failed. {value}')
+                        worker = self._replace(worker)
+                    idle.append(worker)
+                    yield task_id, args, ok, value
+
+        finally:
+            # If the caller stops early, workers still running tasks
+            # are replaced, so that their results are not picked up
+            # by a later call.
+            for worker in running:
+                self._replace(worker)
+
+    def _replace(self, worker):
+        """
+        Kills `worker` and replaces it with a new one.
+
+        Parameters
+        ----------
+        worker : :class:`_Worker`
+            The worker to replace.
+
+        Returns
+        -------
+        :class:`_Worker`
+            The new worker.
+
+        """
+
+        worker.kill()
+        new_worker = _Worker(self._log_queue)
+        new_worker.wait_until_ready()
+        self._workers[self._workers.index(worker)] = new_worker
+        return new_worker
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+class _Worker:
+    """
+    A worker process of a :class:`WorkerPool`.
+
+    Attributes
+    ----------
+    process : :class:`multiprocessing.Process`
+        The worker process.
+
+    conn : :class:`multiprocessing.connection.Connection`
+        The main process's end of the pipe to the worker.
+
+    """
+
+    def __init__(self, log_queue):
+        """
+        Starts a worker process.
+
+        Parameters
+        ----------
+        log_queue : :class:`multiprocessing.Queue`
+            The queue into which the worker sends log records.
+
+        """
+
+        ctx = mp.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(child_conn,
+                                         log_queue,
+                                         __name__.split('.')[0]),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def wait_until_ready(self):
+        """
+        Waits for the worker to finish importing the package.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self.conn.recv()
+
+    def send(self, task_id, cwd, func, args):
+        """
+        Sends a task to the worker.
+
+        Parameters
+        ----------
+        task_id : :class:`int`
+            The id of the task.
+
+        cwd : :class:`str`
+            The directory the task is run in.
+
+        func : :class:`callable`
+            The task.
+
+        args : :class:`tuple`
+            The arguments given to `func`.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self.conn.send((task_id, cwd, func, args))
+
+    def poll(self):
+        """
+        Returns the outcome of the task, if it finished.
+
+        Returns
+        -------
+        :class:`tuple`
+            ``(True, result)`` if the task finished or
+            ``(False, traceback)`` if it raised. ``None`` if the task
+            has not finished.
+
+        Raises
+        ------
+        :class:`EOFError`
+            If the worker died.
+
+        """
+
+        if self.conn.poll():
+            _, ok, value = self.conn.recv()
+            return ok, value
+        return None
+
+    def stop(self):
+        """
+        Asks the worker to exit and waits for it.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        """
+        Kills the worker and any programs it launched.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        try:
+            children = psutil.Process(self.process.pid).children(
+                                                        recursive=True)
+        except psutil.NoSuchProcess:
+            children = []
+
+        for child in children:
+            try:
+                child.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+@contextmanager
+def worker_pool(processes=None):
+    """
+    Provides a pool of worker processes.
+
+    If a :class:`WorkerPool` is :attr:`~WorkerPool.active`, it is
+    provided. Otherwise a temporary pool is created, which is closed
+    when the context exits.
+
+    Parameters
+    ----------
+    processes : :class:`int`, optional
+        The number of worker processes used if a temporary pool is
+        created. If ``None``, the number of CPUs is used.
+
+    Yields
+    ------
+    :class:`WorkerPool`
+        A running pool.
+
+    """
+
+    if WorkerPool.active is not None:
+        yield WorkerPool.active
+    else:
+        with WorkerPool(processes) as pool:
+            yield pool
+
+
+def _worker_main(conn, log_queue, package):
+    """
+    Runs the tasks sent to a worker process.
+
+    Parameters
+    ----------
+    conn : :class:`multiprocessing.connection.Connection`
+        The worker's end of the pipe to the main process.
+
+    log_queue : :class:`multiprocessing.Queue`
+        The queue into which log records are sent.
+
+    package : :class:`str`
+        The name of the package, which is imported before any task is
+        run.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # If the import fails, the tasks will raise the error themselves.
+    try:
+        importlib.import_module(package)
+    except Exception:
+        pass
+    conn.send('ready')
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        task_id, cwd, func, args = task
+        try:
+            if os.getcwd() != cwd:
+                os.chdir(cwd)
+            result = task_id, True, logged_call(log_queue, func, *args)
+        except Exception:
+            result = task_id, False, traceback.format_exc()
+
+        try:
+            conn.send(result)
+        # The result may not be picklable.
+        except Exception:
+            conn.send((task_id, False, traceback.format_exc()))
+
+
+def _call_chunk(func, chunk):
+    """
+    Applies `func` to every item of `chunk`.
+
+    Parameters
+    ----------
+    func : :class:`callable`
+        The function to apply.
+
+    chunk : :class:`list` of :class:`tuple`
+        The arguments given to `func`.
+
+    Returns
+    -------
+    :class:`list`
+        The results.
+
+    """
+
+    return [func(*args) for args in chunk]
@@ -1,4 +1,5 @@
 from .topologies import *
 from .energy import *
+from .ensemble import *
 from .fg_info import *
 from .molecules import *
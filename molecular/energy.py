@@ -175,6 +175,24 @@ the function was defined so that the key is:
                  building_blocks=None,
                  func=FunctionData('macromodel', forcefield=16))
 
+Storing results between runs.
+-----------------------------
+
+Results in :attr:`~Energy.values` are lost when the molecule is
+deleted. If :func:`set_energy_store` is called, results are also kept
+in a :class:`.ResultStore`, which is shared by all processes and later
+runs. Before an :class:`Energy` method is run, :func:`e_logger` looks
+for a result calculated with the same key on a molecule with the same
+structure and coordinates, and uses it instead of running the method.
+
+Methods whose results should not be stored, for example because they
+are cheap to find from other stored results, have their
+:attr:`persist` attribute set to ``False``:
+
+.. code-block:: python
+
+    Energy.formation.persist = False
+
 Notes.
 ------
 
@@ -191,17 +209,20 @@ Notes.
 
 import os
 import rdkit.Chem.AllChem as rdkit
-import subprocess as sp
-import psutil
-import copy
 from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
 from types import MethodType
-from functools import wraps
-from inspect import signature as sig
+from functools import wraps, partial
+from inspect import signature as sig, getattr_static
 import logging
+import numpy as np
 
-from ..convenience_tools import FunctionData
-from ..optimization.mopac import mopac_opt
+from ..convenience_tools import FunctionData, run_program, ResultStore
+from ..optimization.mopac import _mop_line as _opt_mop_line
+from ..optimization.macromodel import (_run_licensed,
+                                       _batch_job,
+                                       _write_mae)
+from ..optimization.optimization import _canonical
 
 
 logger = logging.getLogger(__name__)
@@ -225,6 +246,11 @@ class EMethod:
     func : :class:`function`
         The method which the descriptor acts as a getter for.
 
+    make_key : :class:`function`
+        Creates the key of :attr:`func` in :attr:`Energy.values` from
+        the arguments of a call. It is made once, when the class is
+        defined, by :func:`_compile_key`.
+
     """
 
     def __init__(self, func):
@@ -239,6 +265,10 @@ class EMethod:
         """
 
         self.func = func
+        self.make_key = _compile_key(func)
+
+    def __set_name__(self, owner, name):
+        self.name = name
 
     def __get__(self, obj, cls):
         """
@@ -276,7 +306,12 @@ class EMethod:
         # method is modified so that after the method returns a value,
         # it is stored in the `values` dictionary of the Energy
         # instance.
-        return e_logger(self.func, obj)
+        method = e_logger(self.func, obj, self.make_key)
+        # The modified method is placed in the instance dictionary, so
+        # that later accesses find it there without calling the
+        # descriptor again.
+        obj.__dict__[self.name] = method
+        return method
 
 
 class EMeta(type):
@@ -295,6 +330,11 @@ class EMeta(type):
     decorator. Calling this decorated method makes it automatically
     update :attr:`Energy.values`.
 
+    The decorated method is made the first time it is accessed on an
+    :class:`Energy` instance and kept in the instance, so that
+    repeated calls, for example in fitness functions, pay for the
+    decoration once.
+
     """
 
     def __new__(cls, cls_name, bases, cls_dict):
@@ -317,7 +357,7 @@ class EMeta(type):
         return type.__new__(cls, cls_name, bases, cls_dict)
 
 
-def e_logger(func, obj):
+def e_logger(func, obj, make_key=None):
     """
     Turns `func` into a version which updates :attr`Energy.values`.
 
@@ -330,23 +370,46 @@ def e_logger(func, obj):
         The :class:`Energy` object on which the method `func` was
         called.
 
+    make_key : :class:`function`, optional
+        Creates the key of `func` from the arguments of a call, as
+        made by :func:`_compile_key`. If ``None``, it is made here.
+
     Returns
     -------
     :class:`types.MethodType`
         The function `func` bound to `obj` and modified so that when
-        called the results update :attr:`Energy.values`.
+        called the results update :attr:`Energy.values`. If a store
+        was set with :func:`set_energy_store`, results found in it are
+        returned without running `func` and new results are added to
+        it.
 
     """
 
+    if make_key is None:
+        make_key = _compile_key(func)
+
     @wraps(func)
     def inner(self, *args, **kwargs):
 
-        # First get the result of the energy calculation.
-        result = func(self, *args, **kwargs)
-
-        # Next create FunctionData object to store the values of the
-        # parameters used to run that calculation.
-        key = func_key(func, (self,)+args, kwargs)
+        # Create FunctionData object to store the values of the
+        # parameters used to run the calculation.
+        key = make_key(self, args, kwargs)
+
+        # If the energy store has the result, the calculation does not
+        # need to be run.
+        store = _energy_store()
+        store_key = (_store_key(self.molecule, key) if
+                     store is not None and getattr(func, 'persist', True)
+                     else None)
+        result = None if store_key is None else store.get(store_key)
+
+        if result is None:
+            result = func(self, *args, **kwargs)
+            if store_key is not None:
+                store.put(store_key, result)
+        else:
+            logger.debug(f'Loaded {key} of "{self.molecule.name}" '
+                         'from the energy store.')
 
         # Update the `values` dictionary with the results of the
         # calculation.
@@ -417,6 +480,163 @@ def func_key(func, fargs=None, fkwargs=None):
     return FunctionData(func.__name__, **bound)
 
 
+def _compile_key(func):
+    """
+    Creates a function which makes the key of `func`.
+
+    The made keys are the same as those made by :func:`func_key`, but
+    the signature of `func` is only inspected once, here, rather than
+    on every call.
+
+    Parameters
+    ----------
+    func : :class:`function`
+        An :class:`Energy` method.
+
+    Returns
+    -------
+    :class:`function`
+        Takes the :class:`Energy` instance, the arguments and the
+        keyword arguments of a call to `func` and returns its key.
+
+    """
+
+    params = list(sig(func).parameters.values())[1:]
+    # Methods with variable arguments are left to the general code.
+    if any(param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD) for
+           param in params):
+        return lambda obj, args, kwargs: func_key(func,
+                                                  (obj, *args),
+                                                  kwargs)
+
+    name = func.__name__
+    positional = [param.name for param in params if
+                  param.kind == param.POSITIONAL_OR_KEYWORD]
+    excluded = tuple(getattr(func, 'exclude', ()))
+    defaults = {param.name: param.default for param in params if
+                param.default is not param.empty}
+
+    def make_key(obj, args, kwargs):
+        # Custom keys, such as :func:`formation_key`, may be set after
+        # the class is defined, so they are looked up on each call.
+        custom = getattr(func, 'key', None)
+        if custom is not None:
+            return custom((obj, *args), kwargs)
+
+        bound = dict(defaults)
+        bound.update(zip(positional, args))
+        bound.update(kwargs)
+        for param in excluded:
+            bound.pop(param, None)
+        return FunctionData(name, **bound)
+
+    return make_key
+
+
+def set_energy_store(path, max_size=None):
+    """
+    Sets the directory where the results of :class:`Energy` methods
+    are stored.
+
+    Before an :class:`Energy` method is run, the store is checked for
+    a result calculated with the same parameters, on a molecule with
+    the same structure and coordinates. If one is found, it is used
+    instead of running the calculation. New results are added to the
+    store, so that they are reused by later runs and by other
+    processes, including worker processes started after this function
+    is called.
+
+    Parameters
+    ----------
+    path : :class:`str`
+        The directory holding the store. ``None`` to stop using a
+        store.
+
+    max_size : :class:`int`, optional
+        The maximum size of the store, in bytes. If ``None``, there is
+        no limit.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # The settings are held in environment variables so that they are
+    # inherited by worker processes.
+    if path is None:
+        os.environ.pop('STK_ENERGY_STORE', None)
+    else:
+        os.environ['STK_ENERGY_STORE'] = os.path.abspath(path)
+
+    if max_size is None:
+        os.environ.pop('STK_ENERGY_STORE_SIZE', None)
+    else:
+        os.environ['STK_ENERGY_STORE_SIZE'] = str(int(max_size))
+
+
+# The store used by this process. It is recreated if the settings in
+# the environment change.
+_store = None
+
+
+def _energy_store():
+    """
+    Returns the store set by :func:`set_energy_store`.
+
+    Returns
+    -------
+    :class:`.ResultStore`
+        The store. ``None`` if no store is set.
+
+    """
+
+    global _store
+
+    path = os.environ.get('STK_ENERGY_STORE')
+    if path is None:
+        return None
+
+    max_size = os.environ.get('STK_ENERGY_STORE_SIZE')
+    max_size = None if max_size is None else int(max_size)
+    if (_store is None or
+            _store.path != path or
+            _store.max_size != max_size):
+        _store = ResultStore(path, max_size)
+    return _store
+
+
+def _store_key(molecule, fkey):
+    """
+    Returns the key of a result in the energy store.
+
+    Parameters
+    ----------
+    molecule : :class:`.Molecule`
+        The molecule whose energy was calculated.
+
+    fkey : :class:`.FunctionData`
+        The key of the result in :attr:`Energy.values`.
+
+    Returns
+    -------
+    :class:`str`
+        The key. ``None`` if `molecule` has no structure key, in which
+        case its results are not stored.
+
+    """
+
+    if getattr(molecule, 'key', None) is None:
+        return None
+
+    coords = b''.join(
+        np.round(conf.GetPositions(), 4).tobytes() for
+        conf in molecule.mol.GetConformers())
+    return ResultStore.key(_canonical(molecule.key),
+                           coords,
+                           _canonical(fkey))
+
+
 def exclude(*args):
     """
     A decorator to add the :attr`exclude` attribute to methods.
@@ -482,6 +702,32 @@ class Energy(metaclass=EMeta):
 
         self.molecule = molecule
         self.values = {}
+        # Results of MOPAC runs, keyed by the settings and coordinates
+        # used. They are shared by all MOPAC methods, so that
+        # properties found by the same calculation only need one run.
+        self._mopac_results = {}
+        # ``rdkit`` force fields, keyed by their name. Each is set up
+        # once for the graph of the molecule and then reused for any
+        # coordinates.
+        self._force_fields = {}
+
+    def __getstate__(self):
+        # ``rdkit`` force fields cannot be pickled. They are set up
+        # again when needed. The same goes for the decorated methods
+        # kept by :class:`EMethod`. The descriptors are looked up
+        # statically, because accessing them through the class returns
+        # the undecorated methods.
+        cls = type(self)
+        state = {
+            name: value for name, value in vars(self).items() if
+            not isinstance(getattr_static(cls, name, None), EMethod)
+        }
+        state['_force_fields'] = {}
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_force_fields', {})
+        self.__dict__ = state
 
     @exclude('force_e_calc')
     def formation(self,
@@ -692,20 +938,110 @@ class Energy(metaclass=EMeta):
         """
 
         logger.debug('Starting rdkit energy calculation.')
+        positions = self.molecule.mol.GetConformer(conformer).GetPositions()
+        return self._rdkit_energies(forcefield, [positions])[0]
+
+    def rdkit_conformers(self, forcefield, conformers=None):
+        """
+        Uses ``rdkit`` to calculate the energies of many conformers.
+
+        The force field is set up once and only the positions of the
+        atoms change between conformers, so this is much faster than
+        calling :meth:`rdkit` on each conformer.
+
+        Parameters
+        ----------
+        forcefield : :class:`str`
+            The name of the forcefield to be used.
+
+        conformers : :class:`list` of :class:`int`, optional
+            The ids of the conformers to use. If ``None``, all
+            conformers are used.
+
+        Returns
+        -------
+        :class:`list` of :class:`float`
+            The energy of each conformer.
+
+        """
+
+        mol = self.molecule.mol
+        if conformers is None:
+            conformers = [conf.GetId() for conf in mol.GetConformers()]
+        return self._rdkit_energies(
+                    forcefield,
+                    [mol.GetConformer(conformer).GetPositions() for
+                     conformer in conformers])
+
+    def _rdkit_energies(self, forcefield, positions):
+        """
+        Calculates ``rdkit`` energies of many sets of coordinates.
+
+        Parameters
+        ----------
+        forcefield : :class:`str`
+            The name of the forcefield to be used.
+
+        positions : :class:`list` of :class:`numpy.ndarray`
+            Each array has shape ``(n, 3)`` and holds the coordinates
+            of every atom in the molecule.
+
+        Returns
+        -------
+        :class:`list` of :class:`float`
+            The energy of each set of coordinates.
+
+        """
+
+        ff = self._force_field(forcefield)
+        return [ff.CalcEnergy(np.ravel(coords).tolist()) for
+                coords in positions]
+
+    def _force_field(self, forcefield):
+        """
+        Returns an ``rdkit`` force field for :attr:`molecule`.
+
+        Atom typing and parameter assignment are only done the first
+        time a force field is needed, or after the molecule is
+        replaced. The force field is built for a private copy of the
+        molecule, so that removing conformers from the molecule does
+        not invalidate it.
+
+        Parameters
+        ----------
+        forcefield : :class:`str`
+            The name of the forcefield, ``'uff'`` or ``'mmff'``.
+
+        Returns
+        -------
+        :class:`rdkit.ForceField.rdForceField.ForceField`
+            The force field.
+
+        """
+
+        mol = self.molecule.mol
+        cached = self._force_fields.get(forcefield)
+        if (cached is not None and
+           cached[0] is mol and
+           cached[1].GetNumAtoms() == mol.GetNumAtoms() and
+           cached[1].GetNumBonds() == mol.GetNumBonds()):
+            return cached[2]
+
+        logger.debug(f'Setting up {forcefield} force field for '
+                     f'"{self.molecule.name}".')
+        ff_mol = rdkit.Mol(mol)
         if forcefield == 'uff':
-            self.molecule.mol.UpdatePropertyCache()
-            ff = rdkit.UFFGetMoleculeForceField(self.molecule.mol,
-                                                confId=conformer)
+            ff_mol.UpdatePropertyCache()
+            ff = rdkit.UFFGetMoleculeForceField(ff_mol)
         if forcefield == 'mmff':
-            rdkit.GetSSSR(self.molecule.mol)
-            self.molecule.mol.UpdatePropertyCache()
+            rdkit.GetSSSR(ff_mol)
+            ff_mol.UpdatePropertyCache()
             ff = rdkit.MMFFGetMoleculeForceField(
-                  self.molecule.mol,
-                  rdkit.MMFFGetMoleculeProperties(self.molecule.mol),
-                  confId=conformer)
+                  ff_mol,
+                  rdkit.MMFFGetMoleculeProperties(ff_mol))
 
-        eng = ff.CalcEnergy()
-        return eng
+        self._force_fields[forcefield] = (mol, ff_mol, ff)
+        return ff
 
     @exclude('macromodel_path')
     def macromodel(self, forcefield, macromodel_path, conformer=-1):
@@ -747,69 +1083,140 @@ class Energy(metaclass=EMeta):
         # a temporary copy of the molecular structure file is made and
         # used for macromodel calculations.
 
+        # Unique file name is generated by inserting a random int into
+        # the file path.
+        tmp_file = "{}.mae".format(uuid4().int)
+        _write_mae(self.molecule, tmp_file, macromodel_path, conformer)
+        file_root, ext = os.path.splitext(tmp_file)
+
+        # Create an input file and run it.
+        energies = _run_macromodel_energy(file_root,
+                                          forcefield,
+                                          macromodel_path)
+        if not energies:
+            raise EnergyError('MacroModel energy calculation failed.')
+        return energies[-1]
+
+    def _mopac_result(self, mopac_path, settings):
+        """
+        Runs a MOPAC single point calculation on :attr:`molecule`.
+
+        If the calculation was already run with the same `settings`
+        on the same coordinates, its result is returned instead.
+
+        Parameters
+        ----------
+        mopac_path : :class:`str`
+            The full path to the MOPAC installation.
+
+        settings : :class:`dict`
+            The settings of the calculation, with the defaults of
+            the MOPAC methods filled in.
+
+        Returns
+        -------
+        :class:`MOPACResult`
+            The properties found by the calculation.
+
+        """
+
+        coords = np.round(
+                   self.molecule.mol.GetConformer().GetPositions(), 4)
+        key = (_canonical(settings), coords.tobytes())
+        if key in self._mopac_results:
+            return self._mopac_results[key]
+
+        # To prevent conflicts when running this function in parallel,
+        # a temporary copy of the molecular structure file is made and
+        # used for mopac calculations.
+
         # Unique file name is generated by inserting a random int into
         # the file path.
         tmp_file = "{}.mol".format(uuid4().int)
-        self.molecule.write(tmp_file, conformer)
+        self.molecule.write(tmp_file)
 
         file_root, ext = os.path.splitext(tmp_file)
-        convrt_app = os.path.join(macromodel_path,
-                                  'utilities',
-                                  'structconvert')
-        convrt_cmd = [convrt_app,
-                      tmp_file,
-                      file_root+'.mae']
-        sp.call(convrt_cmd, stdout=sp.PIPE, stderr=sp.PIPE)
 
-        # Create an input file and run it.
-        input_script = (
-         "{0}.mae\n"
-         "{0}-out.maegz\n"
-         " MMOD       0      1      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " FFLD{1:8}      1      0      0     1.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " BGIN       0      0      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " READ      -1      0      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " ELST      -1      0      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " WRIT       0      0      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n"
-         " END       0      0      0      0     0.0000     0.0000     "
-         "0.0000     0.0000\n\n"
-        ).format(file_root, forcefield)
-
-        with open(file_root+'.com', 'w') as f:
-            f.write(input_script)
-
-        cmd = [os.path.join(macromodel_path, 'bmin'),
-               file_root,
-               "-WAIT",
-               "-LOCAL"]
-        sp.call(cmd)
-
-        # Check if the license was found. If not run the function
-        # again.
-        with open(file_root+'.log', 'r') as f:
-            log_content = f.read()
-        if ('FATAL -96: Could not check out a license for mmlibs' in
-           log_content):
-            return self.macromodel(forcefield,
-                                   macromodel_path,
-                                   conformer)
+        # Generate the input file
+        _create_mop(file_root, self.molecule, settings)
+        # Run MOPAC
+        _run_mopac(file_root, mopac_path)
+
+        result = MOPACResult(file_root)
+        self._mopac_results[key] = result
+        return result
 
-        # Read the .log file and return the energy.
-        with open(file_root+'.log', 'r') as f:
-            for line in f:
-                if "                   Total Energy =" in line:
-                    eng = float(line.split()[-2].replace("=", ""))
+    def _mopac_ion(self, mopac_path, settings):
+        """
+        Optimizes an ion of :attr:`molecule` using MOPAC.
 
-        try:
-            return eng
-        except UnboundLocalError:
-            raise EnergyError('MacroModel energy calculation failed.')
+        Only the coordinates of :attr:`molecule` are written to the
+        MOPAC input file, :attr:`molecule` itself is not changed.
+
+        Parameters
+        ----------
+        mopac_path : :class:`str`
+            The full path to the MOPAC installation.
+
+        settings : :class:`dict`
+            The settings of the optimization, including the charge of
+            the ion.
+
+        Returns
+        -------
+        :class:`MOPACResult`
+            The properties of the optimized ion.
+
+        """
+
+        file_root = str(uuid4().int)
+        _create_mop(file_root, self.molecule, settings, opt=True)
+        _run_mopac(file_root, mopac_path, 7200)
+        # The output of the optimization holds the energy of the final
+        # structure, so no further single point calculation is needed.
+        return MOPACResult(file_root)
+
+    def _mopac_ion_energies(self, mopac_path, settings, charge):
+        """
+        Calculates the energies of :attr:`molecule` and one of its ions.
+
+        The single point calculation of the neutral molecule and the
+        optimization of the ion are run at the same time.
+
+        Parameters
+        ----------
+        mopac_path : :class:`str`
+            The full path to the MOPAC installation.
+
+        settings : :class:`dict`
+            The settings of the single point calculation of the neutral
+            molecule, with the defaults of the MOPAC methods filled in.
+
+        charge : :class:`int`
+            The charge of the ion.
+
+        Returns
+        -------
+        :class:`tuple` of :class:`float`
+            The energy of the neutral molecule and the energy of the
+            optimized ion, in eV.
+
+        """
+
+        ion_settings = dict(settings,
+                            method='OPT',
+                            gradient=0.01,
+                            charge=charge,
+                            fileout='PDBOUT')
+
+        with ThreadPoolExecutor(2) as executor:
+            neutral = executor.submit(self._mopac_result,
+                                      mopac_path,
+                                      settings)
+            ion = executor.submit(self._mopac_ion,
+                                  mopac_path,
+                                  ion_settings)
+            return neutral.result().energy, ion.result().energy
 
     @exclude('mopac_path')
     def mopac(self, mopac_path, settings=None):
@@ -882,22 +1289,7 @@ class Energy(metaclass=EMeta):
 
         vals.update(settings)
 
-        # To prevent conflicts when running this function in parallel,
-        # a temporary copy of the molecular structure file is made and
-        # used for mopac calculations.
-
-        # Unique file name is generated by inserting a random int into
-        # the file path.
-        tmp_file = "{}.mol".format(uuid4().int)
-        self.molecule.write(tmp_file)
-
-        file_root, ext = os.path.splitext(tmp_file)
-
-        # Generate the input file
-        _create_mop(file_root, self.molecule, vals)
-        # Run MOPAC
-        _run_mopac(file_root, mopac_path)
-        return _extract_MOPAC_en(file_root)
+        return self._mopac_result(mopac_path, vals).energy
 
     @exclude('mopac_path')
     def mopac_dipole(self, mopac_path, settings=None):
@@ -970,22 +1362,7 @@ class Energy(metaclass=EMeta):
 
         vals.update(settings)
 
-        # To prevent conflicts when running this function in parallel,
-        # a temporary copy of the molecular structure file is made and
-        # used for mopac calculations.
-
-        # Unique file name is generated by inserting a random int into
-        # the file path.
-        tmp_file = "{}.mol".format(uuid4().int)
-        self.molecule.write(tmp_file)
-
-        file_root, ext = os.path.splitext(tmp_file)
-
-        # Generate the input file
-        _create_mop(file_root, self.molecule, vals)
-        # Run MOPAC
-        _run_mopac(file_root, mopac_path)
-        return _extract_MOPAC_dipole(file_root)
+        return self._mopac_result(mopac_path, vals).dipole
 
     @exclude('mopac_path')
     def mopac_ea(self, mopac_path, settings=None):
@@ -1057,45 +1434,9 @@ class Energy(metaclass=EMeta):
                 }
         vals.update(settings)
 
-        # First check the energy of the neutral system
-        # To prevent conflicts when running this function in parallel,
-        # a temporary copy of the molecular structure file is made and
-        # used for mopac calculations.
-
-        # Unique file name is generated by inserting a random int into
-        # the file path.
-        tmp_file = "{}.mol".format(uuid4().int)
-        self.molecule.write(tmp_file)
-
-        file_root, ext = os.path.splitext(tmp_file)
-
-        # Generate the input file
-        _create_mop(file_root, self.molecule, vals)
-        # Run MOPAC
-        _run_mopac(file_root, mopac_path)
-
-        # Extract the neutral energy
-        en1 = _extract_MOPAC_en(file_root)
-
-        # Update the settings for the anion optimization
-        settings2 = {
-                    'method': 'OPT',
-                    'gradient': 0.01,
-                    'charge': -1,
-                    'fileout': 'PDBOUT'
-                    }
-
-        vals.update(settings2)
-
-        # Now generate a new molecule
-        mol2 = copy.deepcopy(self.molecule)
-        # Run the mopac optimisation
-        mopac_opt(mol2, mopac_path, vals)
-        # Extract the energy by using the self.mopac method
-        vals['method'] = 'NOOPT'
-        del vals['gradient']
-        del vals['fileout']
-        en2 = mol2.energy.mopac(mopac_path, vals)
+        # The neutral system and the anion are calculated at the same
+        # time.
+        en1, en2 = self._mopac_ion_energies(mopac_path, vals, -1)
         # Calculate the EA (eV)
         return en2 - en1
 
@@ -1169,45 +1510,9 @@ class Energy(metaclass=EMeta):
                 }
         vals.update(settings)
 
-        # First check the energy of the neutral system
-        # To prevent conflicts when running this function in parallel,
-        # a temporary copy of the molecular structure file is made and
-        # used for mopac calculations.
-
-        # Unique file name is generated by inserting a random int into
-        # the file path.
-        tmp_file = "{}.mol".format(uuid4().int)
-        self.molecule.write(tmp_file)
-
-        file_root, ext = os.path.splitext(tmp_file)
-
-        # Generate the input file
-        _create_mop(file_root, self.molecule, vals)
-        # Run MOPAC
-        _run_mopac(file_root, mopac_path)
-
-        # Extract the neutral energy
-        en1 = _extract_MOPAC_en(file_root)
-
-        # Update the settings for the cation optimization
-        settings2 = {
-                    'method': 'OPT',
-                    'gradient': 0.01,
-                    'charge': 1,
-                    'fileout': 'PDBOUT'
-                    }
-
-        vals.update(settings2)
-
-        # Now generate a new molecule
-        mol2 = copy.deepcopy(self.molecule)
-        # Run the mopac optimisation
-        mopac_opt(mol2, mopac_path, vals)
-        # Extract the energy by using the self.mopac method
-        vals['method'] = 'NOOPT'
-        del vals['gradient']
-        del vals['fileout']
-        en2 = mol2.energy.mopac(mopac_path, vals)
+        # The neutral system and the cation are calculated at the same
+        # time.
+        en1, en2 = self._mopac_ion_energies(mopac_path, vals, 1)
         # Calculate the IP (eV)
         return en2 - en1
 
@@ -1265,6 +1570,9 @@ def formation_key(fargs, fkwargs):
 
 
 Energy.formation.key = formation_key
+# The energies used by :meth:`Energy.formation` are stored, the
+# formation energy itself is cheap to find from them.
+Energy.formation.persist = False
 
 
 def pseudoformation_key(fargs, fkwargs):
@@ -1321,6 +1629,176 @@ def pseudoformation_key(fargs, fkwargs):
 
 
 Energy.pseudoformation.key = pseudoformation_key
+Energy.pseudoformation.persist = False
+
+
+def batch_energies(molecules, func_data):
+    """
+    Runs an :class:`Energy` method on many molecules.
+
+    If the method has a :attr:`batch` attribute, every molecule whose
+    result is not in the store set by :func:`set_energy_store` is
+    calculated by a single call to it. For example,
+    :meth:`Energy.macromodel` calculates the energies of all the
+    molecules with one MacroModel job. Otherwise, the method is run on
+    each molecule in turn.
+
+    Parameters
+    ----------
+    molecules : :class:`list` of :class:`.Molecule`
+        The molecules whose energies are calculated. The results are
+        added to their :attr:`Energy.values`.
+
+    func_data : :class:`.FunctionData`
+        Describes the :class:`Energy` method and its parameters.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    efunc = getattr(Energy, func_data.name)
+    batch = getattr(efunc, 'batch', None)
+    if batch is None:
+        for mol in molecules:
+            getattr(mol.energy, func_data.name)(**func_data.params)
+        return
+
+    fkey = func_key(efunc, None, func_data.params)
+    store = _energy_store()
+    pending = []
+    for mol in molecules:
+        store_key = None if store is None else _store_key(mol, fkey)
+        result = None if store_key is None else store.get(store_key)
+        if result is None:
+            pending.append((mol, store_key))
+        else:
+            mol.energy.values[fkey] = result
+
+    if not pending:
+        return
+
+    results = batch([mol for mol, _ in pending], **func_data.params)
+    for (mol, store_key), result in zip(pending, results):
+        mol.energy.values[fkey] = result
+        if store_key is not None:
+            store.put(store_key, result)
+
+
+def _macromodel_batch(molecules,
+                      forcefield,
+                      macromodel_path,
+                      conformer=-1):
+    """
+    Calculates energies of many molecules with one MacroModel job.
+
+    This is the :attr:`batch` version of :meth:`Energy.macromodel`.
+
+    Parameters
+    ----------
+    molecules : :class:`list` of :class:`.Molecule`
+        The molecules whose energies are calculated.
+
+    forcefield : :class:`int`
+        The id number of the forcefield to be used by macromodel.
+
+    macromodel_path : :class:`str`
+        The full path to the Schrodinger suite within the user's
+        machine.
+
+    conformer : :class:`int`, optional
+        The conformer to use.
+
+    Returns
+    -------
+    :class:`list` of :class:`float`
+        The energy of each molecule.
+
+    """
+
+    job = _batch_job(molecules, macromodel_path, conformer)
+    file_root, ext = os.path.splitext(job._file)
+    energies = _run_macromodel_energy(file_root, forcefield, macromodel_path)
+
+    # The log only holds the energies of the structures ``bmin`` could
+    # handle, in order. If some are missing, there is no way to tell
+    # which, so each molecule is calculated on its own.
+    if len(energies) != len(molecules):
+        logger.warning('Batch MacroModel energy calculation found '
+                       f'{len(energies)} energies for {len(molecules)} '
+                       'molecules. Calculating them one at a time.')
+        energies = [mol.energy.macromodel(forcefield,
+                                          macromodel_path,
+                                          conformer) for
+                    mol in molecules]
+    return energies
+
+
+Energy.macromodel.batch = _macromodel_batch
+
+
+def _run_macromodel_energy(file_root, forcefield, macromodel_path):
+    """
+    Runs a MacroModel energy calculation on a ``.mae`` file.
+
+    Parameters
+    ----------
+    file_root : :class:`str`
+        The path of the ``.mae`` file, without the extension. It may
+        hold many structures.
+
+    forcefield : :class:`int`
+        The id number of the forcefield to be used by macromodel.
+
+    macromodel_path : :class:`str`
+        The full path to the Schrodinger suite within the user's
+        machine.
+
+    Returns
+    -------
+    :class:`list` of :class:`float`
+        The energy of each structure, in the order they were
+        calculated.
+
+    """
+
+    input_script = (
+     "{0}.mae\n"
+     "{0}-out.maegz\n"
+     " MMOD       0      1      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " FFLD{1:8}      1      0      0     1.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " BGIN       0      0      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " READ      -1      0      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " ELST      -1      0      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " WRIT       0      0      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n"
+     " END       0      0      0      0     0.0000     0.0000     "
+     "0.0000     0.0000\n\n"
+    ).format(file_root, forcefield)
+
+    with open(file_root+'.com', 'w') as f:
+        f.write(input_script)
+
+    cmd = [os.path.join(macromodel_path, 'bmin'),
+           file_root,
+           "-WAIT",
+           "-LOCAL"]
+    # If no license is found, the calculation is retried.
+    _run_licensed(cmd, log_file=file_root+'.log')
+
+    # Read the .log file and return the energies.
+    energies = []
+    with open(file_root+'.log', 'r') as f:
+        for line in f:
+            if "                   Total Energy =" in line:
+                energies.append(float(line.split()[-2].replace("=", "")))
+    return energies
 
 
 def _run_mopac(file_root, mopac_path, timeout=3600):
@@ -1330,23 +1808,19 @@ def _run_mopac(file_root, mopac_path, timeout=3600):
     logger.info(f'Running MOPAC - {file_root}.')
 
     # To run MOPAC a command is issued to the console via
-    # ``subprocess.Popen``. The command is the full path of the
-    # ``mopac`` program.
+    # :func:`.run_program`. The command is the full path of the
+    # ``mopac`` program. If MOPAC runs for too long, it is asked to
+    # stop, so that it still writes its output files.
     file_root, ext = os.path.splitext(mop_file)
     opt_cmd = [mopac_path, file_root]
-    opt_proc = psutil.Popen(opt_cmd, stdout=sp.PIPE,
-                            stderr=sp.STDOUT,
-                            universal_newlines=True)
-
-    try:
-        if timeout:
-            proc_out, _ = opt_proc.communicate(timeout=timeout)
-        else:
-            proc_out, _ = opt_proc.communicate()
-    except sp.TimeoutExpired:
+    opt_proc = run_program(opt_cmd,
+                           timeout or None,
+                           'mopac',
+                           partial(_kill_mopac, file_root),
+                           60)
+    if opt_proc.timed_out:
         logger.info(('Minimization took too long and was terminated '
                      'by force - {}').format(file_root))
-        _kill_mopac(file_root)
 
 
 def _kill_mopac(file_root):
@@ -1407,7 +1881,7 @@ def _mop_line(settings):
     return mopac_run_str
 
 
-def _create_mop(file_root, molecule, settings):
+def _create_mop(file_root, molecule, settings, opt=False):
     """
     Creates the ``.mop`` file holding the molecule to be optimized.
 
@@ -1422,6 +1896,11 @@ def _create_mop(file_root, molecule, settings):
         Dictionary defined by the MOPAC methods, where all the run
         details are defined.
 
+    opt : :class:`bool`, optional
+        If ``True``, the input file is for an optimization, using the
+        keywords of :func:`.mopac_opt`. Otherwise, it is for a single
+        point calculation.
+
     Returns
     -------
     :class:`str`
@@ -1437,7 +1916,8 @@ def _create_mop(file_root, molecule, settings):
     # Generate the mop file containing the MOPAC run info
     with open(mop_file, 'w') as mop:
         # line for the run info
-        mop.write(_mop_line(settings) + "\n")
+        line = _opt_mop_line(settings) if opt else _mop_line(settings)
+        mop.write(line + "\n")
         # line with the name of the molecule
         mop.write(file_root + "\n\n")
 
@@ -1453,23 +1933,160 @@ def _create_mop(file_root, molecule, settings):
     return mop_file
 
 
-def _extract_MOPAC_en(file_root):
-    mopac_out = file_root + '.arc'
+class MOPACResult:
+    """
+    Holds the properties found by a MOPAC calculation.
+
+    All properties are read in a single pass over the ``.arc`` and
+    ``.out`` files written by MOPAC, so that a calculation only needs
+    to be run once, however many of its properties are used.
+
+    Attributes
+    ----------
+    energy : :class:`float`
+        The total energy, in eV.
+
+    heat_of_formation : :class:`float`
+        The heat of formation, in kcal mol-1.
+
+    dipole : :class:`float`
+        The dipole moment, in Debye.
+
+    homo : :class:`float`
+        The energy of the highest occupied molecular orbital, in eV.
+
+    lumo : :class:`float`
+        The energy of the lowest unoccupied molecular orbital, in eV.
+
+    charges : :class:`list` of :class:`float`
+        The partial charge of each atom, in the order of the atoms in
+        the input file.
+
+    Any property which is missing from the output files is ``None``.
+
+    """
+
+    __slots__ = ['energy',
+                 'heat_of_formation',
+                 'dipole',
+                 'homo',
+                 'lumo',
+                 'charges']
+
+    def __init__(self, file_root):
+        """
+        Reads the properties from the output files of a MOPAC run.
+
+        Parameters
+        ----------
+        file_root : :class:`str`
+            The path of the MOPAC input file, without the extension.
+
+        Raises
+        ------
+        :class:`EnergyError`
+            If the total energy is not in the ``.arc`` file, which
+            means the calculation failed.
+
+        """
+
+        self.energy = None
+        self.heat_of_formation = None
+        self.dipole = None
+        self.homo = None
+        self.lumo = None
+        self.charges = None
+
+        self._read_arc(file_root + '.arc')
+        self._read_out(file_root + '.out')
+
+        if self.energy is None:
+            raise EnergyError(f'MOPAC did not write the energy of '
+                              f'"{file_root}".')
 
-    with open(mopac_out) as outfile:
-        target = "TOTAL ENERGY"
-        energy_str = str([x for x in outfile.readlines() if target in x][0])
-        energy_val = float(energy_str.split()[3])
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
 
-    return energy_val
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
+    def __repr__(self):
+        return (f'MOPACResult(energy={self.energy}, '
+                f'dipole={self.dipole}, '
+                f'homo={self.homo}, '
+                f'lumo={self.lumo})')
 
-def _extract_MOPAC_dipole(file_root):
-    mopac_out = file_root + '.arc'
+    def _read_arc(self, path):
+        """
+        Reads the properties held in the ``.arc`` file.
 
-    with open(mopac_out) as outfile:
-        target = "DIPOLE"
-        energy_str = str([x for x in outfile.readlines() if target in x][0])
-        energy_val = float(energy_str.split()[2])
+        Parameters
+        ----------
+        path : :class:`str`
+            The path of the ``.arc`` file.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        with open(path) as arc:
+            for line in arc:
+                words = line.split()
+                if not words:
+                    continue
+                # Only the first occurrence of each property is used.
+                if 'TOTAL ENERGY' in line and self.energy is None:
+                    self.energy = float(words[3])
+                elif 'HEAT OF FORMATION' in line:
+                    if self.heat_of_formation is None:
+                        self.heat_of_formation = float(words[4])
+                elif words[0] == 'DIPOLE' and self.dipole is None:
+                    self.dipole = float(words[2])
+                # Closed shell systems have the line
+                # "HOMO LUMO ENERGIES (EV) = -9.1 -0.5" while open
+                # shell systems have "SOMO LUMO (EV)" lines, for each
+                # spin. The first one is used.
+                elif 'LUMO' in line and self.lumo is None:
+                    energies = line.split('=')[1].split()
+                    self.homo = float(energies[0])
+                    self.lumo = float(energies[1])
+
+    def _read_out(self, path):
+        """
+        Reads the partial charges held in the ``.out`` file.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The path of the ``.out`` file.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
 
-    return energy_val
+        if not os.path.exists(path):
+            return
+
+        charges = None
+        with open(path) as out:
+            for line in out:
+                if 'NET ATOMIC CHARGES' in line:
+                    charges = []
+                    continue
+                if charges is None:
+                    continue
+
+                words = line.split()
+                # The table of charges ends with the dipole.
+                if words and words[0] == 'DIPOLE':
+                    break
+                # Skip the header of the table.
+                if len(words) >= 3 and words[0].isdigit():
+                    charges.append(float(words[2]))
+
+        self.charges = charges
@@ -0,0 +1,495 @@
+"""
+Defines :class:`Ensemble`, which holds many conformers of a molecule.
+
+Conformer searches, such as MacroModel MD runs, produce many
+structures of the same molecule. Rather than adding each of them to
+the ``rdkit`` molecule as a separate conformer, they are held in a
+single :class:`numpy.ndarray` of shape ``(n_conformers, n_atoms, 3)``,
+along with their energies. Geometric properties, such as centroids
+and RMSDs, are then calculated for all conformers at once.
+
+.. code-block:: python
+
+    ensemble = Ensemble.from_mae(mol, 'md-out.maegz')
+    weights = ensemble.boltzmann_weights()
+    mean_cavity = np.sum(weights*ensemble.cavity_sizes())
+
+An :class:`Ensemble` is usually found in the
+:attr:`~.Molecule.ensemble` attribute of a molecule.
+
+"""
+
+import warnings
+import logging
+import numpy as np
+import rdkit.Chem.AllChem as rdkit
+from scipy.optimize import minimize
+from scipy.spatial.distance import pdist
+import pywindow
+
+from ..convenience_tools import (atom_vdw_radii,
+                                 AtomMismatchError,
+                                 set_conformer_positions,
+                                 structures_from_mae_file)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Ensemble:
+    """
+    Holds the coordinates and energies of many conformers.
+
+    Attributes
+    ----------
+    molecule : :class:`.Molecule`
+        The molecule whose conformers are held.
+
+    coords : :class:`numpy.ndarray`
+        An array of shape ``(n_conformers, n_atoms, 3)`` holding the
+        coordinates of every atom in every conformer. Atoms are ordered
+        by their id in :attr:`molecule`.
+
+    energies : :class:`numpy.ndarray`
+        The energy of each conformer. ``nan`` if the energy of a
+        conformer is not known.
+
+    """
+
+    def __init__(self, molecule, coords, energies=None):
+        """
+        Initializes an :class:`Ensemble`.
+
+        Parameters
+        ----------
+        molecule : :class:`.Molecule`
+            The molecule whose conformers are held.
+
+        coords : :class:`numpy.ndarray`
+            An array of shape ``(n_conformers, n_atoms, 3)`` holding
+            the coordinates of the conformers.
+
+        energies : :class:`list` of :class:`float`, optional
+            The energy of each conformer. If ``None``, the energies
+            are not known.
+
+        """
+
+        self.molecule = molecule
+        self.coords = np.array(coords, dtype=np.float64).reshape(
+                                        -1, molecule.mol.GetNumAtoms(), 3)
+        if energies is None:
+            energies = np.full(len(self.coords), np.nan)
+        self.energies = np.array(energies, dtype=np.float64)
+
+    @classmethod
+    def from_molecule(cls, molecule):
+        """
+        Creates an :class:`Ensemble` from the conformers of a molecule.
+
+        Parameters
+        ----------
+        molecule : :class:`.Molecule`
+            The molecule whose ``rdkit`` conformers are used.
+
+        Returns
+        -------
+        :class:`Ensemble`
+            The ensemble, with unknown energies.
+
+        """
+
+        coords = [conf.GetPositions() for
+                  conf in molecule.mol.GetConformers()]
+        return cls(molecule, coords)
+
+    @classmethod
+    def from_mae(cls, molecule, path, n=None):
+        """
+        Creates an :class:`Ensemble` from a multi-structure file.
+
+        Parameters
+        ----------
+        molecule : :class:`.Molecule`
+            The molecule whose conformers are in the file.
+
+        path : :class:`str`
+            The full path of a ``.mae`` or ``.maegz`` file, such as the
+            output of a MacroModel conformer search.
+
+        n : :class:`int`, optional
+            If given, only the `n` lowest energy conformers are kept.
+
+        Returns
+        -------
+        :class:`Ensemble`
+            The ensemble of structures in the file.
+
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms of a structure do not match the atoms of
+            `molecule`.
+
+        """
+
+        structures = []
+        for props, atomic_nums, coords in structures_from_mae_file(path):
+            energy = float(props.get('r_mmod_Potential_Energy', 'nan'))
+            structures.append((energy, atomic_nums, coords))
+
+        if n is not None:
+            # Structures without an energy are placed last.
+            structures = sorted(
+                structures,
+                key=lambda s: np.inf if np.isnan(s[0]) else s[0])[:n]
+        return cls.from_structures(molecule, path, structures)
+
+    @classmethod
+    def from_structures(cls, molecule, path, structures):
+        """
+        Creates an :class:`Ensemble` from structures read from a file.
+
+        Parameters
+        ----------
+        molecule : :class:`.Molecule`
+            The molecule whose conformers are held.
+
+        path : :class:`str`
+            The path of the file the structures were read from. Used
+            when reporting errors.
+
+        structures : :class:`list` of :class:`tuple`
+            Each :class:`tuple` holds the energy, atomic numbers and
+            coordinates of a structure.
+
+        Returns
+        -------
+        :class:`Ensemble`
+            The ensemble of `structures`.
+
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms of a structure do not match the atoms of
+            `molecule`.
+
+        """
+
+        expected = _atomic_nums(molecule)
+        energies, all_coords = [], []
+        for energy, atomic_nums, coords in structures:
+            if not np.array_equal(atomic_nums, expected):
+                raise AtomMismatchError(
+                    path,
+                    'The atoms of a structure do not match the atoms '
+                    f'of "{molecule.name}".')
+            energies.append(energy)
+            all_coords.append(coords)
+        return cls(molecule, all_coords, energies)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def add(self, coords, energy=np.nan):
+        """
+        Adds a conformer to the ensemble.
+
+        Unlike :meth:`.MacroMolecule.add_conformer`, the molecule is
+        not rebuilt.
+
+        Parameters
+        ----------
+        coords : :class:`numpy.ndarray`
+            An ``(n_atoms, 3)`` array holding the coordinates of the
+            conformer.
+
+        energy : :class:`float`, optional
+            The energy of the conformer.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self.coords = np.concatenate(
+                [self.coords, np.reshape(coords, (1, -1, 3))])
+        self.energies = np.append(self.energies, energy)
+
+    def lowest_energy(self):
+        """
+        Returns the index of the lowest energy conformer.
+
+        Returns
+        -------
+        :class:`int`
+            The index of the conformer in :attr:`coords`.
+
+        """
+
+        return int(np.nanargmin(self.energies))
+
+    def set_conformer(self, index, conformer=-1):
+        """
+        Sets a conformer of :attr:`molecule` to a conformer of the ensemble.
+
+        Parameters
+        ----------
+        index : :class:`int`
+            The index of the conformer in :attr:`coords`.
+
+        conformer : :class:`int`, optional
+            The id of the ``rdkit`` conformer which is updated.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        set_conformer_positions(self.molecule.mol.GetConformer(conformer),
+                                self.coords[index])
+
+    def rdkit_energies(self, forcefield):
+        """
+        Calculates the energies of the conformers with ``rdkit``.
+
+        The force field of :attr:`molecule` is set up once and reused
+        for every conformer.
+
+        Parameters
+        ----------
+        forcefield : :class:`str`
+            The name of the forcefield to be used.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The energy of each conformer, also placed in
+            :attr:`energies`.
+
+        """
+
+        self.energies = np.array(
+            self.molecule.energy._rdkit_energies(forcefield, self.coords))
+        return self.energies
+
+    def boltzmann_weights(self, temperature=298.15):
+        """
+        Returns the Boltzmann weight of each conformer.
+
+        Parameters
+        ----------
+        temperature : :class:`float`, optional
+            The temperature in Kelvin.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The weight of each conformer. The weights sum to 1.
+            Energies are taken to be in kJ/mol, the unit used by
+            MacroModel.
+
+        """
+
+        # Boltzmann constant in kJ/(mol K).
+        kt = 0.0083144598*temperature
+        energies = self.energies - np.nanmin(self.energies)
+        weights = np.nan_to_num(np.exp(-energies/kt))
+        return weights / weights.sum()
+
+    def centroids(self):
+        """
+        Returns the centroid of each conformer.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            An ``(n_conformers, 3)`` array of centroids.
+
+        """
+
+        return self.coords.mean(axis=1)
+
+    def centers_of_mass(self):
+        """
+        Returns the centre of mass of each conformer.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            An ``(n_conformers, 3)`` array of centres of mass.
+
+        """
+
+        masses = _masses(self.molecule)
+        return np.einsum('kij,i->kj', self.coords, masses) / masses.sum()
+
+    def max_diameters(self):
+        """
+        Returns the largest distance between atoms in each conformer.
+
+        Unlike :meth:`.Molecule.max_diameter`, the van der Waals radii
+        of the atoms are not added.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The largest distance of each conformer, in Angstroms.
+
+        """
+
+        return np.array([pdist(coords).max() for coords in self.coords])
+
+    def cavity_sizes(self):
+        """
+        Returns the cavity diameter of each conformer.
+
+        The cavity is found in the same way as
+        :meth:`.Molecule.cavity_size`.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The diameter of the cavity of each conformer, in
+            Angstroms.
+
+        """
+
+        vdw = _vdw_radii(self.molecule)
+
+        def cavity(origin, coords):
+            distances = np.linalg.norm(coords - origin, axis=1) - vdw
+            return -2*distances.min()
+
+        # The starting point of each search is found for all
+        # conformers at once.
+        refs = self.centers_of_mass()
+        distances = np.linalg.norm(self.coords - refs[:, None, :], axis=2)
+        icavities = -(distances - vdw).min(axis=1)
+
+        sizes = np.empty(len(self))
+        for i, (coords, ref, icavity) in enumerate(zip(self.coords,
+                                                       refs,
+                                                       icavities)):
+            bounds = [(x+icavity, x-icavity) for x in ref]
+            origin = minimize(cavity,
+                              x0=ref,
+                              args=(coords, ),
+                              bounds=bounds).x
+            sizes[i] = max(-cavity(origin, coords), 0)
+        return sizes
+
+    def windows(self, n_windows):
+        """
+        Returns the window sizes of each conformer.
+
+        Parameters
+        ----------
+        n_windows : :class:`int`
+            The number of windows the molecule is expected to have.
+
+        Returns
+        -------
+        :class:`list`
+            The windows of each conformer, as returned by
+            :meth:`.Cage.windows`.
+
+        """
+
+        # A single copy of the molecule, holding one conformer, is
+        # reused for all conformers.
+        mol = rdkit.Mol(self.molecule.mol)
+        mol.RemoveAllConformers()
+        mol.AddConformer(rdkit.Conformer(mol.GetNumAtoms()))
+        windows = []
+        for coords in self.coords:
+            set_conformer_positions(mol.GetConformer(), coords)
+            windows.append(_windows(mol, n_windows))
+        return windows
+
+    def rmsd(self, reference=0):
+        """
+        Returns the RMSD of each conformer from a reference conformer.
+
+        Each conformer is superimposed on the reference with the
+        Kabsch algorithm, all at once.
+
+        Parameters
+        ----------
+        reference : :class:`int`, optional
+            The index of the reference conformer in :attr:`coords`.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The RMSD of each conformer, in Angstroms.
+
+        """
+
+        coords = self.coords - self.centroids()[:, None, :]
+        ref = coords[reference]
+        # The covariance matrix of each conformer with the reference.
+        covariance = np.einsum('kij,il->kjl', coords, ref)
+        u, s, vt = np.linalg.svd(covariance)
+        # Make sure the rotations are proper, so that conformers are
+        # not reflected.
+        u[:, :, -1] *= np.sign(np.linalg.det(np.matmul(u, vt)))[:, None]
+        coords = np.matmul(coords, np.matmul(u, vt))
+        return np.sqrt(((coords - ref)**2).sum(axis=(1, 2)) /
+                       coords.shape[1])
+
+
+def _atomic_nums(molecule):
+    return np.array([atom.GetAtomicNum() for
+                     atom in molecule.mol.GetAtoms()])
+
+
+def _masses(molecule):
+    return np.array([atom.GetMass() for atom in molecule.mol.GetAtoms()])
+
+
+def _vdw_radii(molecule):
+    return np.array([atom_vdw_radii[atom.GetSymbol()] for
+                     atom in molecule.mol.GetAtoms()])
+
+
+def _windows(mol, n_windows):
+    """
+    Returns window sizes found by ``pyWindow``.
+
+    Parameters
+    ----------
+    mol : :class:`rdkit.Chem.rdchem.Mol`
+        A molecule holding a single conformer.
+
+    n_windows : :class:`int`
+        The number of windows the molecule is expected to have.
+
+    Returns
+    -------
+    :class:`list` of :class:`float`
+        The sizes of the `n_windows` largest windows.
+
+    None : :class:`NoneType`
+        If ``pyWindow`` failed.
+
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        pw_molecule = pywindow.molecular.Molecule.load_rdkit_mol(mol)
+        # Find windows and get a single array with windows' sizes.
+        all_windows = pw_molecule.calculate_windows(output='windows')
+
+    # If pyWindow failed, return ``None``.
+    if all_windows is None:
+        return None
+
+    all_windows = sorted(all_windows, reverse=True)[:n_windows]
+    # Return ``None`` when pyWindow outputs a mistakenly large window
+    # size.
+    if any(x > 500 for x in all_windows):
+        return None
+    return all_windows
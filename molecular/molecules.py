@@ -148,7 +148,8 @@ class does the assembly of the macromolecule from the building blocks.
 """
 
 import tempfile
-import warnings
+import ast
+import copy
 import logging
 import json
 import os
@@ -173,17 +174,286 @@ from inspect import signature
 from . import topologies
 from .fg_info import functional_groups
 from .energy import Energy
-import pywindow
+from .ensemble import Ensemble, _windows
 from ..convenience_tools import (flatten, periodic_table,
                                  normalize_vector, rotation_matrix,
                                  vector_theta, mol_from_mae_file,
                                  rotation_matrix_arbitrary_axis,
-                                 atom_vdw_radii, bond_dict, Cell)
+                                 atom_vdw_radii, bond_dict, Cell,
+                                 eval_literal, to_json_value,
+                                 from_json_value, coords_from_mae_file,
+                                 coords_from_mol_file,
+                                 set_conformer_positions,
+                                 AtomMismatchError, MolFileError,
+                                 ChargedMolError, AtomTypeError,
+                                 MAE_HEADER)
 
 
 logger = logging.getLogger(__name__)
 # Toggles caching when making molecules.
 CACHE_SETTINGS = {'ON': True}
+# Maps the JSON representation of a topology to its class and
+# parameters. Used so that loading a population does not parse the
+# same representation for every molecule.
+_topology_table = {}
+
+
+# MacroModel atom types of neutral atoms of common elements, by the
+# hybridization of the atom. Hydrogen atoms are typed by the element
+# they are bonded to. MacroModel assigns force field atom types from
+# these and the bonds of the structure. Atoms which are not covered,
+# such as charged atoms and metals, are typed by ``structconvert``.
+_mmod_types = {
+    'C': {'SP': 1, 'SP2': 2, 'SP3': 3},
+    'N': {'SP': 24, 'SP2': 25, 'SP3': 26},
+    'O': {'SP2': 15, 'SP3': 16},
+    'H': {'C': 41, 'O': 42, 'N': 43},
+    'S': 49,
+    'P': 53,
+    'F': 56,
+    'Cl': 57,
+    'Br': 58,
+    'I': 59,
+    'Si': 60
+}
+
+
+def _mmod_type(atom):
+    """
+    Returns the MacroModel atom type of an atom.
+
+    Parameters
+    ----------
+    atom : :class:`rdkit.Chem.rdchem.Atom`
+        An atom of a kekulized molecule.
+
+    Returns
+    -------
+    :class:`int`
+        The MacroModel atom type. ``None`` if the atom is not covered
+        by :data:`_mmod_types`.
+
+    """
+
+    types = _mmod_types.get(atom.GetSymbol())
+    if (types is None or
+            atom.GetFormalCharge() != 0 or
+            atom.GetNumRadicalElectrons() != 0):
+        return None
+    if isinstance(types, int):
+        return types
+
+    # Hydrogen atoms are typed by the atom they are bonded to.
+    if atom.GetSymbol() == 'H':
+        neighbors = [n.GetSymbol() for n in atom.GetNeighbors()]
+        if len(neighbors) != 1:
+            return None
+        return types.get(neighbors[0])
+
+    # The hybridization is found from the bonds, rather than asked of
+    # ``rdkit``, as it is only set for sanitized molecules.
+    orders = [b.GetBondTypeAsDouble() for b in atom.GetBonds()]
+    if 3 in orders or orders.count(2) > 1:
+        hybridization = 'SP'
+    elif 2 in orders:
+        hybridization = 'SP2'
+    else:
+        hybridization = 'SP3'
+    return types.get(hybridization)
+
+
+def _mae_columns(mol):
+    """
+    Returns the parts of a ``.mae`` block set by the graph of `mol`.
+
+    Parameters
+    ----------
+    mol : :class:`rdkit.Chem.rdchem.Mol`
+        A kekulized molecule.
+
+    Returns
+    -------
+    :class:`tuple`
+        The start of each atom line, up to the coordinates, the end of
+        each atom line, after the coordinates, the bond lines and the
+        atoms which have no MacroModel type.
+
+    """
+
+    # id mmod_type x y z atomic_number formal_charge
+    atoms = list(mol.GetAtoms())
+    mmod_types = [_mmod_type(atom) for atom in atoms]
+    untyped = [f'{atom.GetSymbol()}{atom.GetIdx()}' for
+               atom, mmod_type in zip(atoms, mmod_types) if
+               mmod_type is None]
+    starts = [f'  {i} {mmod_type} ' for
+              i, mmod_type in enumerate(mmod_types, 1)]
+    ends = [f' {atom.GetAtomicNum()} {atom.GetFormalCharge()}\n' for
+            atom in atoms]
+
+    # id atom1 atom2 bond_order
+    bond_lines = []
+    for bond in mol.GetBonds():
+        bond_order = bond.GetBondTypeAsDouble()
+        # Ensure that no information is lost when converting double to
+        # int.
+        assert bond_order == int(bond_order)
+        bond_lines.append(
+            f'  {bond.GetIdx()+1} {bond.GetBeginAtomIdx()+1} '
+            f'{bond.GetEndAtomIdx()+1} {int(bond_order)}\n'
+        )
+
+    return starts, ends, bond_lines, untyped
+
+
+def _mdl_columns(mol):
+    """
+    Returns the parts of a V3000 mol block set by the graph of `mol`.
+
+    Parameters
+    ----------
+    mol : :class:`rdkit.Chem.rdchem.Mol`
+        A kekulized molecule.
+
+    Returns
+    -------
+    :class:`tuple`
+        The start of each atom line, up to the coordinates, the end of
+        each atom line, after the coordinates, and the bond lines.
+
+    """
+
+    # id atomic_symbol x y z
+    atoms = list(mol.GetAtoms())
+    starts = [f'M  V30 {i} {periodic_table[atom.GetAtomicNum()]} ' for
+              i, atom in enumerate(atoms, 1)]
+    ends = [' 0\n' if charge == 0 else f' 0 CHG={charge}\n' for
+            charge in (atom.GetFormalCharge() for atom in atoms)]
+
+    # id bond_order atom1 atom2
+    bond_lines = []
+    for bond in mol.GetBonds():
+        bond_order = bond.GetBondTypeAsDouble()
+        # Ensure that no information is lost when converting double to
+        # int.
+        assert bond_order == int(bond_order)
+        bond_lines.append(
+            f'M  V30 {bond.GetIdx()} {int(bond_order)} '
+            f'{bond.GetBeginAtomIdx()+1} {bond.GetEndAtomIdx()+1}\n'
+        )
+
+    return starts, ends, bond_lines
+
+
+def _topology_from_json(topology_json):
+    """
+    Returns the :class:`.Topology` represented by `topology_json`.
+
+    Each representation is only parsed once, but a new
+    :class:`.Topology` is made on every call. Topologies are not
+    shared between molecules because building a molecule can change
+    its topology, for example periodic topologies scale their cell.
+
+    Parameters
+    ----------
+    topology_json : :class:`dict` or :class:`str`
+        The representation made by :meth:`.Topology.json`. Older dump
+        files hold the ``repr`` of the topology instead, for example
+        ``'FourPlusSix(A_alignments=None, B_alignments=None)'``.
+        This is parsed without using :func:`eval`.
+
+    Returns
+    -------
+    :class:`.Topology`
+        The topology represented by `topology_json`.
+
+    Raises
+    ------
+    :class:`ValueError`
+        If `topology_json` does not represent a topology.
+
+    """
+
+    if isinstance(topology_json, str):
+        table_key = topology_json
+    else:
+        table_key = json.dumps(topology_json, sort_keys=True)
+
+    if table_key not in _topology_table:
+        _topology_table[table_key] = _parse_topology(topology_json)
+
+    cls, params = _topology_table[table_key]
+    return cls(**copy.deepcopy(params))
+
+
+def _parse_topology(topology_json):
+    """
+    Returns the class and parameters of a topology representation.
+
+    Parameters
+    ----------
+    topology_json : :class:`dict` or :class:`str`
+        The representation made by :meth:`.Topology.json` or the
+        ``repr`` of the topology.
+
+    Returns
+    -------
+    :class:`tuple`
+        The :class:`.Topology` subclass and a :class:`dict` holding
+        the parameters it is initialized with.
+
+    Raises
+    ------
+    :class:`ValueError`
+        If `topology_json` does not represent a topology.
+
+    """
+
+    if isinstance(topology_json, str):
+        # Legacy reprs have the form "TopologyName(arg1=1, arg2=2)".
+        expr = ast.parse(topology_json.strip(), mode='eval').body
+        if (not isinstance(expr, ast.Call) or
+                not isinstance(expr.func, ast.Name) or
+                expr.args):
+            raise ValueError(f'"{topology_json}" is not a topology.')
+        name = expr.func.id
+        params = {x.arg: eval_literal(x.value) for x in expr.keywords}
+    else:
+        name = topology_json['class']
+        params = from_json_value(topology_json['params'])
+
+    cls = getattr(topologies, name, None)
+    if not (isinstance(cls, type) and
+            issubclass(cls, topologies.Topology)):
+        raise ValueError(f'"{name}" is not a topology.')
+
+    return cls, params
+
+
+def _fitness_from_json(fitness_json):
+    """
+    Returns the unscaled fitness represented by `fitness_json`.
+
+    Parameters
+    ----------
+    fitness_json : :class:`object`
+        The value made by :meth:`MacroMolecule.json`. Older dump files
+        hold the ``repr`` of the fitness value instead, which is parsed
+        without using :func:`eval`, or the value made by
+        :func:`.to_json_value` without its ``'__json__'`` tag.
+
+    Returns
+    -------
+    :class:`object`
+        The unscaled fitness.
+
+    """
+
+    if isinstance(fitness_json, dict) and '__json__' in fitness_json:
+        return from_json_value(fitness_json['__json__'])
+    if isinstance(fitness_json, str):
+        return eval_literal(fitness_json)
+    return from_json_value(fitness_json)
 
 
 class Cached(type):
@@ -291,11 +561,16 @@ class Molecule:
         A note or comment about the molecule. Purely optional but can
         be useful for labelling and debugging.
 
+    ensemble : :class:`.Ensemble`
+        Holds the conformers found by a conformer search, if one was
+        run. ``None`` otherwise.
+
     """
 
     def __init__(self, name="", note=""):
         self.optimized = False
         self.energy = Energy(self)
+        self.ensemble = None
         self.bonder_ids = []
         self.name = name
         self.note = note
@@ -738,6 +1013,134 @@ class Molecule:
 
         return maxd, maxid1, maxid2
 
+    def _block_columns(self, block, make_columns):
+        """
+        Returns the parts of a structure block set by the graph.
+
+        The parts of the lines of a structure block which do not
+        depend on the coordinates are only made the first time the
+        block is written, or after the molecule is replaced or its
+        atoms or bonds change in number. Writing the block again, for
+        example for another conformer or after an optimization, then
+        only needs the coordinates to be formatted.
+
+        Parameters
+        ----------
+        block : :class:`str`
+            The name of the block.
+
+        make_columns : :class:`function`
+            Takes :attr:`mol` and returns the parts of the block.
+
+        Returns
+        -------
+        :class:`object`
+            The value returned by `make_columns`.
+
+        """
+
+        mol = self.mol
+        blocks = self.__dict__.setdefault('_blocks', {})
+        cached = blocks.get(block)
+        if (cached is not None and
+           cached[0] is mol and
+           cached[1] == mol.GetNumAtoms() and
+           cached[2] == mol.GetNumBonds()):
+            return cached[3]
+
+        columns = make_columns(mol)
+        blocks[block] = (mol, mol.GetNumAtoms(), mol.GetNumBonds(), columns)
+        return columns
+
+    def mae_block(self, conformer=-1, title=None):
+        """
+        Returns a ``.mae`` structure block of the molecule.
+
+        The block can be read by MacroModel without being converted
+        by ``structconvert``. A ``.mae`` file holds
+        :data:`.MAE_HEADER` followed by one block for each structure.
+        Only molecules made of neutral atoms of the elements in
+        :data:`_mmod_types` can be written.
+
+        Parameters
+        ----------
+        conformer : :class:`int`, optional
+            The id of the conformer to use.
+
+        title : :class:`str`, optional
+            The title of the structure. If ``None``, :attr:`name` is
+            used.
+
+        Returns
+        -------
+        :class:`str`
+            The "f_m_ct" block representing the molecule.
+
+        Raises
+        ------
+        :class:`.AtomTypeError`
+            If the MacroModel type of an atom is not known.
+
+        """
+
+        # Kekulize the mol, which means that each aromatic bond is
+        # converted to a single or double. This is necessary because
+        # .mae files only support integer bond orders.
+        try:
+            rdkit.Kekulize(self.mol)
+        except ValueError:
+            pass
+
+        if title is None:
+            title = '' if self.name is None else str(self.name)
+        # Quotes end a string in .mae files.
+        title = title.replace('"', '')
+
+        # Only the coordinates are formatted here, the rest of each
+        # line depends only on the graph of the molecule.
+        starts, ends, bond_lines, untyped = self._block_columns(
+                                                        'mae',
+                                                        _mae_columns)
+        if untyped:
+            raise AtomTypeError(f'No MacroModel type for '
+                                f'{", ".join(untyped)} of "{title}".')
+
+        coords = self.mol.GetConformer(conformer).GetPositions()
+        atom_lines = map('{}{:.6f} {:.6f} {:.6f}{}'.format,
+                         starts,
+                         *coords.T.tolist(),
+                         ends)
+
+        return ''.join([
+            'f_m_ct {\n'
+            ' s_m_title\n'
+            ' :::\n'
+            f' "{title}"\n'
+            f' m_atom[{len(starts)}] {{\n'
+            '  # First column is atom index #\n'
+            '  i_m_mmod_type\n'
+            '  r_m_x_coord\n'
+            '  r_m_y_coord\n'
+            '  r_m_z_coord\n'
+            '  i_m_atomic_number\n'
+            '  i_m_formal_charge\n'
+            '  :::\n',
+            *atom_lines,
+            '  :::\n'
+            ' }\n'
+            f' m_bond[{len(bond_lines)}] {{\n'
+            '  # First column is bond index #\n'
+            '  i_m_from\n'
+            '  i_m_to\n'
+            '  i_m_order\n'
+            '  :::\n',
+            *bond_lines,
+            '  :::\n'
+            ' }\n'
+            '}\n'
+            '\n'
+        ])
+
     def mdl_mol_block(self, conformer=-1):
         """
         Returns a V3000 mol block of the molecule.
@@ -754,33 +1157,6 @@ class Molecule:
 
         """
 
-        main_string = ("\n"
-                       "     RDKit          3D\n"
-                       "\n"
-                       "  0  0  0  0  0  0  0  0  0  0999 V3000\n"
-                       "M  V30 BEGIN CTAB\n"
-                       "M  V30 COUNTS {0} {1} 0 0 0\n"
-                       "M  V30 BEGIN ATOM\n"
-                       "!!!ATOM!!!BLOCK!!!HERE!!!\n"
-                       "M  V30 END ATOM\n"
-                       "M  V30 BEGIN BOND\n"
-                       "!!!BOND!!!BLOCK!!!HERE!!!\n"
-                       "M  V30 END BOND\n"
-                       "M  V30 END CTAB\n"
-                       "M  END\n"
-                       "\n"
-                       "$$$$\n")
-
-        # id atomic_symbol x y z
-        atom_line = "M  V30 {} {} {:.4f} {:.4f} {:.4f} 0{}\n"
-        atom_block = ""
-
-        # id bond_order atom1 atom2
-        bond_line = "M  V30 {} {} {} {}\n"
-        bond_block = ""
-
-        main_string = main_string.format(self.mol.GetNumAtoms(),
-                                         self.mol.GetNumBonds())
         # Kekulize the mol, which means that each aromatic bond is
         # converted to a single or double. This is necessary because
         # .mol V3000 only supports integer bonds. However, this fails
@@ -790,33 +1166,34 @@ class Molecule:
         except ValueError:
             pass
 
-        for atom in self.mol.GetAtoms():
-            atom_id = atom.GetIdx()
-            atom_sym = periodic_table[atom.GetAtomicNum()]
-            charge = atom.GetFormalCharge()
-            charge = '' if charge == 0 else f' CHG={charge}'
-            x, y, z = self.atom_coords(atom_id, conformer)
-            atom_block += atom_line.format(atom_id+1,
-                                           atom_sym,
-                                           x, y, z,
-                                           charge)
-
-        for bond in self.mol.GetBonds():
-            bond_id = bond.GetIdx()
-            atom1_id = bond.GetBeginAtomIdx() + 1
-            atom2_id = bond.GetEndAtomIdx() + 1
-            bond_order = int(bond.GetBondTypeAsDouble())
-            # Ensure that no information was lost when converting
-            # double to int.
-            assert bond_order == bond.GetBondTypeAsDouble()
-            bond_block += bond_line.format(bond_id, bond_order,
-                                           atom1_id, atom2_id)
-
-        main_string = main_string.replace(
-                            "!!!ATOM!!!BLOCK!!!HERE!!!\n", atom_block)
-
-        return main_string.replace(
-                            "!!!BOND!!!BLOCK!!!HERE!!!\n", bond_block)
+        # Only the coordinates are formatted here, the rest of each
+        # line depends only on the graph of the molecule.
+        starts, ends, bond_lines = self._block_columns('mdl',
+                                                       _mdl_columns)
+        coords = self.mol.GetConformer(conformer).GetPositions()
+        atom_lines = map('{}{:.4f} {:.4f} {:.4f}{}'.format,
+                         starts,
+                         *coords.T.tolist(),
+                         ends)
+
+        return ''.join([
+            '\n'
+            '     RDKit          3D\n'
+            '\n'
+            '  0  0  0  0  0  0  0  0  0  0999 V3000\n'
+            'M  V30 BEGIN CTAB\n'
+            f'M  V30 COUNTS {len(starts)} {len(bond_lines)} 0 0 0\n'
+            'M  V30 BEGIN ATOM\n',
+            *atom_lines,
+            'M  V30 END ATOM\n'
+            'M  V30 BEGIN BOND\n',
+            *bond_lines,
+            'M  V30 END BOND\n'
+            'M  V30 END CTAB\n'
+            'M  END\n'
+            '\n'
+            '$$$$\n'
+        ])
 
     def position_matrix(self, conformer=-1):
         """
@@ -1131,6 +1508,10 @@ class Molecule:
         """
         Updates molecular structure to match an ``.mae`` file.
 
+        Only the coordinates of the conformer are updated. The atoms
+        in the file must be the same, and in the same order, as the
+        atoms in :attr:`mol`.
+
         Parameters
         ----------
         path : :class:`str`
@@ -1138,27 +1519,59 @@ class Molecule:
             should be updated.
 
         conformer : :class:`int`, optional
-            The conformer to be updated.
+            The conformer to be updated. If the molecule does not have
+            a conformer with this id, it is added.
 
         Returns
         -------
         None : :class:`NoneType`
 
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms in the file do not match the atoms in
+            :attr:`mol`.
+
         """
 
-        if conformer == -1:
-            conformer = self.mol.GetConformer(conformer).GetId()
+        atomic_nums, coords = coords_from_mae_file(path)
+        self._update_conformer(path, atomic_nums, coords, conformer)
 
-        mol = mol_from_mae_file(path)
-        conf = rdkit.Conformer(mol.GetConformer())
-        conf.SetId(conformer)
-        self.mol.RemoveConformer(conformer)
-        self.mol.AddConformer(conf)
+    def update_ensemble(self, path, structures):
+        """
+        Replaces :attr:`ensemble` with structures read from a file.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The path of the file the structures were read from.
+
+        structures : :class:`list` of :class:`tuple`
+            Each :class:`tuple` holds the energy, atomic numbers and
+            coordinates of a structure.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms of a structure do not match the atoms in
+            :attr:`mol`.
+
+        """
+
+        self.ensemble = Ensemble.from_structures(self, path, structures)
 
     def update_from_mol(self, path, conformer=-1):
         """
         Updates molecular structure to match an ``.mol`` file.
 
+        Only the coordinates of the conformer are updated. The atoms
+        in the file must be the same, and in the same order, as the
+        atoms in :attr:`mol`.
+
         Parameters
         ----------
         path : :class:`str`
@@ -1166,22 +1579,152 @@ class Molecule:
             should be updated.
 
         conformer : :class:`int`, optional
-            The conformer to be updated.
+            The conformer to be updated. If the molecule does not have
+            a conformer with this id, it is added.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms in the file do not match the atoms in
+            :attr:`mol`.
+
+        :class:`RuntimeError`
+            If the file cannot be read.
+
+        """
+
+        try:
+            atomic_nums, coords = coords_from_mol_file(path)
+        # Fall back to rdkit for files the fast reader does not
+        # support, such as V2000 files or ones with charged atoms.
+        except (MolFileError, ChargedMolError):
+            mol = rdkit.MolFromMolFile(path,
+                                       sanitize=False,
+                                       removeHs=False)
+            if mol is None:
+                raise RuntimeError(f'"{path}" could not be read.')
+            atomic_nums = [a.GetAtomicNum() for a in mol.GetAtoms()]
+            coords = mol.GetConformer().GetPositions()
+
+        self._update_conformer(path, atomic_nums, coords, conformer)
+
+    def update_from_pdb(self, path, conformer=-1):
+        """
+        Updates molecular structure to match a ``.pdb`` file.
+
+        Only the coordinates of the conformer are updated. The atoms
+        in the file must be the same, and in the same order, as the
+        atoms in :attr:`mol`.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The full path of the ``.pdb`` file from which the structure
+            should be updated.
+
+        conformer : :class:`int`, optional
+            The conformer to be updated. If the molecule does not have
+            a conformer with this id, it is added.
 
         Returns
         -------
         None : :class:`NoneType`
 
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms in the file do not match the atoms in
+            :attr:`mol`.
+
+        :class:`RuntimeError`
+            If the file cannot be read.
+
+        """
+
+        mol = rdkit.MolFromPDBFile(path, sanitize=False, removeHs=False)
+        # rdkit returns None, or a molecule without atoms, for files it
+        # cannot read, for example the output of a failed MOPAC run.
+        if mol is None or mol.GetNumConformers() == 0:
+            raise RuntimeError(f'"{path}" could not be read.')
+        atomic_nums = [a.GetAtomicNum() for a in mol.GetAtoms()]
+        coords = mol.GetConformer().GetPositions()
+        self._update_conformer(path, atomic_nums, coords, conformer)
+
+    def _update_conformer(self, path, atomic_nums, coords, conformer):
         """
+        Overwrites the coordinates of a conformer.
+
+        This function should not be used directly, only via the
+        :meth:`update_from_mae`, :meth:`update_from_mol` and
+        :meth:`update_from_pdb` methods.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The path of the file which `atomic_nums` and `coords`
+            were read from. Used when reporting errors.
+
+        atomic_nums : :class:`list` of :class:`int`
+            The atomic number of every atom in the file.
+
+        coords : :class:`numpy.ndarray`
+            An ``(n, 3)`` array holding the coordinates of every atom
+            in the file.
+
+        conformer : :class:`int`
+            The conformer to be updated. If the molecule does not have
+            a conformer with this id, it is added.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        Raises
+        ------
+        :class:`.AtomMismatchError`
+            If the atoms in the file do not match the atoms in
+            :attr:`mol`.
+
+        """
+
+        # Make sure the file holds the same atoms, in the same order.
+        # Otherwise the coordinates would be assigned to the wrong
+        # atoms.
+        atomic_nums = np.asarray(atomic_nums)
+        expected = np.array([a.GetAtomicNum() for
+                             a in self.mol.GetAtoms()])
+        if len(atomic_nums) != len(expected):
+            raise AtomMismatchError(
+                path,
+                (f'File has {len(atomic_nums)} atoms but the '
+                 f'molecule has {len(expected)} atoms.'))
+
+        mismatches = np.flatnonzero(atomic_nums != expected)
+        if len(mismatches):
+            msg = ', '.join(
+                f'atom {i} is {periodic_table[expected[i]]} in the '
+                f'molecule but {periodic_table[atomic_nums[i]]} '
+                'in the file' for i in mismatches[:5])
+            raise AtomMismatchError(
+                path,
+                (f'{len(mismatches)} atoms of the molecule do not '
+                 f'match the file: {msg}.'))
 
         if conformer == -1:
             conformer = self.mol.GetConformer(conformer).GetId()
 
-        mol = rdkit.MolFromMolFile(path, sanitize=False, removeHs=False)
-        conf = rdkit.Conformer(mol.GetConformer())
-        conf.SetId(conformer)
-        self.mol.RemoveConformer(conformer)
-        self.mol.AddConformer(conf)
+        if any(c.GetId() == conformer for c in self.mol.GetConformers()):
+            set_conformer_positions(self.mol.GetConformer(conformer),
+                                    coords)
+        else:
+            conf = rdkit.Conformer(self.mol.GetNumAtoms())
+            conf.SetId(conformer)
+            set_conformer_positions(conf, coords)
+            self.mol.AddConformer(conf)
 
     def update_stereochemistry(self, conformer=-1):
         """
@@ -1227,12 +1770,40 @@ class Molecule:
 
         write_funcs = {'.mol': self._write_mdl_mol_file,
                        '.sdf': self._write_mdl_mol_file,
+                       '.mae': self._write_mae_file,
                        '.pdb': self._write_pdb_file}
 
         _, ext = os.path.splitext(path)
         write_func = write_funcs[ext]
         write_func(path, conformer)
 
+    def _write_mae_file(self, path, conformer=-1):
+        """
+        Writes a ``.mae`` file of the molecule.
+
+        This function should not be used directly, only via
+        :meth:`write`.
+
+        Parameters
+        ----------
+        path : :class:`str`
+            The full path to the file being written.
+
+        conformer : :class:`int`, optional
+            The conformer to use.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        # The block is made first, so that no file is left behind if
+        # it cannot be.
+        block = self.mae_block(conformer)
+        with open(path, 'w') as f:
+            f.write(MAE_HEADER + block)
+
     def _write_mdl_mol_file(self, path, conformer=-1):
         """
         Writes a V3000 ``.mol`` file of the molecule
@@ -2689,20 +3260,37 @@ class MacroMolecule(Molecule, metaclass=Cached):
                 'mol_block' : '''A string holding the V3000 mol
                                  block of the molecule.'''
                 'building_blocks' : {bb1.json(), bb2.json()}
-                'topology' : 'Copolymer(repeating_unit="AB")'
-                'unscaled_fitness' : {'fitness_func1' : fitness1,
-                                      'fitness_func2' : fitness2},
+                'topology' : {'class': 'Linear',
+                              'params': {'repeating_unit': 'AB',
+                                         ...}},
+                'unscaled_fitness' : {'__json__': {
+                                        'fitness_func1' : fitness1,
+                                        'fitness_func2' : fitness2}},
                 'note' : 'A nice molecule.',
                 'name' : 'Poly-Benzene'
             }
 
+        The topology and unscaled fitness are converted with
+        :meth:`.Topology.json` and :func:`.to_json_value`, so that
+        they can be loaded without :func:`eval`. The converted fitness
+        is tagged with ``'__json__'``, which tells it apart from the
+        ``repr`` held by older dump files.
+
         Returns
         -------
         :class:`dict`
             A :class:`dict` which represents the molecule.
 
+        Raises
+        ------
+        :class:`TypeError`
+            If the unscaled fitness holds an object which cannot be
+            converted by :func:`.to_json_value`.
+
         """
 
+        fitness = {'__json__': to_json_value(self.unscaled_fitness)}
+
         return {
             'bb_counter': [(key.json(), val) for key, val in
                            self.bb_counter.items()],
@@ -2713,8 +3301,8 @@ class MacroMolecule(Molecule, metaclass=Cached):
             'mol_block': self.mdl_mol_block(),
             'building_blocks': [x.json() for x in
                                 self.building_blocks],
-            'topology': repr(self.topology),
-            'unscaled_fitness': repr(self.unscaled_fitness),
+            'topology': self.topology.json(),
+            'unscaled_fitness': fitness,
             'progress_params': self.progress_params,
             'note': self.note,
             'name': self.name,
@@ -2747,7 +3335,7 @@ class MacroMolecule(Molecule, metaclass=Cached):
         bbs = [Molecule.from_dict(x) for x in
                json_dict['building_blocks']]
 
-        topology = eval(json_dict['topology'],  topologies.__dict__)
+        topology = _topology_from_json(json_dict['topology'])
 
         key = cls.gen_key(bbs, topology)
         if key in cls.cache and CACHE_SETTINGS['ON']:
@@ -2758,14 +3346,15 @@ class MacroMolecule(Molecule, metaclass=Cached):
                                         sanitize=False,
                                         removeHs=False)
         obj.topology = topology
-        obj.unscaled_fitness = eval(json_dict['unscaled_fitness'],
-                                    np.__dict__)
+        obj.unscaled_fitness = _fitness_from_json(
+                                        json_dict['unscaled_fitness'])
         obj.fitness = None
         obj.progress_params = json_dict['progress_params']
         obj.bb_counter = Counter({Molecule.from_dict(key): val for
                                   key, val in json_dict['bb_counter']})
         obj.bonds_made = json_dict['bonds_made']
         obj.energy = Energy(obj)
+        obj.ensemble = None
         obj.bonder_ids = json_dict['bonder_ids']
         obj.fg_ids = set(json_dict['fg_ids'])
         obj.optimized = json_dict['optimized']
@@ -2959,6 +3548,7 @@ class MacroMolecule(Molecule, metaclass=Cached):
             macro_mol = cls.__new__(cls)
             macro_mol.building_blocks = [bb1, bb2]
             macro_mol.topology = topology
+            macro_mol.ensemble = None
             MacroMolecule.cache[key] = macro_mol
             return macro_mol
 
@@ -3072,33 +3662,12 @@ class Cage(MacroMolecule):
 
         """
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            # Load an RDKit molecule object to pyWINDOW.
-
-            # As pyWindow doesnt support multiple conformers, first
-            # make an rdkit molecule holding only the desired conformer.
-            new_mol = rdkit.Mol(self.mol)
-            new_mol.RemoveAllConformers()
-            new_mol.AddConformer(self.mol.GetConformer(conformer))
-
-            pw_molecule = pywindow.molecular.Molecule.load_rdkit_mol(new_mol)
-            # Find windows and get a single array with windows' sizes.
-            all_windows = pw_molecule.calculate_windows(output='windows')
-
-        # If pyWindow failed, return ``None``.
-        if all_windows is None:
-            return None
-
-        all_windows = sorted(all_windows,
-                             reverse=True)[:self.topology.n_windows]
-        for i, x in enumerate(all_windows):
-            # Return ``None`` when pyWindow fucks up and outputs
-            # a mistakenly large window size.
-            if x > 500:
-                return None
-
-        return all_windows
+        # As pyWindow doesnt support multiple conformers, first
+        # make an rdkit molecule holding only the desired conformer.
+        new_mol = rdkit.Mol(self.mol)
+        new_mol.RemoveAllConformers()
+        new_mol.AddConformer(self.mol.GetConformer(conformer))
+        return _windows(new_mol, self.topology.n_windows)
 
 
 class Polymer(MacroMolecule):
@@ -54,7 +54,8 @@ from itertools import chain
 from inspect import signature
 
 from ..fg_info import double_bond_combs
-from ...convenience_tools import dedupe, flatten, add_fragment_props
+from ...convenience_tools import (dedupe, flatten, add_fragment_props,
+                                  to_json_value)
 
 
 def remove_confs(building_blocks, keep):
@@ -128,6 +129,9 @@ class TopologyMeta(type):
         c = ', '.join("{!s}={!r}".format(key, value) for key, value in
                       sorted(sig.items()))
         obj._repr = "{}({})".format(self.__name__, c)
+        # Keep the arguments so that the object can be written to and
+        # loaded from JSON without parsing the repr.
+        obj._params = sig
         return obj
 
 
@@ -294,6 +298,32 @@ class Topology(metaclass=TopologyMeta):
         else:
             return rdkit.rdchem.BondType.SINGLE
 
+    def json(self):
+        """
+        Returns a JSON representation of the topology.
+
+        The representation has the form
+
+        .. code-block:: python
+
+            {
+                'class': 'FourPlusSix',
+                'params': {'A_alignments': None, 'B_alignments': None}
+            }
+
+        where ``'params'`` holds the arguments used to initialize the
+        topology, converted by :func:`.to_json_value`.
+
+        Returns
+        -------
+        :class:`dict`
+            A :class:`dict` which represents the topology.
+
+        """
+
+        return {'class': self.__class__.__name__,
+                'params': to_json_value(self._params)}
+
     def __str__(self):
         return repr(self)
 
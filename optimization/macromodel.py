@@ -4,16 +4,32 @@ Defines optimization functions which use MacroModel.
 """
 
 import os
-import subprocess as sp
 import time
 import rdkit.Chem.AllChem as rdkit
 import warnings
-import psutil
 import re
+import random
+import threading
+import tempfile
+from itertools import count
+from contextlib import contextmanager, nullcontext
 from uuid import uuid4
+from types import SimpleNamespace
 import logging
 
-from ..convenience_tools import MAEExtractor
+# ``fcntl`` is not available on Windows. There, MacroModel jobs are
+# not limited by :func:`set_macromodel_licenses`.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..convenience_tools import (MAEExtractor,
+                                 run_program,
+                                 wait_for_file,
+                                 structures_from_mae_file,
+                                 AtomTypeError,
+                                 MAE_HEADER)
 
 
 logger = logging.getLogger(__name__)
@@ -141,21 +157,17 @@ def macromodel_opt(mol,
         vals['lewis_fixed'] = False
 
     try:
-        mol._file = '{}.mol'.format(uuid4().int)
-        # First write a .mol file of the molecule.
-        mol.write(mol._file, conformer)
+        mol._file = '{}.mae'.format(uuid4().int)
         # MacroModel requires a ``.mae`` file as input. This creates a
         # ``.mae`` file holding the molecule.
-        _create_mae(mol, macromodel_path)
+        _create_mae(mol, macromodel_path, conformer)
         # generate the ``.com`` file for the MacroModel run.
         _generate_com(mol, vals)
         # Run the optimization.
         _run_bmin(mol, macromodel_path, vals['timeout'])
-        # Get the ``.maegz`` file output from the optimization and
-        # convert it to a ``.mae`` file.
-        _convert_maegz_to_mae(mol, macromodel_path)
-        mol.update_from_mae(mol._file.replace('.mol', '.mae'),
-                            conformer)
+        # Read the optimized structure from the ``.maegz`` file output
+        # by the optimization.
+        _update_from_output(mol, conformer)
 
         if vals['restricted'] == 'both':
             new_vals = dict(vals)
@@ -197,7 +209,7 @@ def macromodel_opt(mol,
         logger.warning(('Attempting to fix Lewis '
                         'structure of "{}".'.format(mol.name)))
         if not vals['lewis_fixed']:
-            _run_applyhtreat(mol, macromodel_path)
+            _run_applyhtreat(mol, macromodel_path, conformer)
             vals['lewis_fixed'] = True
             return macromodel_opt(mol,
                                   macromodel_path,
@@ -310,21 +322,17 @@ def macromodel_cage_opt(mol,
         vals['lewis_fixed'] = False
 
     try:
-        mol._file = '{}.mol'.format(uuid4().int)
-        # First write a .mol file of the molecule.
-        mol.write(mol._file, conformer)
+        mol._file = '{}.mae'.format(uuid4().int)
         # MacroModel requires a ``.mae`` file as input. This creates a
         # ``.mae`` file holding the molecule.
-        _create_mae(mol, macromodel_path)
+        _create_mae(mol, macromodel_path, conformer)
         # generate the ``.com`` file for the MacroModel run.
         _generate_com(mol, vals)
         # Run the optimization.
         _run_bmin(mol, macromodel_path, vals['timeout'])
-        # Get the ``.maegz`` file output from the optimization and
-        # convert it to a ``.mae`` file.
-        _convert_maegz_to_mae(mol, macromodel_path)
-        mol.update_from_mae(mol._file.replace('.mol', '.mae'),
-                            conformer)
+        # Read the optimized structure from the ``.maegz`` file output
+        # by the optimization.
+        _update_from_output(mol, conformer)
 
         if vals['restricted'] == 'both':
             new_vals = dict(vals)
@@ -373,7 +381,7 @@ def macromodel_cage_opt(mol,
         logger.warning(('Attempting to fix Lewis '
                         'structure of "{}".'.format(mol.name)))
         if not vals['lewis_fixed']:
-            _run_applyhtreat(mol, macromodel_path)
+            _run_applyhtreat(mol, macromodel_path, conformer)
             vals['lewis_fixed'] = True
             return macromodel_cage_opt(mol,
                                        macromodel_path,
@@ -384,6 +392,160 @@ def macromodel_cage_opt(mol,
             raise ex
 
 
+def macromodel_batch_opt(mols,
+                         macromodel_path,
+                         settings=None,
+                         md=None,
+                         conformer=-1):
+    """
+    Optimizes many molecules with a single MacroModel job.
+
+    Every MacroModel job pays for the start up of Schrodinger's job
+    control and a license checkout, which take several seconds. This
+    function writes all molecules into one ``.mae`` file and
+    minimizes them with one ``bmin`` job, so that these costs are paid
+    once per batch rather than once per molecule.
+
+    Restricted optimizations fix bonds by atom id, which differ
+    between molecules, and MD is run separately on each molecule. If
+    either is requested, the molecules are optimized one at a time
+    with :func:`macromodel_opt`. Molecules which are missing from the
+    output of the batch job, for example because the force field
+    failed on them, are also optimized one at a time, so that
+    :func:`macromodel_opt` can try to fix them. A molecule which
+    fails on its own does not stop the others from being optimized.
+
+    Parameters
+    ----------
+    mols : :class:`list` of :class:`.Molecule`
+        The molecules to optimize.
+
+    macromodel_path : :class:`str`
+        The full path of the Schrodinger suite within the user's
+        machine. For example, on a Linux machine this may be something
+        like ``'/opt/schrodinger2017-2'``.
+
+    settings : :class:`dict`, optional
+        The settings of the optimization. See :func:`macromodel_opt`.
+        The ``'timeout'`` applies to the whole batch.
+
+    md : :class:`dict`, optional
+        The settings of the MD conformer search. See
+        :func:`macromodel_opt`.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to be optimized.
+
+    Returns
+    -------
+    :class:`list` of :class:`bool`
+        For each molecule in `mols`, ``True`` if it was optimized and
+        ``False`` if its optimization failed.
+
+    """
+
+    if settings is None:
+        settings = {}
+    if md is None:
+        md = {}
+
+    vals = {
+             'restricted': True,
+             'timeout': 0,
+             'force_field': 16,
+             'max_iter': 2500,
+             'gradient': 0.05,
+             'md': False
+            }
+    vals.update(settings)
+
+    if vals['restricted'] or vals['md']:
+        return [_optimize_alone(mol,
+                                macromodel_path,
+                                settings,
+                                md,
+                                conformer) for mol in mols]
+
+    try:
+        job = _batch_job(mols, macromodel_path, conformer)
+        _generate_com(job, vals)
+        _run_bmin(job, macromodel_path, vals['timeout'])
+        structures = _batch_structures(job)
+    # If the whole batch failed, every molecule is optimized on its
+    # own.
+    except (_OptimizationError,
+            _ForceFieldError,
+            _LewisStructureError,
+            _ConversionError) as ex:
+        logger.warning(f'Batch optimization failed: {ex.message}')
+        structures = {}
+
+    optimized = []
+    for i, mol in enumerate(mols):
+        if i not in structures:
+            logger.warning(f'"{mol.name}" is missing from the batch '
+                           'optimization. Optimizing it on its own.')
+            optimized.append(_optimize_alone(mol,
+                                              macromodel_path,
+                                              settings,
+                                              md,
+                                              conformer))
+            continue
+
+        atomic_nums, coords = structures[i]
+        mol._update_conformer(_output_file(job),
+                              atomic_nums,
+                              coords,
+                              conformer)
+        optimized.append(True)
+
+    return optimized
+
+
+def _optimize_alone(mol, macromodel_path, settings, md, conformer):
+    """
+    Optimizes a molecule of a batch with :func:`macromodel_opt`.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule to optimize.
+
+    macromodel_path : :class:`str`
+        The full path of the Schrodinger suite within the user's
+        machine.
+
+    settings : :class:`dict`
+        The settings of the optimization. See :func:`macromodel_opt`.
+
+    md : :class:`dict`
+        The settings of the MD conformer search. See
+        :func:`macromodel_opt`.
+
+    conformer : :class:`int`
+        The id of the conformer to be optimized.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if `mol` was optimized and ``False`` if the
+        optimization failed.
+
+    """
+
+    try:
+        macromodel_opt(mol, macromodel_path, settings, md, conformer)
+        return True
+    except Exception:
+        logger.error(f'Optimization of "{mol.name}" failed.',
+                     exc_info=True)
+        return False
+
+
+# Used by :func:`.Population.optimize` to optimize batches of molecules.
+macromodel_opt.batch = macromodel_batch_opt
+
+
 def _macromodel_md_opt(mol,
                        macromodel_path,
                        settings=None,
@@ -391,6 +553,9 @@ def _macromodel_md_opt(mol,
     """
     Runs a MD conformer search on `mol`.
 
+    The lowest energy conformer found replaces `conformer`. All of
+    the conformers found are placed in :attr:`~.Molecule.ensemble`.
+
     Parameters
     ----------
     mol : `.Molecule`
@@ -471,19 +636,28 @@ def _macromodel_md_opt(mol,
 
     logger.info('Running MD on "{}".'.format(mol.name))
     try:
-        mol._file = '{}.mol'.format(uuid4().int)
-        # First write a .mol file of the molecule.
-        mol.write(mol._file, conformer)
+        mol._file = '{}.mae'.format(uuid4().int)
         # MacroModel requires a ``.mae`` file as input. This creates a
         # ``.mae`` file holding the molecule.
-        _create_mae(mol, macromodel_path)
+        _create_mae(mol, macromodel_path, conformer)
         # Generate the ``.com`` file for the MacroModel MD run.
         _generate_md_com(mol, vals)
         # Run the optimization.
         _run_bmin(mol, macromodel_path, vals['timeout'])
-        # Extract the lowest energy conformer into its own .mae file.
-        conformer_mae = MAEExtractor(mol._file).path
-        mol.update_from_mae(conformer_mae, conformer)
+        # Extract the conformers found by the MD. Their coordinates
+        # are kept in memory, rather than written to .mae files.
+        extractor = MAEExtractor(mol._file, vals['confs'], write=False)
+        # The lowest energy conformer becomes the structure of the
+        # molecule, while all of them are kept in its ensemble.
+        energy, num, atomic_nums, coords = extractor.conformers[0]
+        mol._update_conformer(extractor.maegz_path,
+                              atomic_nums,
+                              coords,
+                              conformer)
+        mol.update_ensemble(extractor.maegz_path,
+                            [(energy, atomic_nums, coords) for
+                             energy, num, atomic_nums, coords in
+                             extractor.conformers])
 
     except _ForceFieldError as ex:
         # If OPLS_2005 has been tried already - record an exception.
@@ -509,7 +683,7 @@ def _macromodel_md_opt(mol,
                         'structure of "{}".'.format(mol.name)))
         if not vals['lewis_fixed']:
             vals['lewis_fixed'] = True
-            _run_applyhtreat(mol, macromodel_path)
+            _run_applyhtreat(mol, macromodel_path, conformer)
             return _macromodel_md_opt(mol,
                                       macromodel_path,
                                       vals,
@@ -523,7 +697,7 @@ def _run_bmin(macro_mol, macromodel_path, timeout=0):
     logger.info('Running bmin on "{}".'.format(macro_mol.name))
 
     # To run MacroModel a command is issued to the console via
-    # ``subprocess.Popen``. The command is the full path of the
+    # :func:`_run_licensed`. The command is the full path of the
     # ``bmin`` program. ``bmin`` is located in the Schrodinger
     # installation folder.
     file_root, ext = os.path.splitext(macro_mol._file)
@@ -533,16 +707,10 @@ def _run_bmin(macro_mol, macromodel_path, timeout=0):
     # are any additional arguments.
 
     opt_cmd = [opt_app, file_root, "-WAIT", "-LOCAL"]
-    opt_proc = psutil.Popen(opt_cmd, stdout=sp.PIPE,
-                            stderr=sp.STDOUT,
-                            universal_newlines=True)
-    try:
-        if timeout:
-            proc_out, _ = opt_proc.communicate(timeout=timeout)
-        else:
-            proc_out, _ = opt_proc.communicate()
+    opt_proc = _run_licensed(opt_cmd, timeout or None, log_file)
+    proc_out = opt_proc.stdout
 
-    except sp.TimeoutExpired:
+    if opt_proc.timed_out:
         logger.warning(('Minimization took too long'
                         ' and was terminated '
                         'by force on "{}".').format(macro_mol.name))
@@ -579,14 +747,9 @@ def _run_bmin(macro_mol, macromodel_path, timeout=0):
         raise _PathError(('Wrong Schrodinger path supplied to'
                           ' `macromodel_opt` function.'))
 
-    # If optimization fails because the license is not found, rerun the
-    # function.
-    if not _license_found(proc_out, macro_mol):
-        return _run_bmin(macro_mol, macromodel_path, timeout)
-
     # Make sure the .maegz file created by the optimization is present.
     maegz = file_root + '-out.maegz'
-    _wait_for_file(maegz)
+    wait_for_file(maegz)
     if not os.path.exists(log_file) or not os.path.exists(maegz):
         raise _OptimizationError(('The .log and/or .maegz '
                                   'files were not created by '
@@ -598,85 +761,153 @@ def _kill_bmin(macro_mol, macromodel_path):
     name = re.split(r'\\|/', name)[-1]
     app = os.path.join(macromodel_path, 'jobcontrol')
     cmd = [app, '-stop', name]
-    out = sp.run(cmd, stdout=sp.PIPE,
-                 stderr=sp.STDOUT, universal_newlines=True)
-
-    # If no license if found, keep re-running the function until it is.
-    if not _license_found(out.stdout):
-        return _kill_bmin(macro_mol, macromodel_path)
-
-    # This loop causes the function to wait until the job has been
-    # killed via job control. This means the output files will have been
-    # written by the time the function exits. Essentially the loop
-    # continues until the job is no longer found by "./jobcontrol -list"
-    cmd = [app, '-list']
-    output = name
-    start = time.time()
-    while name in output:
-        output = sp.run(cmd, stdout=sp.PIPE, stderr=sp.STDOUT,
-                        universal_newlines=True).stdout
-        if time.time() - start > 600:
-            break
-
-
-def _run_applyhtreat(macro_mol, macromodel_path):
+    # The job being killed still holds a seat, so do not wait for one.
+    _run_licensed(cmd, gated=False)
+
+    # Wait until the job has been killed via job control. This means
+    # the output files will have been written by the time the function
+    # exits.
+    _job_list.wait_until_gone(app, name, 600)
+
+
+class _JobList:
+    """
+    Tracks the jobs listed by ``jobcontrol -list``.
+
+    Every thread waiting for a job to end shares the same listing,
+    which is refreshed at most once per :attr:`min_interval`. Each
+    waiter checks the listing at intervals which start at
+    :attr:`min_interval` and double up to :attr:`max_interval`. This
+    means that many waiting jobs cost a single ``jobcontrol`` call
+    every so often, rather than one tight loop each.
+
+    Attributes
+    ----------
+    min_interval : :class:`float`
+        The shortest time, in seconds, between listings.
+
+    max_interval : :class:`float`
+        The longest time, in seconds, a waiter sleeps between checks.
+
+    """
+
+    def __init__(self):
+        self.min_interval = 0.5
+        self.max_interval = 10
+        self._lock = threading.Lock()
+        # Maps the path of a ``jobcontrol`` program to the time of its
+        # latest listing and the listing.
+        self._listings = {}
+
+    def listing(self, app):
+        """
+        Returns the output of ``jobcontrol -list``.
+
+        Parameters
+        ----------
+        app : :class:`str`
+            The path of the ``jobcontrol`` program.
+
+        Returns
+        -------
+        :class:`str`
+            The listing, which is at most :attr:`min_interval` seconds
+            old.
+
+        """
+
+        with self._lock:
+            listed, output = self._listings.get(app, (None, ''))
+            now = time.monotonic()
+            if listed is None or now - listed >= self.min_interval:
+                output = run_program([app, '-list']).stdout
+                self._listings[app] = now, output
+            return output
+
+    def wait_until_gone(self, app, name, timeout):
+        """
+        Waits until a job is no longer listed.
+
+        Parameters
+        ----------
+        app : :class:`str`
+            The path of the ``jobcontrol`` program.
+
+        name : :class:`str`
+            The name of the job.
+
+        timeout : :class:`float`
+            The maximum number of seconds to wait.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the job is gone.
+
+        """
+
+        deadline = time.monotonic() + timeout
+        interval = self.min_interval
+        while name in self.listing(app):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(2*interval, self.max_interval)
+        return True
+
+
+_job_list = _JobList()
+
+
+def _run_applyhtreat(macro_mol, macromodel_path, conformer=-1):
     name, ext = os.path.splitext(macro_mol._file)
     mae = name + '.mae'
     mae_out = name + '_htreated.mae'
-    _create_mae(macro_mol, macromodel_path)
+    _create_mae(macro_mol, macromodel_path, conformer)
 
     app = os.path.join(macromodel_path, 'utilities', 'applyhtreat')
     cmd = [app, mae, mae_out]
-    out = sp.run(cmd, stdout=sp.PIPE,
-                 stderr=sp.STDOUT, universal_newlines=True)
+    _run_licensed(cmd)
+    macro_mol.update_from_mae(mae_out, conformer)
 
-    # If no license if found, keep re-running the function until it is.
-    if not _license_found(out.stdout):
-        return _run_applyhtreat(macro_mol, macromodel_path)
 
-    macro_mol.update_from_mae(mae_out)
-
-
-def _license_found(output, mol=None):
+def _license_found(output, log_file=None):
     """
-    Checks to see if minimization failed due to a missing license.
+    Checks to see if a program failed due to a missing license.
 
     The user can be notified of this in one of two ways. Sometimes the
-    output of the submission contains the message informing that the
+    output of the program contains the message informing that the
     license was not found and in other cases it will be the log file.
     This function checks both of these sources for this message.
 
     Parameters
     ----------
     output : :class:`str`
-        The output from submitting the minimization of the structure
-        to the ``bmin`` program.
+        The output of the program.
 
-    mol : :class:`.Molecule`, optional
-        The molecule being optimized. If the ``.log`` file is not to
-        be checked, the default ``None`` should be used.
+    log_file : :class:`str`, optional
+        The path of the ``.log`` file written by the program. If the
+        ``.log`` file is not to be checked, the default ``None``
+        should be used.
 
     Returns
     -------
     :class:`bool`
         ``True`` if the license was found. ``False`` if the
-        minimization did not occur due to a missing license.
+        program did not run due to a missing license.
 
     """
 
     if 'Could not check out a license for mmlibs' in output:
         return False
-    if mol is None:
+    if log_file is None or not os.path.exists(log_file):
         return True
 
     # To check if the log file mentions a missing license file open the
     # the log file and scan for the apporpriate string.
-
-    # Check if the file exists first. If not, this is often means the
-    # calculation must be redone so return False anyway.
-    log_file_path = mol._file.replace('mol', 'log')
-    with open(log_file_path, 'r') as log_file:
-        log_file_content = log_file.read()
+    with open(log_file, 'r') as f:
+        log_file_content = f.read()
 
     if 'Could not check out a license for mmlibs' in log_file_content:
         return False
@@ -684,6 +915,276 @@ def _license_found(output, mol=None):
     return True
 
 
+def set_macromodel_licenses(seats, lock_dir=None):
+    """
+    Limits the number of MacroModel jobs which run at the same time.
+
+    The limit holds across all processes on the machine which share
+    `lock_dir`, including worker processes started after this
+    function is called. It should match the number of license seats
+    available, so that jobs queue on the machine rather than hammer
+    the license server.
+
+    Parameters
+    ----------
+    seats : :class:`int`
+        The maximum number of MacroModel jobs which may run at the
+        same time. ``0`` means there is no limit.
+
+    lock_dir : :class:`str`, optional
+        The directory holding the lock files used to share the seats
+        between processes. If ``None``, a directory in the temporary
+        directory of the machine is used.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # The settings are held in environment variables so that they are
+    # inherited by worker processes.
+    os.environ['STK_MACROMODEL_LICENSES'] = str(seats)
+    if lock_dir is not None:
+        os.environ['STK_MACROMODEL_LOCK_DIR'] = lock_dir
+
+
+class _LicenseGate:
+    """
+    Limits the number of MacroModel jobs which run at the same time.
+
+    Each license seat is a lock file. A job may only run while it
+    holds the lock on one of them. The seats are set by
+    :func:`set_macromodel_licenses`.
+
+    Attributes
+    ----------
+    backoff_base : :class:`float`
+        The longest wait, in seconds, before the first retry of a job
+        which found no license. The longest wait doubles with every
+        retry.
+
+    backoff_cap : :class:`float`
+        The longest wait, in seconds, before any retry.
+
+    poll_cap : :class:`float`
+        The longest wait, in seconds, between checks for a free seat.
+
+    """
+
+    def __init__(self):
+        self.backoff_base = 1
+        self.backoff_cap = 120
+        self.poll_cap = 1
+
+    @property
+    def seats(self):
+        if fcntl is None:
+            return 0
+        return int(os.environ.get('STK_MACROMODEL_LICENSES', 0))
+
+    @property
+    def lock_dir(self):
+        default = os.path.join(tempfile.gettempdir(),
+                               'stk_macromodel_licenses')
+        return os.environ.get('STK_MACROMODEL_LOCK_DIR', default)
+
+    def backoff(self, attempt, cap=None):
+        """
+        Returns how long to wait before retrying.
+
+        The wait is exponential in `attempt`, with full jitter so that
+        many waiting jobs do not retry at the same time.
+
+        Parameters
+        ----------
+        attempt : :class:`int`
+            The number of retries made so far.
+
+        cap : :class:`float`, optional
+            The longest possible wait. If ``None``,
+            :attr:`backoff_cap` is used.
+
+        Returns
+        -------
+        :class:`float`
+            The number of seconds to wait.
+
+        """
+
+        cap = self.backoff_cap if cap is None else cap
+        return random.uniform(0,
+                              min(cap, self.backoff_base*2**attempt))
+
+    @contextmanager
+    def seat(self):
+        """
+        Holds a seat for the duration of the context.
+
+        Waits until a seat is free.
+
+        Yields
+        ------
+        None : :class:`NoneType`
+
+        """
+
+        seats = self.seats
+        if not seats:
+            yield
+            return
+
+        lock_dir = self.lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+        lock = None
+        for attempt in count():
+            lock = self._lock_free_seat(lock_dir, seats)
+            if lock is not None:
+                break
+            time.sleep(self.backoff(attempt, self.poll_cap))
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    @staticmethod
+    def _lock_free_seat(lock_dir, seats):
+        """
+        Locks a free seat.
+
+        Parameters
+        ----------
+        lock_dir : :class:`str`
+            The directory holding the lock files.
+
+        seats : :class:`int`
+            The number of seats.
+
+        Returns
+        -------
+        :class:`file`
+            The locked file, or ``None`` if no seat was free.
+
+        """
+
+        for seat in range(seats):
+            lock = open(os.path.join(lock_dir, f'{seat}.lock'), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock
+            except OSError:
+                lock.close()
+        return None
+
+
+class _LicenseMetrics:
+    """
+    Records where the time of MacroModel jobs in this process goes.
+
+    Attributes
+    ----------
+    jobs : :class:`int`
+        The number of jobs run.
+
+    retries : :class:`int`
+        The number of times a job was rerun because no license was
+        available.
+
+    seat_wait : :class:`float`
+        Seconds spent waiting for a free seat.
+
+    license_wait : :class:`float`
+        Seconds spent backing off because no license was available.
+
+    compute : :class:`float`
+        Seconds spent running programs.
+
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.retries = 0
+        self.seat_wait = 0
+        self.license_wait = 0
+        self.compute = 0
+
+    def __str__(self):
+        return (f'{self.jobs} MacroModel jobs ran for '
+                f'{self.compute:.1f} s, waited {self.seat_wait:.1f} s '
+                f'for a seat and {self.license_wait:.1f} s for '
+                f'{self.retries} license retries.')
+
+
+_license_gate = _LicenseGate()
+_license_metrics = _LicenseMetrics()
+
+
+def _run_licensed(cmd, timeout=None, log_file=None, gated=True):
+    """
+    Runs a Schrodinger program, waiting for a license if needed.
+
+    The program is run once a seat is free, see
+    :func:`set_macromodel_licenses`. If the program finds no license,
+    it is rerun after an exponential back off, without giving up the
+    seat.
+
+    Parameters
+    ----------
+    cmd : :class:`list` of :class:`str`
+        The program and its arguments.
+
+    timeout : :class:`float`, optional
+        The number of seconds the program may run for. ``None`` means
+        there is no timeout.
+
+    log_file : :class:`str`, optional
+        The ``.log`` file written by the program, which is checked for
+        license errors along with the output.
+
+    gated : :class:`bool`, optional
+        If ``False``, the program does not wait for a seat.
+
+    Returns
+    -------
+    :class:`.ProgramResult`
+        The outcome of the last run of the program.
+
+    """
+
+    program = os.path.basename(cmd[0])
+    start = time.perf_counter()
+    with (_license_gate.seat() if gated else nullcontext()):
+        seat_wait = time.perf_counter() - start
+        license_wait = compute = 0
+
+        for attempt in count():
+            run_start = time.perf_counter()
+            result = run_program(cmd, timeout, 'macromodel')
+            compute += time.perf_counter() - run_start
+
+            if (result.timed_out or
+               _license_found(result.stdout, log_file)):
+                break
+
+            delay = _license_gate.backoff(attempt)
+            logger.warning(f'No license found for "{program}". '
+                           f'Retrying in {delay:.1f} s.')
+            time.sleep(delay)
+            license_wait += delay
+            _license_metrics.retries += 1
+
+    _license_metrics.jobs += 1
+    _license_metrics.seat_wait += seat_wait
+    _license_metrics.license_wait += license_wait
+    _license_metrics.compute += compute
+    logger.info(f'"{program}" ran for {compute:.1f} s after waiting '
+                f'{seat_wait:.1f} s for a seat and {license_wait:.1f} '
+                's for a license.')
+    return result
+
+
 def _com_line(arg1, arg2, arg3, arg4, arg5, arg6, arg7, arg8, arg9):
     return (" {:<5}{:>7}{:>7}{:>7}{:>7}{:>11.4f}{:>11.4f}"
             "{:>11.4f}{:>11.4f}").format(arg1, arg2, arg3, arg4,
@@ -804,21 +1305,22 @@ def _generate_md_com(macro_mol, settings):
         com.write(main_string)
 
 
-def _create_mae(mol, macromodel_path):
+def _create_mae(mol, macromodel_path, conformer=-1):
     """
     Creates the ``.mae`` file holding the molecule to be optimized.
 
     Parameters
     ----------
     mol : :class:`.Molecule`
-        The molecule which is to be optimized. Its molecular
-        structure file is converted to a ``.mae`` file. The original
-        file is also kept.
+        The molecule which is to be optimized. The file is written to
+        its :attr:`_file` path.
 
     macromodel_path : :class:`str`
         The full path of the Schrodinger suite within the user's
-        machine. For example, on a Linux machine this may be something
-        like ``'/opt/schrodinger2017-2'``.
+        machine.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to write.
 
     Returns
     -------
@@ -827,33 +1329,170 @@ def _create_mae(mol, macromodel_path):
 
     """
 
-    _, ext = os.path.splitext(mol._file)
+    return _write_mae(mol, mol._file, macromodel_path, conformer)
 
-    logger.debug(f'Converting {ext} of "{mol.name}" to .mae.')
 
-    # Create the name of the new ``.mae`` file. It is the same as the
-    # original structure file, including the same path. Only the
-    # extensions are different.
-    mae_file = mol._file.replace(ext, '.mae')
-    _structconvert(mol._file, mae_file, macromodel_path)
-    return mae_file
+def _write_mae(mol, path, macromodel_path, conformer=-1):
+    """
+    Writes a ``.mae`` file of a molecule.
 
+    The file is written directly, rather than converted from another
+    format by ``structconvert``, so no extra process is started. If
+    the MacroModel type of an atom is not known, for example because
+    it is charged or a metal, ``structconvert`` is used instead.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule to write.
 
-def _convert_maegz_to_mae(mol, macromodel_path):
+    path : :class:`str`
+        The path of the ``.mae`` file.
+
+    macromodel_path : :class:`str`
+        The full path of the Schrodinger suite within the user's
+        machine.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to write.
+
+    Returns
+    -------
+    :class:`str`
+        `path`.
+
+    """
+
+    try:
+        logger.debug(f'Writing .mae of "{mol.name}".')
+        mol.write(path, conformer)
+
+    except AtomTypeError as ex:
+        logger.debug(f'{ex.msg} Converting with structconvert.')
+        root, ext = os.path.splitext(path)
+        mol.write(root + '.mol', conformer)
+        _structconvert(root + '.mol', path, macromodel_path)
+
+    return path
+
+
+def _batch_job(mols, macromodel_path, conformer=-1):
     """
-    Converts a ``.maegz`` file to a ``.mae`` file.
+    Creates the ``.mae`` file holding a batch of molecules.
+
+    The title of each structure is the index of its molecule in
+    `mols`, so that the structures in the output can be matched to
+    their molecules even if some are skipped by ``bmin``. If the
+    MacroModel type of an atom is not known, the molecules are
+    written to a ``.sdf`` file which is converted by
+    ``structconvert``.
 
     Parameters
     ----------
-    mol : :class:`.Molecule`
-        The molecule being optimized. The ``.maegz`` file holding
-        its optimized structure is converted to a ``.mae`` file. Both
-        versions are kept.
+    mols : :class:`list` of :class:`.Molecule`
+        The molecules in the batch.
 
     macromodel_path : :class:`str`
         The full path of the Schrodinger suite within the user's
-        machine. For example, on a Linux machine this may be something
-        like ``'/opt/schrodinger2017-2'``.
+        machine.
+
+    conformer : :class:`int`, optional
+        The id of the conformer of each molecule to write.
+
+    Returns
+    -------
+    :class:`types.SimpleNamespace`
+        Stands in for a molecule in the functions which write the
+        ``.com`` file and run ``bmin``. Its ``_file`` attribute is the
+        path of the ``.mae`` file holding the batch.
+
+    """
+
+    job = SimpleNamespace(name=f'batch of {len(mols)} molecules',
+                          _file='{}.mae'.format(uuid4().int))
+
+    try:
+        blocks = [mol.mae_block(conformer, str(i)) for
+                  i, mol in enumerate(mols)]
+
+    except AtomTypeError as ex:
+        logger.debug(f'{ex.msg} Converting the batch with '
+                     'structconvert.')
+        root, ext = os.path.splitext(job._file)
+        with open(root + '.sdf', 'w') as f:
+            for i, mol in enumerate(mols):
+                # The first line of a mol block is its title.
+                f.write(f'{i}' + mol.mdl_mol_block(conformer))
+        _structconvert(root + '.sdf', job._file, macromodel_path)
+        return job
+
+    with open(job._file, 'w') as f:
+        f.write(MAE_HEADER)
+        f.writelines(blocks)
+
+    return job
+
+
+def _batch_structures(job):
+    """
+    Reads the structures written by a batch job.
+
+    Parameters
+    ----------
+    job : :class:`types.SimpleNamespace`
+        The batch job, made by :func:`_batch_job`.
+
+    Returns
+    -------
+    :class:`dict`
+        Maps the index of each molecule in the batch to the atomic
+        numbers and coordinates of its atoms in the output.
+
+    """
+
+    structures = {}
+    for props, atomic_nums, coords in structures_from_mae_file(
+                                                    _output_file(job)):
+        title = props.get('s_m_title', '')
+        if title.isdigit():
+            structures[int(title)] = (atomic_nums, coords)
+    return structures
+
+
+def _output_file(mol):
+    """
+    Returns the path of the ``-out.maegz`` file written by ``bmin``.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule being optimized.
+
+    Returns
+    -------
+    :class:`str`
+        The path of the output file.
+
+    """
+
+    name, ext = os.path.splitext(mol._file)
+    return name + '-out.maegz'
+
+
+def _update_from_output(mol, conformer=-1):
+    """
+    Updates a molecule with the structure optimized by ``bmin``.
+
+    The ``-out.maegz`` file is decompressed in memory, rather than
+    converted to a ``.mae`` file by ``structconvert``.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule being optimized.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to update.
 
     Returns
     -------
@@ -862,23 +1501,52 @@ def _convert_maegz_to_mae(mol, macromodel_path):
     Raises
     ------
     :class:`_ForceFieldError`
-        If the OPLS3 force field failed to optimize the molecule. If
-        this happens the conversion function is unable to convert the
-        output of the optimization function and as a result this error
-        is raised.
+        If the output is missing or holds no structure. This happens
+        when the OPLS3 force field failed to optimize the molecule.
 
     """
 
-    logger.debug(f'Converting .maegz of "{mol.name}" to .mae.')
-    name, ext = os.path.splitext(mol._file)
-    # ``out`` is the full path of the optimized ``.mae`` file.
-    maegz = name + '-out.maegz'
-    # Replace extensions to get the names of the various files.
-    mae = name + '.mae'
-    return _structconvert(maegz, mae, macromodel_path)
+    logger.debug(f'Reading .maegz of "{mol.name}".')
+    try:
+        mol.update_from_mae(_output_file(mol), conformer)
+    except (OSError, RuntimeError) as ex:
+        raise _ForceFieldError(f'No structure in the output of "bmin" '
+                               f'for "{mol.name}": {ex}')
 
 
 def _structconvert(iname, oname, macromodel_path):
+    """
+    Converts a molecular structure file with ``structconvert``.
+
+    Parameters
+    ----------
+    iname : :class:`str`
+        The path of the file to convert.
+
+    oname : :class:`str`
+        The path of the converted file.
+
+    macromodel_path : :class:`str`
+        The full path of the Schrodinger suite within the user's
+        machine.
+
+    Returns
+    -------
+    :class:`.ProgramResult`
+        The outcome of the ``structconvert`` run.
+
+    Raises
+    ------
+    :class:`_PathError`
+        If ``structconvert`` is not found in `macromodel_path`.
+
+    :class:`_ForceFieldError`
+        If ``structconvert`` reports a force field failure.
+
+    :class:`_ConversionError`
+        If ``structconvert`` did not write `oname`.
+
+    """
 
     convrt_app = os.path.join(macromodel_path, 'utilities',
                               'structconvert')
@@ -886,10 +1554,7 @@ def _structconvert(iname, oname, macromodel_path):
 
     # Execute the file conversion.
     try:
-        convrt_return = sp.run(convrt_cmd,
-                               stdout=sp.PIPE,
-                               stderr=sp.STDOUT,
-                               universal_newlines=True)
+        convrt_return = _run_licensed(convrt_cmd)
 
     # If conversion fails because a wrong Schrodinger path was given,
     # raise.
@@ -897,15 +1562,11 @@ def _structconvert(iname, oname, macromodel_path):
         raise _PathError(('Wrong Schrodinger path supplied to'
                           ' `structconvert` function.'))
 
-    # If no license if found, keep re-running the function until it is.
-    if not _license_found(convrt_return.stdout):
-        return _structconvert(iname, oname, macromodel_path)
-
     # If force field failed, raise.
     if 'number 1' in convrt_return.stdout:
         raise _ForceFieldError(convrt_return.stdout)
 
-    _wait_for_file(oname)
+    wait_for_file(oname)
     if not os.path.exists(oname):
         raise _ConversionError(
          ('Conversion output file {} was not found.'
@@ -1100,34 +1761,3 @@ def _fix_torsional_angle_in_com_file(mol, fix_block):
                                 99999, 361, 0, 0) + '\n')
 
     return fix_block
-
-
-def _wait_for_file(file_name, timeout=10):
-    """
-    Stalls until a given file exists or `timeout` expires.
-
-    Parameters
-    ----------
-    file_name : :class:`str`
-        The full path of the file which should be waited for.
-
-    timeout : :class:`int` or :class:`float`, optional
-        The number of seconds before the function stops waiting and
-        returns.
-
-    Returns
-    --------
-    None : :class:`NoneType`
-
-    """
-
-    t_start = time.time()
-    tick = 0
-    while True:
-        time_taken = time.time() - t_start
-        if divmod(time_taken, 5)[0] == tick + 1:
-            logger.warning('Waiting for "{}".'.format(file_name))
-            tick += 1
-
-        if os.path.exists(file_name) or time_taken > timeout:
-            break
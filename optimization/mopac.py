@@ -4,12 +4,12 @@ Defines optimization functions which use MOPAC.
 """
 
 import os
-import subprocess as sp
-import psutil
 import time
 import logging
-import rdkit.Chem.AllChem as rdkit
 from uuid import uuid4
+from functools import partial
+
+from ..convenience_tools import run_program
 
 logger = logging.getLogger(__name__)
 
@@ -128,23 +128,19 @@ def _run_mopac(mol, mopac_path, settings, timeout=7200):
           'Running MOPAC - {}.'.format(mol.name), sep='\n')
 
     # To run MOPAC a command is issued to the console via
-    # ``subprocess.Popen``. The command is the full path of the
-    # ``mopac`` program.
+    # :func:`.run_program`. The command is the full path of the
+    # ``mopac`` program. If MOPAC runs for too long, it is asked to
+    # stop, so that it still writes its output files.
     file_root, ext = os.path.splitext(mop_file)
     opt_cmd = [mopac_path, file_root]
-    opt_proc = psutil.Popen(opt_cmd, stdout=sp.PIPE,
-                            stderr=sp.STDOUT,
-                            universal_newlines=True)
-
-    try:
-        if timeout:
-            proc_out, _ = opt_proc.communicate(timeout=timeout)
-        else:
-            proc_out, _ = opt_proc.communicate()
-    except sp.TimeoutExpired:
+    opt_proc = run_program(opt_cmd,
+                           timeout or None,
+                           'mopac',
+                           partial(_kill_mopac, mol),
+                           60)
+    if opt_proc.timed_out:
         logger.warning('\nMinimization took too long and was terminated '
                        'by force - {}\n'.format(mol.name))
-        _kill_mopac(mol)
 
     return
 
@@ -267,8 +263,8 @@ def _convert_mopout_to_mol(mol):
     Updates the molecular structure if the optimization is successful.
 
     Takes the ``.pdb`` file of the neutral file generated from the
-    MOPAC run and initializes a new ``rdkit`` molecule with those
-    coordinates. `mol` is then updated to hold the new molecule.
+    MOPAC run and copies its coordinates into the conformer of `mol`.
+    The atoms and bonds of `mol` are kept.
 
     Parameters
     ----------
@@ -287,8 +283,6 @@ def _convert_mopout_to_mol(mol):
     logger.info("\nUpdating molecule with MOPAC optimized "
                 "one - {}.\n".format(mol.name))
 
-    new_mol = rdkit.MolFromPDBFile(pdb_file,
-                                   sanitize=False,
-                                   removeHs=False)
-    # Updating the macro_mol.mol infos with the new mol
-    mol.mol = new_mol
+    # MOPAC does not change the connectivity, so only the coordinates
+    # need to be updated.
+    mol.update_from_pdb(pdb_file)
@@ -28,23 +28,48 @@ file, not any of the helper functions or classes.
 """
 
 import rdkit.Chem.AllChem as rdkit
-import multiprocessing as mp
+import os
 from functools import partial, wraps
 import numpy as np
 import logging
-from threading import Thread
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from .macromodel import macromodel_opt, macromodel_cage_opt
-from ..convenience_tools import daemon_logger, logged_call
+from .macromodel import (macromodel_opt,
+                         macromodel_cage_opt,
+                         macromodel_batch_opt)
+from . import rejection
+from ..convenience_tools import (worker_pool,
+                                 TaskFailure,
+                                 FunctionData,
+                                 set_conformer_positions)
 
 
 logger = logging.getLogger(__name__)
 
 
-def _optimize_all(func_data, population, processes):
+def _optimize_all(func_data,
+                  population,
+                  processes,
+                  timeout=None,
+                  then=None,
+                  store=None):
     """
     Run opt function on all population members in parallel.
 
+    If a :class:`.WorkerPool` is active, its workers are used.
+    Otherwise a temporary pool is created.
+
+    An optimization which crashes its worker process or runs for
+    longer than `timeout` is stopped. The molecule is logged as a
+    failure and marked as optimized, so that it is not attempted
+    again, and the remaining optimizations carry on.
+
+    Molecules are sent to the workers one at a time, the ones expected
+    to take longest first, so that no worker is left with a backlog of
+    big molecules at the end. The expected times are predicted by
+    :data:`_cost_model`, which is updated with the measured times.
+
     Parameters
     ----------
     func_data : :class:`.FunctionData`
@@ -56,7 +81,24 @@ def _optimize_all(func_data, population, processes):
         optimized.
 
     processes : :class:`int`
-        The number of parallel processes to create.
+        The number of parallel processes to create, if no
+        :class:`.WorkerPool` is active.
+
+    timeout : :class:`float`, optional
+        The maximum number of seconds an optimization may take. If
+        ``None``, there is no limit.
+
+    then : :class:`callable`, optional
+        A picklable callable which takes an optimized molecule and
+        returns it. It is called in the same worker task as the
+        optimization, so that the next step for each molecule starts
+        as soon as it is optimized, without waiting for the rest of
+        the population. It counts towards `timeout`.
+
+    store : :class:`.ResultStore`, optional
+        A store of optimized structures. Molecules whose optimized
+        structures are in the store are not optimized again. Newly
+        optimized structures are added to it.
 
     Returns
     -------
@@ -64,34 +106,58 @@ def _optimize_all(func_data, population, processes):
 
     """
 
-    manager = mp.Manager()
-    logq = manager.Queue()
-    log_thread = Thread(target=daemon_logger, args=(logq, ))
-    log_thread.start()
-
     # Using the name of the function stored in `func_data` get the
     # function object from one of the functions defined within the
     # module.
     func = globals()[func_data.name]
-    # Provide the function with any additional paramters it may
-    # require.
-    p_func = _OptimizationFunc(partial(func, **func_data.params))
+
+    members = list(population)
+    costs = [_cost_model.predict(func_data.name, mem) for
+             mem in members]
+    order = sorted(range(len(members)),
+                   key=lambda i: costs[i],
+                   reverse=True)
 
     # Apply the function to every member of the population, in
     # parallel.
-    with mp.get_context('spawn').Pool(processes) as pool:
-        optimized = pool.starmap(logged_call,
-                                 ((logq, p_func, mem) for
-                                  mem in population))
-    # Make sure the cache is updated with the optimized versions.
-    for member in optimized:
-        member.update_cache()
-
-    logq.put(None)
-    log_thread.join()
-
-
-def _optimize_all_serial(func_data, population):
+    start = time.perf_counter()
+    busy = 0
+    with worker_pool(processes) as pool:
+        # Provide the function with any additional paramters it may
+        # require.
+        params = _share_cores(func, func_data.params, pool.processes)
+        p_func = _OptimizationFunc(partial(func, **params), store)
+        for result in pool.imap_unordered(_timed_call,
+                                          ((p_func, members[i], then)
+                                           for i in order),
+                                          timeout):
+            if isinstance(result, TaskFailure):
+                _, member, _ = result.args
+                logger.error(f'Optimization of {member.name} failed. '
+                             f'{result.reason}')
+                member.optimized = True
+                # Every molecule must go through `then`, so the
+                # failed ones go through it here.
+                if then is not None:
+                    then(member)
+                continue
+
+            member, duration = result
+            busy += duration
+            _cost_model.record(func_data.name, member, duration)
+            # Make sure the cache is updated with the optimized
+            # versions.
+            member.update_cache()
+        workers = pool.processes
+    wall = time.perf_counter() - start
+
+    utilization = busy / (wall*workers) if wall else 0
+    logger.info(f'Optimized {len(members)} molecules in {wall:.2f} s '
+                f'with {workers} workers. Core utilization was '
+                f'{utilization:.0%}.')
+
+
+def _optimize_all_serial(func_data, population, then=None, store=None):
     """
     Run opt function on all population members sequentially.
 
@@ -105,6 +171,14 @@ def _optimize_all_serial(func_data, population):
         The :class:`.Population` instance who's members are to be
         optimized.
 
+    then : :class:`callable`, optional
+        Called with each molecule after it is optimized.
+
+    store : :class:`.ResultStore`, optional
+        A store of optimized structures. Molecules whose optimized
+        structures are in the store are not optimized again. Newly
+        optimized structures are added to it.
+
     Returns
     -------
     None : :class:`NoneType`
@@ -117,11 +191,437 @@ def _optimize_all_serial(func_data, population):
     func = globals()[func_data.name]
     # Provide the function with any additional paramters it may
     # require.
-    p_func = _OptimizationFunc(partial(func, **func_data.params))
+    params = _share_cores(func, func_data.params, 1)
+    p_func = _OptimizationFunc(partial(func, **params), store)
 
     # Apply the function to every member of the population.
     for member in population:
         p_func(member)
+        if then is not None:
+            then(member)
+
+
+def _optimize_all_threaded(func_data, population, threads, store=None):
+    """
+    Run opt function on all population members in threads.
+
+    This is for optimization functions which spend most of their time
+    waiting for external programs, such as :func:`.macromodel_opt` and
+    :func:`.mopac_opt`. The programs are run by :func:`.run_program`,
+    so a single process can drive `threads` of them at the same time,
+    without one Python process per program. The Python parts of the
+    optimizations, such as writing input files and reading the
+    results, run in the threads.
+
+    Parameters
+    ----------
+    func_data : :class:`.FunctionData`
+        The :class:`.FunctionData` object which represents the chosen
+        optimization function.
+
+    population : :class:`.Population`
+        The :class:`.Population` instance who's members are to be
+        optimized.
+
+    threads : :class:`int`
+        The number of optimizations run at the same time.
+
+    store : :class:`.ResultStore`, optional
+        A store of optimized structures. Molecules whose optimized
+        structures are in the store are not optimized again. Newly
+        optimized structures are added to it.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # Using the name of the function stored in `func_data` get the
+    # function object from one of the functions defined within the
+    # module.
+    func = globals()[func_data.name]
+    # Provide the function with any additional paramters it may
+    # require.
+    params = _share_cores(func, func_data.params, threads)
+    p_func = _OptimizationFunc(partial(func, **params), store)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        # Molecules are optimized in place, so the cache already holds
+        # the optimized versions.
+        members = list(executor.map(p_func, population))
+    wall = time.perf_counter() - start
+
+    logger.info(f'Optimized {len(members)} molecules in {wall:.2f} s '
+                f'with {threads} threads.')
+
+
+def _optimize_all_batched(func_data,
+                          population,
+                          processes,
+                          batch_size,
+                          timeout=None,
+                          store=None):
+    """
+    Run opt function on batches of population members in parallel.
+
+    Each worker process is given `batch_size` molecules at a time. If
+    the optimization function has a :attr:`batch` attribute, such as
+    :func:`.macromodel_opt`, each batch is optimized with a single
+    call to it, which pays the start up costs of external programs
+    once per batch. The :attr:`batch` function returns a
+    :class:`list` holding ``True`` for each molecule it optimized and
+    ``False`` for each one which failed. Otherwise, the molecules of a
+    batch are optimized one after the other.
+
+    Only the structures of molecules which were optimized are added
+    to `store`. Molecules which failed are marked as optimized, so
+    that they are not attempted again in this run, but they are not
+    loaded as optimized by later runs.
+
+    Parameters
+    ----------
+    func_data : :class:`.FunctionData`
+        The :class:`.FunctionData` object which represents the chosen
+        optimization function. This function should be defined within
+        this module.
+
+    population : :class:`.Population`
+        The :class:`.Population` instance who's members must be
+        optimized.
+
+    processes : :class:`int`
+        The number of parallel processes to create.
+
+    batch_size : :class:`int`
+        The number of molecules in each batch.
+
+    timeout : :class:`float`, optional
+        The maximum number of seconds the optimization of a single
+        batch may take. If ``None``, there is no limit.
+
+    store : :class:`.ResultStore`, optional
+        A store of optimized structures. Molecules whose optimized
+        structures are in the store are not optimized again. Newly
+        optimized structures are added to it.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    # Using the name of the function stored in `func_data` get the
+    # function object from one of the functions defined within the
+    # module.
+    func = globals()[func_data.name]
+    # Provide the function with any additional paramters it may
+    # require.
+    params = _share_cores(func, func_data.params, processes)
+    p_func = _OptimizationFunc(partial(func, **params), store)
+    batch_func = getattr(func, 'batch', None)
+    if batch_func is not None:
+        batch_func = partial(batch_func, **func_data.params)
+
+    # Only molecules which need to be optimized are sent to the
+    # workers, so that no batch is made smaller by skipped molecules.
+    pending = []
+    for member in population:
+        if member.optimized:
+            continue
+        key = p_func._store_key(member)
+        if key is not None and p_func._load(member, key):
+            logger.info(f'Loaded optimized {member.name} from store.')
+            member.optimized = True
+            continue
+        pending.append((member, key))
+
+    batches = [pending[i:i+batch_size] for
+               i in range(0, len(pending), batch_size)]
+
+    start = time.perf_counter()
+    failed = 0
+    with worker_pool(processes) as pool:
+        for result in pool.imap_unordered(
+                            _optimize_batch,
+                            ((i, p_func, batch_func, [m for m, _ in batch])
+                             for i, batch in enumerate(batches)),
+                            timeout):
+            if isinstance(result, TaskFailure):
+                *_, members = result.args
+                names = ', '.join(str(member.name) for member in members)
+                logger.error(f'Optimization of {names} failed. '
+                             f'{result.reason}')
+                for member in members:
+                    member.optimized = True
+                failed += len(members)
+                continue
+
+            i, members, optimized, duration = result
+            failed += optimized.count(False)
+            for (_, key), member, ok in zip(batches[i],
+                                            members,
+                                            optimized):
+                # Without a batch function, the workers already saved
+                # the optimized structures.
+                if batch_func is not None and ok and key is not None:
+                    p_func._save(member, key, duration/len(members))
+                # Make sure the cache is updated with the optimized
+                # versions.
+                member.update_cache()
+    wall = time.perf_counter() - start
+
+    logger.info(f'Optimized {len(pending)} molecules in {len(batches)} '
+                f'batches in {wall:.2f} s. {failed} failed.')
+
+
+def _share_cores(func, params, workers):
+    """
+    Sets the number of threads an optimization function may use.
+
+    Optimization functions which run in many threads, such as
+    :func:`rdkit_conformer_search`, name their thread count parameter
+    in a :attr:`threads` attribute. The cores of the machine are
+    shared between the `workers` which run the function at the same
+    time, so that they are not oversubscribed.
+
+    Parameters
+    ----------
+    func : :class:`function`
+        The optimization function.
+
+    params : :class:`dict`
+        The parameters given to `func` by the user. A thread count
+        set by the user is not changed.
+
+    workers : :class:`int`
+        The number of processes or threads which call `func` at the
+        same time.
+
+    Returns
+    -------
+    :class:`dict`
+        The parameters to call `func` with.
+
+    """
+
+    name = getattr(func, 'threads', None)
+    if name is None or name in params:
+        return params
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    return {**params, name: threads}
+
+
+def _optimize_batch(index, func, batch_func, mols):
+    """
+    Optimizes a batch of molecules.
+
+    This function runs in the worker processes used by
+    :func:`_optimize_all_batched`.
+
+    Parameters
+    ----------
+    index : :class:`int`
+        The index of the batch.
+
+    func : :class:`_OptimizationFunc`
+        The optimization function, used if `batch_func` is ``None``.
+
+    batch_func : :class:`callable`
+        Optimizes all molecules in `mols` with one call. ``None`` if
+        the optimization function has no batch version.
+
+    mols : :class:`list` of :class:`.Molecule`
+        The molecules to optimize.
+
+    Returns
+    -------
+    :class:`tuple`
+        The `index`, the optimized molecules, a :class:`list` holding
+        ``True`` for each molecule which was optimized and ``False``
+        for each one which failed and the number of seconds the
+        optimization took.
+
+    """
+
+    start = time.perf_counter()
+    if batch_func is None:
+        optimized = [func._optimize(mol) for mol in mols]
+
+    else:
+        names = ', '.join(str(mol.name) for mol in mols)
+        try:
+            logger.info(f'Optimizing {names}.')
+            optimized = batch_func(mols)
+
+        except Exception as ex:
+            errormsg = (f'Optimization function '
+                        f'"{batch_func.func.__name__}()" '
+                        f'failed on molecules {names}.')
+            logger.error(errormsg, exc_info=True)
+            optimized = [False]*len(mols)
+
+        finally:
+            for mol in mols:
+                mol.optimized = True
+
+    return index, mols, optimized, time.perf_counter() - start
+
+
+def _timed_call(func, mol, then=None):
+    """
+    Calls ``func(mol)`` and measures how long it takes.
+
+    Parameters
+    ----------
+    func : :class:`callable`
+        An optimization function wrapped by :class:`_OptimizationFunc`.
+
+    mol : :class:`.Molecule`
+        The molecule to be optimized.
+
+    then : :class:`callable`, optional
+        Called with the optimized molecule. Its time is not measured.
+
+    Returns
+    -------
+    :class:`tuple`
+        The optimized molecule and the number of seconds the
+        optimization took. The time is ``0`` if the molecule was
+        already optimized and therefore skipped.
+
+    """
+
+    skipped = mol.optimized
+    start = time.perf_counter()
+    mol = func(mol)
+    duration = 0 if skipped else time.perf_counter() - start
+
+    if then is not None:
+        mol = then(mol)
+    return mol, duration
+
+
+class _CostModel:
+    """
+    Predicts how long optimizations take.
+
+    The prediction is proportional to the number of atoms in the
+    molecule. The constant of proportionality, the number of seconds
+    per atom, is the mean of the ones measured in earlier
+    optimizations. It is kept separately for every optimization
+    function and topology. If nothing has been measured for a
+    topology yet, the mean for the optimization function is used. If
+    nothing has been measured for the optimization function either,
+    the prediction is just the number of atoms.
+
+    Molecules which are already optimized are skipped by
+    :class:`_OptimizationFunc`, so their predicted cost is ``0``.
+
+    Attributes
+    ----------
+    timings : :class:`dict`
+        Maps ``(func_name, topology_name)`` to a :class:`list` holding
+        the sum of the measured seconds per atom and the number of
+        measurements. ``topology_name`` is ``None`` for the totals of
+        an optimization function.
+
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    def predict(self, func_name, mol):
+        """
+        Predicts how long optimizing `mol` will take.
+
+        Parameters
+        ----------
+        func_name : :class:`str`
+            The name of the optimization function.
+
+        mol : :class:`.Molecule`
+            The molecule to be optimized.
+
+        Returns
+        -------
+        :class:`float`
+            The predicted cost. Only meaningful relative to other
+            predictions.
+
+        """
+
+        if mol.optimized:
+            return 0
+
+        for key in ((func_name, self._topology_name(mol)),
+                    (func_name, None)):
+            if key in self.timings:
+                total, count = self.timings[key]
+                return total / count * mol.mol.GetNumAtoms()
+
+        return mol.mol.GetNumAtoms()
+
+    def record(self, func_name, mol, seconds):
+        """
+        Records how long optimizing `mol` took.
+
+        Parameters
+        ----------
+        func_name : :class:`str`
+            The name of the optimization function.
+
+        mol : :class:`.Molecule`
+            The optimized molecule.
+
+        seconds : :class:`float`
+            How long the optimization took.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        num_atoms = mol.mol.GetNumAtoms()
+        # Skipped molecules tell nothing about the cost.
+        if seconds <= 0 or num_atoms == 0:
+            return
+
+        for key in ((func_name, self._topology_name(mol)),
+                    (func_name, None)):
+            total, count = self.timings.get(key, (0, 0))
+            self.timings[key] = [total + seconds/num_atoms, count + 1]
+
+    @staticmethod
+    def _topology_name(mol):
+        """
+        Returns the name of the topology of `mol`.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            A molecule.
+
+        Returns
+        -------
+        :class:`str`
+            The class name of the topology, or of the molecule if it
+            has no topology.
+
+        """
+
+        topology = getattr(mol, 'topology', None)
+        if topology is None:
+            return mol.__class__.__name__
+        return topology.__class__.__name__
+
+
+# Predicts the cost of optimizations in :func:`_optimize_all`. It is
+# kept for the lifetime of the process, so that timings measured in
+# one generation of the GA are used to schedule the next.
+_cost_model = _CostModel()
 
 
 class _OptimizationFunc:
@@ -136,10 +636,24 @@ class _OptimizationFunc:
     they fail (necessary for multiprocessing) and prevents them from
     being run twice on the same molecule.
 
+    If a :class:`.ResultStore` is given, the optimized structures are
+    saved in it and reused by later runs and other processes. A
+    result is reused when the molecule, the optimization function,
+    its parameters and the structure before the optimization all
+    match, so nothing is launched for molecules which were optimized
+    before.
+
+    Attributes
+    ----------
+    store : :class:`.ResultStore`
+        The store of optimized structures. ``None`` if optimized
+        structures are not stored.
+
     """
 
-    def __init__(self, func):
+    def __init__(self, func, store=None):
         wraps(func)(self)
+        self.store = store
 
     def __call__(self, mol):
         """
@@ -157,23 +671,182 @@ class _OptimizationFunc:
 
         """
 
+        self._optimize(mol)
+        return mol
+
+    def _optimize(self, mol):
+        """
+        Optimizes `mol`, unless it is already optimized.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            The molecule to be optimized.
+
+        Returns
+        -------
+        :class:`bool`
+            ``False`` if the optimization failed and ``True``
+            otherwise.
+
+        """
+
         if mol.optimized:
             logger.info(f'Skipping {mol.name}.')
-            return mol
+            return True
+
+        key = self._store_key(mol)
+        if key is not None and self._load(mol, key):
+            logger.info(f'Loaded optimized {mol.name} from store.')
+            mol.optimized = True
+            return True
 
         try:
             logger.info(f'Optimizing {mol.name}.')
+            start = time.perf_counter()
             self.__wrapped__(mol)
+            # Molecules rejected by a pipeline are not optimized.
+            if key is not None and not getattr(mol, 'rejected', False):
+                self._save(mol, key, time.perf_counter() - start)
+            return True
 
         except Exception as ex:
             errormsg = (f'Optimization function '
                         f'"{self.__wrapped__.func.__name__}()" '
                         f'failed on molecule "{mol.name}".')
             logger.error(errormsg, exc_info=True)
+            return False
 
         finally:
             mol.optimized = True
-            return mol
+
+    def _store_key(self, mol):
+        """
+        Returns the key of `mol` in :attr:`store`.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            The molecule about to be optimized.
+
+        Returns
+        -------
+        :class:`str`
+            The key. ``None`` if there is no store or `mol` has no
+            key.
+
+        """
+
+        if self.store is None or getattr(mol, 'key', None) is None:
+            return None
+
+        func = self.__wrapped__
+        coords = b''.join(
+            np.round(conf.GetPositions(), 4).tobytes() for
+            conf in mol.mol.GetConformers())
+        # The number of threads used does not change the result.
+        threads = getattr(func.func, 'threads', None)
+        params = {name: value for name, value in func.keywords.items() if
+                  name != threads}
+        return self.store.key(_canonical(mol.key),
+                              func.func.__name__,
+                              _canonical(params),
+                              coords)
+
+    def _load(self, mol, key):
+        """
+        Updates `mol` with its optimized structure from :attr:`store`.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            The molecule about to be optimized.
+
+        key : :class:`str`
+            The key of `mol` in :attr:`store`.
+
+        Returns
+        -------
+        :class:`bool`
+            ``True`` if the optimized structure was found.
+
+        """
+
+        result = self.store.get(key)
+        if result is None:
+            return False
+
+        positions = result['conformers']
+        conformers = list(mol.mol.GetConformers())
+        if any(conf.GetId() not in positions for conf in conformers):
+            return False
+
+        for conf in conformers:
+            set_conformer_positions(conf, positions[conf.GetId()])
+        return True
+
+    def _save(self, mol, key, seconds):
+        """
+        Saves the optimized structure of `mol` in :attr:`store`.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            The optimized molecule.
+
+        key : :class:`str`
+            The key of `mol` in :attr:`store`.
+
+        seconds : :class:`float`
+            How long the optimization took.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        self.store.put(key, {
+            'conformers': {conf.GetId(): conf.GetPositions() for
+                           conf in mol.mol.GetConformers()},
+            'func': self.__wrapped__.func.__name__,
+            'seconds': seconds,
+            'created': time.time()
+        })
+
+
+def _canonical(obj):
+    """
+    Returns a representation of `obj` which does not depend on order.
+
+    Used to make keys from molecule keys and the parameters of
+    optimization functions. The iteration order of sets and
+    :class:`dict` objects can differ between processes, so they are
+    sorted.
+
+    Parameters
+    ----------
+    obj : :class:`object`
+        The object. Usually a :class:`dict` of parameters.
+
+    Returns
+    -------
+    :class:`str`
+        A representation of `obj` in which the items of sets and
+        :class:`dict` objects are sorted.
+
+    """
+
+    if isinstance(obj, dict):
+        items = sorted((repr(k), _canonical(v)) for k, v in obj.items())
+        return '{' + ', '.join(f'{k}: {v}' for k, v in items) + '}'
+    if isinstance(obj, (set, frozenset)):
+        return f'{type(obj).__name__}({sorted(map(_canonical, obj))!r})'
+    if isinstance(obj, (list, tuple)):
+        return repr(type(obj)(_canonical(x) for x in obj))
+    if isinstance(obj, FunctionData):
+        return f'FunctionData({obj.name!r}, {_canonical(obj.params)})'
+    return repr(obj)
 
 
 def do_not_optimize(mol):
@@ -253,6 +926,85 @@ def raiser(mol, param1, param2=2):
     raise Exception('Raiser optimization function used.')
 
 
+def pipeline(mol, stages, threads=None):
+    """
+    Optimizes the molecule in stages, dropping it if it is rejected.
+
+    Each stage is either an optimization function or a rejection
+    function defined in :mod:`.rejection`. The stages are applied in
+    order. If a rejection function returns ``True``, the remaining
+    stages are skipped and the :attr:`rejected` attribute of the
+    molecule is set to ``True``. Rejected molecules are not added to
+    the store of optimized structures and are removed from the
+    population by :meth:`.Population.optimize`. For example
+
+    .. code-block:: python
+
+        FunctionData('pipeline', stages=[
+            FunctionData('rdkit_optimization', embed=True),
+            FunctionData('atoms_too_close', min_distance=0.7),
+            FunctionData('collapsed'),
+            FunctionData('macromodel_opt',
+                         macromodel_path='/opt/schrodinger2017-2',
+                         settings={'restricted': True}),
+            FunctionData('macromodel_opt',
+                         macromodel_path='/opt/schrodinger2017-2',
+                         settings={'restricted': False, 'md': True})
+        ])
+
+    first does a quick ``rdkit`` optimization and only runs MacroModel
+    on the molecules which are neither overlapping nor collapsed.
+
+    When a population is optimized with :meth:`.Population.optimize`,
+    each molecule goes through all of its stages as soon as a worker
+    is free. This means that the expensive stages of some molecules
+    run while other molecules are still in the cheap stages.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule to be optimized.
+
+    stages : :class:`list` of :class:`.FunctionData`
+        The optimization and rejection functions to apply, in order.
+
+    threads : :class:`int`, optional
+        The number of threads given to stages which run in many
+        threads, such as :func:`rdkit_conformer_search`, unless the
+        stage sets its own thread count. Set by
+        :meth:`.Population.optimize` from the cores free to each
+        worker.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    for stage in stages:
+        # Only functions defined in :mod:`.rejection` are rejection
+        # functions, not the names it imports.
+        reject = getattr(rejection, stage.name, None)
+        if getattr(reject, '__module__', None) == rejection.__name__:
+            if reject(mol, **stage.params):
+                logger.info(f'"{mol.name}" was rejected by '
+                            f'"{stage.name}".')
+                mol.rejected = True
+                return
+        else:
+            func = globals()[stage.name]
+            params = stage.params
+            name = getattr(func, 'threads', None)
+            if threads is not None and name is not None:
+                params = {name: threads, **params}
+            func(mol, **params)
+
+
+# Names the parameter holding the number of threads, which is passed
+# on to the stages.
+pipeline.threads = 'threads'
+
+
 def rdkit_optimization(mol, embed=False, conformer=-1):
     """
     Optimizes the structure of the molecule using ``rdkit``.
@@ -325,3 +1077,91 @@ def rdkit_ETKDG(mol, conformer=-1):
     mol.mol.RemoveConformer(conformer)
     new_conf.SetId(conformer)
     mol.mol.AddConformer(new_conf)
+
+
+def rdkit_conformer_search(mol,
+                           n_confs=50,
+                           max_iter=500,
+                           random_seed=-1,
+                           num_threads=0,
+                           conformer=-1):
+    """
+    Keeps the lowest energy conformer found with :func:`rdkit.ETKDG`.
+
+    `n_confs` conformers are embedded with ``EmbedMultipleConfs`` and
+    optimized with the ``MMFF`` forcefield by
+    ``MMFFOptimizeMoleculeConfs``. Both spread the conformers over
+    `num_threads` threads. The lowest energy conformer then replaces
+    `conformer` in place.
+
+    When run by :meth:`.Population.optimize`, `num_threads` is set so
+    that the cores are shared between the worker processes, unless
+    the user sets it.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule who's structure should be optimized.
+
+    n_confs : :class:`int`, optional
+        The number of conformers to embed.
+
+    max_iter : :class:`int`, optional
+        The maximum number of iterations of each ``MMFF``
+        optimization.
+
+    random_seed : :class:`int`, optional
+        The random seed used for embedding. If ``-1``, a random seed
+        is used.
+
+    num_threads : :class:`int`, optional
+        The number of threads used by ``rdkit``. If ``0``, all cores
+        are used.
+
+    conformer : :class:`int`, optional
+        The conformer to replace.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    Raises
+    ------
+    :class:`RuntimeError`
+        If no conformer could be embedded.
+
+    """
+
+    # The conformers are embedded in a copy of the molecule, so that
+    # its other conformers are not touched.
+    search = rdkit.Mol(mol.mol)
+    search.RemoveAllConformers()
+    rdkit.SanitizeMol(search)
+
+    conf_ids = list(rdkit.EmbedMultipleConfs(search,
+                                             numConfs=n_confs,
+                                             randomSeed=random_seed,
+                                             useExpTorsionAnglePrefs=True,
+                                             useBasicKnowledge=True,
+                                             numThreads=num_threads))
+    if not conf_ids:
+        raise RuntimeError(
+                    f'No conformers of "{mol.name}" could be embedded.')
+
+    # Each result holds whether the optimization did not converge and
+    # the energy of the conformer.
+    results = rdkit.MMFFOptimizeMoleculeConfs(search,
+                                              numThreads=num_threads,
+                                              maxIters=max_iter)
+    energies = [energy for _, energy in results]
+    best = conf_ids[int(np.argmin(energies))]
+    logger.debug(f'Lowest energy conformer of "{mol.name}" has an '
+                 f'MMFF energy of {min(energies)}.')
+
+    set_conformer_positions(mol.mol.GetConformer(conformer),
+                            search.GetConformer(best).GetPositions())
+
+
+# Names the parameter holding the number of threads, so that
+# :meth:`.Population.optimize` can share the cores between processes.
+rdkit_conformer_search.threads = 'num_threads'
@@ -0,0 +1,84 @@
+"""
+Defines rejection functions used by :func:`.pipeline`.
+
+A rejection function checks a molecule between the stages of an
+optimization :func:`.pipeline`. If it returns ``True``, the molecule is
+rejected and the remaining, usually more expensive, stages are
+skipped.
+
+Extending stk: Adding rejection functions.
+------------------------------------------
+
+New rejection functions are added by writing them in this module. As
+with optimization functions, the first argument must be `mol`. Any
+other arguments are set in the input file. The function must return
+``True`` if the molecule should be rejected and ``False`` otherwise.
+Rejection functions should be cheap compared to the optimization
+stages they guard.
+
+"""
+
+import logging
+import warnings
+import numpy as np
+from scipy.spatial.distance import pdist
+
+
+logger = logging.getLogger(__name__)
+
+
+def atoms_too_close(mol, min_distance=0.7, conformer=-1):
+    """
+    Rejects molecules which have overlapping atoms.
+
+    Parameters
+    ----------
+    mol : :class:`.Molecule`
+        The molecule to check.
+
+    min_distance : :class:`float`, optional
+        The smallest distance between 2 atoms, in Angstrom, which is
+        allowed.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to check.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if any 2 atoms are closer than `min_distance`.
+
+    """
+
+    coords = mol.mol.GetConformer(conformer).GetPositions()
+    if len(coords) < 2:
+        return False
+    return np.min(pdist(coords)) < min_distance
+
+
+def collapsed(mol, conformer=-1):
+    """
+    Rejects cages which do not have all of their windows.
+
+    Uses the same check as :func:`.macromodel_cage_opt`.
+
+    Parameters
+    ----------
+    mol : :class:`.Cage`
+        The cage to check.
+
+    conformer : :class:`int`, optional
+        The id of the conformer to check.
+
+    Returns
+    -------
+    :class:`bool`
+        ``True`` if the windows of the cage could not be found or if
+        any of them are missing.
+
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        windows = mol.windows(conformer)
+    return windows is None or len(windows) != mol.topology.n_windows
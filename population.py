@@ -9,13 +9,22 @@ from os.path import join
 import numpy as np
 import json
 from glob import iglob
-import multiprocessing as mp
 import psutil
-
-from .molecular import Molecule
-from .convenience_tools import dedupe
+import logging
+
+from .molecular import (Molecule,
+                        CACHE_SETTINGS,
+                        Energy,
+                        batch_energies,
+                        func_key)
+from .convenience_tools import dedupe, worker_pool, TaskFailure
 from .optimization.optimization import (_optimize_all_serial,
-                                        _optimize_all)
+                                        _optimize_all,
+                                        _optimize_all_threaded,
+                                        _optimize_all_batched)
+
+
+logger = logging.getLogger(__name__)
 
 
 class Population:
@@ -127,7 +136,8 @@ class Population:
 
         processes : :class:`int`, optional
             The number of parallel processes to create when building
-            the molecules.
+            the molecules. Ignored if a :class:`.WorkerPool` is
+            active, in which case its workers are used.
 
         duplicates : :class:`bool`, optional
             If ``False``, duplicate structures are removed from
@@ -145,7 +155,7 @@ class Population:
         for *bbs, topology in it.product(*building_blocks, topologies):
             args.append((bbs, topology))
 
-        with mp.Pool(processes) as pool:
+        with worker_pool(processes) as pool:
             mols = pool.starmap(macromol_class, args)
 
         # Update the cache.
@@ -493,6 +503,196 @@ class Population:
 
         return n
 
+    def calculate_energies(self,
+                           func_data,
+                           processes=psutil.cpu_count(),
+                           timeout=None,
+                           batch_size=1):
+        """
+        Calculates an energy of every member in parallel.
+
+        Each member is sent to a worker process, which runs the
+        :class:`.Energy` method described by `func_data` on it. The
+        results are added to :attr:`.Energy.values` of the members.
+        Expensive methods, such as :meth:`.Energy.mopac_ea` and
+        :meth:`.Energy.mopac_ip`, which run several external jobs per
+        molecule, benefit most, as the jobs of all members are spread
+        over the shared worker pool.
+
+        Parameters
+        ----------
+        func_data : :class:`.FunctionData`
+            Describes the :class:`.Energy` method to run and its
+            parameters. For example
+
+            .. code-block:: python
+
+                func_data = FunctionData('mopac_ip',
+                                         mopac_path='/opt/mopac')
+
+        processes : :class:`int`, optional
+            The number of parallel processes to use.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds the calculation of a single
+            batch may take. If ``None``, there is no limit.
+
+        batch_size : :class:`int`, optional
+            The number of members sent to a worker process at a time.
+            Methods which can calculate many molecules at once, such
+            as :meth:`.Energy.macromodel`, calculate each batch with
+            a single job, see :func:`.batch_energies`.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        members = list(self)
+        batches = [range(i, min(i+batch_size, len(members))) for
+                   i in range(0, len(members), batch_size)]
+        with worker_pool(processes) as pool:
+            for result in pool.imap_unordered(
+                            _members_energies,
+                            ((batch, [members[i] for i in batch], func_data)
+                             for batch in batches),
+                            timeout):
+                if isinstance(result, TaskFailure):
+                    _, failed, _ = result.args
+                    names = ', '.join(str(mem.name) for mem in failed)
+                    logger.error(f'Energy calculation of {names} '
+                                 f'failed. {result.reason}')
+                    continue
+
+                for i, values in result:
+                    members[i].energy.values.update(values)
+
+    def calculate_formation_energies(self,
+                                     func_data,
+                                     products=None,
+                                     processes=psutil.cpu_count(),
+                                     timeout=None,
+                                     batch_size=1,
+                                     force_e_calc=False):
+        """
+        Calculates the formation energy of every member.
+
+        :meth:`.Energy.formation` calculates the energies of the
+        building blocks and products for each molecule on its own.
+        Members of a population share few building blocks and
+        products, so here the energy of each unique molecule is
+        calculated once, in parallel, with :meth:`calculate_energies`.
+        The formation energies are then found for all members at once,
+        as the product of a matrix of stoichiometric coefficients and
+        the vector of unique energies.
+
+        The results are added to :attr:`.Energy.values` of each member,
+        under the same keys as :meth:`.Energy.formation` and
+        :meth:`.Energy.pseudoformation` use.
+
+        Parameters
+        ----------
+        func_data : :class:`.FunctionData`
+            Describes the :class:`.Energy` method used to calculate
+            the energies. For example
+
+            .. code-block:: python
+
+                func_data = FunctionData('rdkit', forcefield='uff')
+
+        products : :class:`list`, optional
+            A :class:`list` of the form
+
+            .. code-block:: python
+
+                products = [(4, mol1), (2, mol2)]
+
+            holding the molecules produced in addition to each member
+            and how many of them are made per member. See
+            :meth:`.Energy.formation`. If ``None``, no other molecules
+            are produced.
+
+        processes : :class:`int`, optional
+            The number of parallel processes to use.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds the calculation of a single
+            batch may take. If ``None``, there is no limit.
+
+        batch_size : :class:`int`, optional
+            The number of molecules sent to a worker process at a
+            time.
+
+        force_e_calc : :class:`bool`, optional
+            If ``True``, the energies of all molecules are calculated
+            again, even if they are already known. Each is still only
+            calculated once.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The formation energy of each member, in the order of
+            iteration.
+
+        """
+
+        members = list(self)
+        products = [] if products is None else list(products)
+        fkey = func_key(getattr(Energy, func_data.name),
+                        None,
+                        func_data.params)
+
+        # Every molecule whose energy is needed, each held once. The
+        # building blocks are cached, so members which share one hold
+        # the same object.
+        unique = {}
+        for mol in it.chain(members,
+                            (bb for mem in members for
+                             bb in mem.bb_counter),
+                            (mol for _, mol in products)):
+            unique.setdefault(id(mol), mol)
+        column = {mol_id: i for i, mol_id in enumerate(unique)}
+
+        pending = [mol for mol in unique.values() if
+                   force_e_calc or fkey not in mol.energy.values]
+        logger.info(f'Calculating {len(pending)} energies for the '
+                    f'formation energies of {len(members)} members.')
+        if pending:
+            Population(*pending).calculate_energies(func_data,
+                                                    processes,
+                                                    timeout,
+                                                    batch_size)
+
+        energies = np.array([mol.energy.values[fkey] for
+                             mol in unique.values()])
+
+        # Each row holds the number of each unique molecule consumed
+        # by the formation of a member, with molecules which are
+        # produced counted as negative.
+        pseudo = np.zeros((len(members), len(unique)))
+        for row, mem in enumerate(members):
+            for bb, n in mem.bb_counter.items():
+                pseudo[row, column[id(bb)]] += n
+            pseudo[row, column[id(mem)]] -= 1
+
+        made = np.zeros(len(unique))
+        for n, mol in products:
+            made[column[id(mol)]] += n
+
+        e_pseudo = pseudo @ energies
+        e_formation = e_pseudo - made @ energies
+
+        for mem, e_p, e_f in zip(members, e_pseudo, e_formation):
+            pkey = func_key(Energy.pseudoformation,
+                            (mem.energy, func_data))
+            mem.energy.values[pkey] = e_p
+            key = func_key(Energy.formation,
+                           (mem.energy, func_data, products))
+            mem.energy.values[key] = e_f
+
+        return e_formation
+
     def dump(self, path):
         """
         Dumps the population to a file.
@@ -524,10 +724,19 @@ class Population:
             json.dump(self.to_list(), f, indent=4)
 
     @classmethod
-    def from_list(cls, pop_list, member_init):
+    def from_list(cls,
+                  pop_list,
+                  member_init,
+                  processes=1,
+                  overwrite_cache=False):
         """
         Initializes a population from a :class:`list` representation.
 
+        The members are decoded in a single pass over `pop_list`. If
+        `processes` is more than ``1``, the decoding is split across a
+        process pool and the decoded molecules are merged into the
+        molecular caches once, in the calling process.
+
         Parameters
         ----------
         pop_list : :class:`list`
@@ -545,7 +754,63 @@ class Population:
         member_init : :class:`function`
             The initialization function for the population's members.
             It converts the member represenations in `pop_list` into
-            desired objects.
+            desired objects. Must be picklable if `processes` is more
+            than ``1``.
+
+        processes : :class:`int`, optional
+            The number of parallel processes used to decode the
+            members. Decoding is serial if ``1``.
+
+        overwrite_cache : :class:`bool`, optional
+            If ``True``, molecules which are already cached have their
+            attributes replaced by the versions in `pop_list`. If
+            ``False``, the cached versions are used and the versions
+            in `pop_list` are discarded.
+
+        Returns
+        -------
+        :class:`Population`
+            The population represented by `pop_list`.
+
+        """
+
+        # Collect all member dicts, depth-first, so that they can be
+        # decoded in one go. The population structure is rebuilt
+        # afterwards by consuming the decoded members in the same
+        # order.
+        member_dicts = []
+        _collect_member_dicts(pop_list, member_dicts)
+
+        # When overwriting, the members must be decoded from their
+        # dicts and not taken from the cache.
+        use_cache = CACHE_SETTINGS['ON'] and not overwrite_cache
+        args = ((member_init, x, use_cache) for x in member_dicts)
+        if processes == 1:
+            members = list(it.starmap(_decode_member, args))
+        else:
+            chunksize = max(1, len(member_dicts) // (4*processes))
+            with worker_pool(processes) as pool:
+                members = pool.starmap(_decode_member, args, chunksize)
+
+        if CACHE_SETTINGS['ON']:
+            members = _merge_into_cache(members, overwrite_cache)
+
+        return cls._from_decoded(pop_list, iter(members))
+
+    @classmethod
+    def _from_decoded(cls, pop_list, members):
+        """
+        Rebuilds the population structure of `pop_list`.
+
+        Parameters
+        ----------
+        pop_list : :class:`list`
+            A :class:`list` which represents a population, as in
+            :meth:`from_list`.
+
+        members : :class:`iterator`
+            Yields the decoded members of `pop_list`, in the
+            depth-first order of :func:`_collect_member_dicts`.
 
         Returns
         -------
@@ -557,13 +822,9 @@ class Population:
         pop = cls()
         for item in pop_list:
             if isinstance(item, dict):
-                pop.members.append(member_init(item))
+                pop.members.append(next(members))
             elif isinstance(item, list):
-                pop.populations.append(cls.from_list(item, member_init))
-
-            else:
-                raise TypeError(('Population list must consist only'
-                                 ' of strings and lists.'))
+                pop.populations.append(cls._from_decoded(item, members))
         return pop
 
     def has_structure(self, mol):
@@ -587,7 +848,11 @@ class Population:
         return any(x.same(mol) for x in self)
 
     @classmethod
-    def load(cls, path, member_init):
+    def load(cls,
+             path,
+             member_init,
+             processes=1,
+             overwrite_cache=False):
         """
         Initializes a :class:`Population` from one dumped to a file.
 
@@ -603,6 +868,17 @@ class Population:
             :meth:`.Molecule.from_dict` when loading ``.json`` files
             generated by :meth:`dump`.
 
+        processes : :class:`int`, optional
+            The number of parallel processes used to decode the
+            members. Decoding is serial if ``1``.
+
+        overwrite_cache : :class:`bool`, optional
+            If ``True``, molecules which are already cached have their
+            attributes replaced by the versions in the file. This is
+            useful when the file holds versions of the molecules with
+            more properties calculated than the cached ones, for
+            example when restarting a GA run.
+
         Returns
         -------
         :class:`Population`
@@ -613,7 +889,10 @@ class Population:
         with open(path, 'r') as f:
             pop_list = json.load(f)
 
-        return cls.from_list(pop_list, member_init)
+        return cls.from_list(pop_list,
+                             member_init,
+                             processes,
+                             overwrite_cache)
 
     def max(self, key):
         """
@@ -705,7 +984,13 @@ class Population:
 
         return np.min([key(member) for member in self], axis=0)
 
-    def optimize(self, func_data, processes=psutil.cpu_count()):
+    def optimize(self,
+                 func_data,
+                 processes=psutil.cpu_count(),
+                 timeout=None,
+                 threads=None,
+                 store=None,
+                 batch_size=None):
         """
         Optimizes the structures of molecules in the population.
 
@@ -716,6 +1001,27 @@ class Population:
         In this case creating a parallel process pool creates
         unncessary overhead.
 
+        If `timeout` is given, the optimizations always run in worker
+        processes, even if `processes` is ``1``. This allows an
+        optimization which hangs or crashes to be killed without
+        stopping the others.
+
+        If `threads` is given, the molecules are instead optimized by
+        that many threads of this process. This suits optimization
+        functions which spend most of their time waiting for external
+        programs, such as :func:`.macromodel_opt`, because no worker
+        process needs to hold a copy of the population. Threads
+        cannot be stopped, so `timeout` is not used. Use the timeout
+        settings of the optimization function instead.
+
+        Optimization functions which use many threads themselves, such
+        as :func:`.rdkit_conformer_search`, are given an equal share
+        of the cores of the machine, so that the processes or threads
+        optimizing different molecules do not compete for them.
+
+        Molecules rejected by an optimization :func:`.pipeline` are
+        removed from the population.
+
         Notes
         -----
         This function modifies the structures of molecules held by the
@@ -733,16 +1039,123 @@ class Population:
             The number of parallel processes to create. Optimization
             will run serially if ``1``.
 
+        timeout : :class:`float`, optional
+            The maximum number of seconds the optimization of a single
+            molecule may take. Molecules which take longer are logged
+            as failures. If ``None``, there is no limit.
+
+        threads : :class:`int`, optional
+            The number of threads used to optimize the molecules. If
+            ``None``, threads are not used.
+
+        store : :class:`.ResultStore`, optional
+            A store of optimized structures, which may be shared with
+            other runs. Molecules whose optimized structures are in
+            the store are updated from it instead of being optimized.
+
+        batch_size : :class:`int`, optional
+            If given, members are sent to the worker processes in
+            batches of this size. Optimization functions with a batch
+            version, such as :func:`.macromodel_opt`, optimize each
+            batch with a single job. `timeout` then applies to whole
+            batches.
+
         Returns
         -------
         None : :class:`NoneType`
 
         """
 
-        if processes == 1:
-            _optimize_all_serial(func_data, self)
+        if batch_size is not None:
+            _optimize_all_batched(func_data,
+                                  self,
+                                  processes,
+                                  batch_size,
+                                  timeout,
+                                  store)
+        elif threads is not None:
+            _optimize_all_threaded(func_data, self, threads, store)
+        elif processes == 1 and timeout is None:
+            _optimize_all_serial(func_data, self, store=store)
         else:
-            _optimize_all(func_data, self, processes)
+            _optimize_all(func_data,
+                          self,
+                          processes,
+                          timeout,
+                          store=store)
+
+        self.remove_members(lambda x: getattr(x, 'rejected', False))
+
+    def optimize_and_evaluate(self,
+                              func_data,
+                              processes=psutil.cpu_count(),
+                              timeout=None,
+                              store=None):
+        """
+        Optimizes molecules and calculates their fitness in one pass.
+
+        Each molecule is optimized and then has its fitness calculated
+        in the same worker task. A molecule's fitness calculation
+        starts as soon as it is optimized, rather than after the whole
+        population has been optimized. A worker is only given a new
+        molecule once it is free, so no more than one molecule per
+        worker is in flight at a time.
+
+        The population must have a ``ga_tools`` attribute and a
+        ``calculate_member_fitness()`` method, as a
+        :class:`.GAPopulation` does.
+
+        Molecules rejected by an optimization :func:`.pipeline` do not
+        have their fitness calculated and are removed from the
+        population.
+
+        If the task of a molecule fails, for example because its
+        worker crashed or it ran out of time, the fitness of the
+        molecule is calculated afterwards in this process. These
+        calculations run one after the other, rather than in the
+        workers.
+
+        Unlike :meth:`optimize`, molecules cannot be optimized by
+        threads or in batches, as each molecule has its own task.
+
+        Parameters
+        ----------
+        func_data : :class:`.FunctionData`
+            Holds the name and arguments of an optimization function
+            defined in :mod:`~stk.optimization`.
+
+        processes : :class:`int`
+            The number of parallel processes to create. The molecules
+            are handled serially if ``1``.
+
+        timeout : :class:`float`, optional
+            The maximum number of seconds the optimization and fitness
+            calculation of a single molecule may take. If ``None``,
+            there is no limit.
+
+        store : :class:`.ResultStore`, optional
+            A store of optimized structures, which may be shared with
+            other runs. Molecules whose optimized structures are in
+            the store are updated from it instead of being optimized.
+
+        Returns
+        -------
+        None : :class:`NoneType`
+
+        """
+
+        then = _MemberFitness(self.__class__, self.ga_tools)
+        if processes == 1 and timeout is None:
+            _optimize_all_serial(func_data, self, then, store)
+        else:
+            _optimize_all(func_data,
+                          self,
+                          processes,
+                          timeout,
+                          then,
+                          store)
+
+        self.remove_members(lambda x: getattr(x, 'rejected', False))
 
     def remove_duplicates(self,
                           between_subpops=True,
@@ -856,7 +1269,7 @@ class Population:
             pop.append(sp.to_list())
         return pop
 
-    def write(self, dir_path, use_name=False):
+    def write(self, dir_path, use_name=False, processes=1):
         """
         Writes the ``.mol`` files of members to a directory.
 
@@ -872,6 +1285,10 @@ class Population:
             ``False``, the files are just named after the member's
             index in the population.
 
+        processes : :class:`int`, optional
+            The number of parallel processes used to write the files.
+            The files are written serially if ``1``.
+
         Returns
         -------
         None : :class:`NoneType`
@@ -882,14 +1299,22 @@ class Population:
         if not os.path.exists(dir_path):
             os.mkdir(dir_path)
 
+        args = []
         for i, member in enumerate(self):
             if use_name:
                 fname = join(dir_path, '{}.mol'.format(
                                                         member.name))
             else:
                 fname = join(dir_path, '{}.mol'.format(i))
+            args.append((member, fname))
 
-            member.write(fname)
+        if processes == 1:
+            for member, fname in args:
+                member.write(fname)
+        else:
+            chunksize = max(1, len(args) // (4*processes))
+            with worker_pool(processes) as pool:
+                pool.starmap(_write_member, args, chunksize)
 
     def __iter__(self):
         """
@@ -1067,3 +1492,232 @@ class Population:
 
     def __repr__(self):
         return str(self)
+
+
+def _collect_member_dicts(pop_list, member_dicts):
+    """
+    Appends the member :class:`dict` in `pop_list` to `member_dicts`.
+
+    The population list is traversed depth-first.
+
+    Parameters
+    ----------
+    pop_list : :class:`list`
+        A :class:`list` which represents a population, as created by
+        :meth:`Population.to_list`.
+
+    member_dicts : :class:`list`
+        The :class:`list` to which the member :class:`dict` are
+        appended.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    Raises
+    ------
+    :class:`TypeError`
+        If `pop_list` holds anything other than :class:`dict` and
+        :class:`list` instances.
+
+    """
+
+    for item in pop_list:
+        if isinstance(item, dict):
+            member_dicts.append(item)
+        elif isinstance(item, list):
+            _collect_member_dicts(item, member_dicts)
+        else:
+            raise TypeError(('Population list must consist only'
+                             ' of dicts and lists.'))
+
+
+def _write_member(member, path):
+    """
+    Writes `member` to `path`.
+
+    This function runs in the worker processes used by
+    :meth:`Population.write`.
+
+    Parameters
+    ----------
+    member : :class:`.Molecule`
+        The molecule to write.
+
+    path : :class:`str`
+        The path of the written file.
+
+    Returns
+    -------
+    None : :class:`NoneType`
+
+    """
+
+    member.write(path)
+
+
+def _members_energies(indices, members, func_data):
+    """
+    Calculates an energy of a batch of `members`.
+
+    This function runs in the worker processes used by
+    :meth:`Population.calculate_energies`.
+
+    Parameters
+    ----------
+    indices : :class:`range`
+        The index of each member in the population.
+
+    members : :class:`list` of :class:`.Molecule`
+        The molecules whose energies are calculated.
+
+    func_data : :class:`.FunctionData`
+        Describes the :class:`.Energy` method to run.
+
+    Returns
+    -------
+    :class:`list` of :class:`tuple`
+        The index and :attr:`.Energy.values` of each member. Only the
+        energies are sent back, rather than the whole molecules.
+
+    """
+
+    batch_energies(members, func_data)
+    return [(i, mem.energy.values) for i, mem in zip(indices, members)]
+
+
+def _decode_member(member_init, member_dict, use_cache):
+    """
+    Decodes a single member of a population list.
+
+    This function runs in the worker processes used by
+    :meth:`Population.from_list`.
+
+    Parameters
+    ----------
+    member_init : :class:`function`
+        The initialization function for the member.
+
+    member_dict : :class:`dict`
+        The representation of the member.
+
+    use_cache : :class:`bool`
+        Toggles the use of the molecular caches during decoding.
+
+    Returns
+    -------
+    :class:`.Molecule`
+        The decoded member.
+
+    """
+
+    cache_on = CACHE_SETTINGS['ON']
+    CACHE_SETTINGS['ON'] = use_cache
+    try:
+        return member_init(member_dict)
+    finally:
+        CACHE_SETTINGS['ON'] = cache_on
+
+
+def _merge_into_cache(members, overwrite):
+    """
+    Merges decoded molecules into the caches of their classes.
+
+    Molecules which are not cached yet are added to the cache. If a
+    molecule is already cached, the cached instance is used in its
+    place. Building blocks of macromolecules are merged in the same
+    way, so that all macromolecules share the cached building blocks.
+    Cached building blocks are never overwritten.
+
+    Parameters
+    ----------
+    members : :class:`list` of :class:`.Molecule`
+        The decoded molecules.
+
+    overwrite : :class:`bool`
+        If ``True``, cached molecules have their attributes replaced
+        by the attributes of the decoded versions.
+
+    Returns
+    -------
+    :class:`list` of :class:`.Molecule`
+        The molecules in `members`, where each molecule has been
+        replaced by its cached instance.
+
+    """
+
+    def merge(mol, overwrite):
+        cache = getattr(mol.__class__, 'cache', None)
+        key = getattr(mol, 'key', None)
+        if cache is None or key is None:
+            return mol
+
+        cached = cache.get(key)
+        if cached is mol:
+            return mol
+
+        # Building blocks are merged first so that a molecule which is
+        # newly added to the cache holds the cached building blocks.
+        if hasattr(mol, 'building_blocks'):
+            mol.building_blocks = [merge(bb, False) for
+                                   bb in mol.building_blocks]
+            mol.bb_counter = mol.bb_counter.__class__(
+                {merge(bb, False): n for
+                 bb, n in mol.bb_counter.items()})
+
+        if cached is None:
+            cache[key] = mol
+            return mol
+
+        if overwrite:
+            cached.__dict__ = dict(vars(mol))
+        return cached
+
+    return [merge(mol, overwrite) for mol in members]
+
+
+class _MemberFitness:
+    """
+    Calculates the fitness of a single molecule.
+
+    Used by :meth:`Population.optimize_and_evaluate` to calculate the
+    fitness of a molecule in the worker which optimized it.
+
+    Attributes
+    ----------
+    pop_class : :class:`type`
+        The class of the population the molecule belongs to.
+
+    ga_tools : :class:`.GATools`
+        The GA settings, which hold the fitness function.
+
+    """
+
+    def __init__(self, pop_class, ga_tools):
+        self.pop_class = pop_class
+        self.ga_tools = ga_tools
+
+    def __call__(self, mol):
+        """
+        Calculates the fitness of `mol`.
+
+        Parameters
+        ----------
+        mol : :class:`.Molecule`
+            The molecule.
+
+        Returns
+        -------
+        :class:`.Molecule`
+            `mol`, holding its fitness.
+
+        """
+
+        # Rejected molecules are removed from the population, so their
+        # fitness is not needed.
+        if getattr(mol, 'rejected', False):
+            return mol
+
+        pop = self.pop_class(mol, ga_tools=self.ga_tools)
+        pop.calculate_member_fitness(1)
+        return mol
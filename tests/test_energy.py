@@ -1,6 +1,19 @@
+import pickle
+import sys
+import time
 from os.path import join
+from types import MethodType
+import pytest
+import rdkit.Chem.AllChem as rdkit
+from ..molecular import energy as energy_module
+from ..molecular.energy import (Energy,
+                                exclude,
+                                func_key,
+                                set_energy_store,
+                                _energy_store,
+                                _store_key)
 from ..ga import Population
-from ..convenience_tools import FunctionData
+from ..convenience_tools import FunctionData, set_conformer_positions
 from ..molecular import Molecule
 import numpy as np
 
@@ -9,12 +22,62 @@ pop = Population.load(join('data', 'macromolecule', 'mm.json'),
                       Molecule.from_dict)
 mol, mol2 = pop[:2]
 
+benchmark = pytest.mark.skipif(
+    all('benchmark' not in x for x in sys.argv),
+    reason="only run when explicitly asked")
+
 
 def test_rdkit():
     assert np.isclose(mol.energy.rdkit('uff'), -0.84, atol=0.01)
     assert np.isclose(mol.energy.rdkit('mmff'), 3476.86, atol=0.02)
 
 
+def test_rdkit_conformers(monkeypatch):
+    conformers = Molecule.__new__(Molecule)
+    conformers.name = 'conformers'
+    conformers.mol = rdkit.Mol(mol.mol)
+    conformers.energy = Energy(conformers)
+    coords = conformers.mol.GetConformer().GetPositions()
+    np.random.seed(4)
+    for i in range(1, 30):
+        conf = rdkit.Conformer(conformers.mol.GetConformer())
+        conf.SetId(i)
+        set_conformer_positions(
+                conf, coords + np.random.normal(0, 0.05, coords.shape))
+        conformers.mol.AddConformer(conf)
+
+    # Count the force field set ups.
+    setups = []
+    for name in ('UFFGetMoleculeForceField', 'MMFFGetMoleculeForceField'):
+        def counted(*args, name=name, func=getattr(rdkit, name)):
+            setups.append(name)
+            return func(*args)
+        monkeypatch.setattr(rdkit, name, counted)
+
+    singles = {}
+    for forcefield in ('uff', 'mmff'):
+        single = [conformers.energy.rdkit(forcefield, conf.GetId()) for
+                  conf in conformers.mol.GetConformers()]
+        singles[forcefield] = single
+        batch = conformers.energy.rdkit_conformers(forcefield)
+        assert np.allclose(single, batch)
+        assert len(set(np.round(batch, 6))) == len(batch)
+
+    # Each force field is set up once for all of the conformers.
+    assert setups == ['UFFGetMoleculeForceField',
+                      'MMFFGetMoleculeForceField']
+
+    # The force field is only set up once.
+    ff = conformers.energy._force_field('uff')
+    assert conformers.energy._force_field('uff') is ff
+
+    # Force fields are not pickled, but are set up again after
+    # unpickling.
+    copy = pickle.loads(pickle.dumps(conformers))
+    assert copy.energy._force_fields == {}
+    assert np.isclose(copy.energy.rdkit('uff', 3), singles['uff'][3])
+
+
 def test_formation():
     assert np.isclose(
             mol.energy.formation(
@@ -34,3 +97,90 @@ def test_pseudoformation():
 
 def test_logging():
     assert len(mol.energy.values) != 0
+
+
+class _Cheap(Energy):
+    @exclude('b')
+    def zero(self, a, b=2, c=3):
+        return 0
+
+
+def test_dispatch(monkeypatch):
+    eng = _Cheap(mol)
+    calls = [((1, ), {}), ((1, 5), {}), ((1, ), {'c': 4}),
+             ((), {'a': 1, 'b': 5, 'c': 4})]
+    for args, kwargs in calls:
+        eng.zero(*args, **kwargs)
+        key = func_key(_Cheap.zero, (eng, *args), kwargs)
+        assert eng.values[key] == 0
+    assert len(eng.values) == 2
+
+    # Custom keys are used as before.
+    key = func_key(Energy.pseudoformation,
+                   (mol.energy, FunctionData('rdkit', forcefield='uff')))
+    assert key in mol.energy.values
+
+    # The decorated method is only made once.
+    assert eng.zero is eng.zero
+    copy = pickle.loads(pickle.dumps(eng))
+    # The decorated methods are not pickled.
+    assert not any(isinstance(value, MethodType) for
+                   value in copy.__dict__.values())
+    copy.zero(2)
+    assert func_key(_Cheap.zero, (copy, 2)) in copy.values
+
+    # The signature is not inspected when the method is called.
+    inspected = []
+
+    def counted(func):
+        inspected.append(func)
+        return sig(func)
+
+    sig = energy_module.sig
+    monkeypatch.setattr(energy_module, 'sig', counted)
+    for i in range(10):
+        eng.zero(i)
+    assert inspected == []
+
+
+@benchmark
+def test_dispatch_benchmark():
+    eng = _Cheap(mol)
+    n = 20000
+    start = time.perf_counter()
+    for i in range(n):
+        eng.zero(1)
+    new = time.perf_counter() - start
+
+    # Inspecting the signature on each call, as was done before the
+    # keys were compiled, costs more than the whole call does now.
+    start = time.perf_counter()
+    for i in range(n):
+        func_key(_Cheap.zero, (eng, 1), {})
+    old = time.perf_counter() - start
+
+    assert new < old, (f'dispatch {new:.3f} s, '
+                       f'old key creation {old:.3f} s')
+
+
+def test_energy_store(tmpdir):
+    set_energy_store(str(tmpdir))
+    try:
+        eng = mol.energy.rdkit('uff')
+        assert len(tmpdir.listdir()) != 0
+
+        # Change the stored result, so that it is clear whether the
+        # result is loaded or calculated.
+        fkey = func_key(Energy.rdkit, None, {'forcefield': 'uff'})
+        _energy_store().put(_store_key(mol, fkey), eng + 100)
+        assert np.isclose(mol.energy.rdkit('uff'), eng + 100)
+
+        # Results of molecules with other coordinates are not reused.
+        conf = mol.mol.GetConformer()
+        pos = conf.GetAtomPosition(0)
+        conf.SetAtomPosition(0, (pos.x+1, pos.y, pos.z))
+        assert not np.isclose(mol.energy.rdkit('uff'), eng + 100)
+        conf.SetAtomPosition(0, pos)
+
+    finally:
+        set_energy_store(None)
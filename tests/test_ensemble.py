@@ -0,0 +1,100 @@
+import gzip
+import numpy as np
+import rdkit.Chem.AllChem as rdkit
+from os.path import join
+
+from ..molecular import Molecule, Ensemble, Energy
+from ..convenience_tools import rotation_matrix, MAE_HEADER
+
+
+def make_mol():
+    mol = Molecule.__new__(Molecule)
+    mol.name = 'molecule'
+    molfile = join('data', 'molecule', 'molecule.mol')
+    mol.mol = rdkit.MolFromMolFile(molfile,
+                                   removeHs=False,
+                                   sanitize=False)
+    return mol
+
+
+def make_ensemble(mol):
+    coords = mol.mol.GetConformer().GetPositions()
+    rot = rotation_matrix([1, 0, 0], [0, 0, 1])
+    conformers = [coords, coords @ rot.T + [1, 2, 3], coords*1.1]
+    return Ensemble(mol, conformers, [10, 0, 20])
+
+
+def test_geometry():
+    mol = make_mol()
+    ensemble = make_ensemble(mol)
+
+    assert len(ensemble) == 3
+    assert ensemble.coords.shape == (3, mol.mol.GetNumAtoms(), 3)
+    assert np.allclose(ensemble.centroids()[0], mol.centroid())
+    assert np.allclose(ensemble.centers_of_mass()[0],
+                       mol.center_of_mass())
+    # Moving and rotating a conformer does not change its shape.
+    assert np.allclose(ensemble.max_diameters()[:2],
+                       ensemble.max_diameters()[0])
+    assert np.allclose(ensemble.cavity_sizes()[0], mol.cavity_size(),
+                       atol=1e-3)
+
+
+def test_rmsd():
+    mol = make_mol()
+    ensemble = make_ensemble(mol)
+    rmsd = ensemble.rmsd()
+    assert np.allclose(rmsd[:2], 0)
+    assert rmsd[2] > 0.01
+
+
+def test_energies():
+    mol = make_mol()
+    ensemble = make_ensemble(mol)
+    assert ensemble.lowest_energy() == 1
+
+    weights = ensemble.boltzmann_weights()
+    assert np.isclose(weights.sum(), 1)
+    assert weights[1] > weights[0] > weights[2]
+
+    ensemble.add(ensemble.coords[0], -5)
+    assert len(ensemble) == 4
+    assert ensemble.lowest_energy() == 3
+
+    ensemble.set_conformer(1)
+    assert np.allclose(mol.mol.GetConformer().GetPositions(),
+                       ensemble.coords[1])
+
+
+def test_from_mae(tmpdir):
+    mol = make_mol()
+    path = str(tmpdir.join('md-out.maegz'))
+    with gzip.open(path, 'wt') as f:
+        f.write(MAE_HEADER)
+        for energy in (3, 1, 2):
+            # Add an energy to the properties of the structure.
+            f.write(mol.mae_block().replace(
+                ' s_m_title\n :::\n "molecule"\n',
+                ' s_m_title\n r_mmod_Potential_Energy\n :::\n'
+                f' "molecule"\n {energy}\n'))
+
+    ensemble = Ensemble.from_mae(mol, path)
+    assert list(ensemble.energies) == [3, 1, 2]
+    assert np.allclose(ensemble.coords[0],
+                       mol.mol.GetConformer().GetPositions(),
+                       atol=1e-5)
+
+    ensemble = Ensemble.from_mae(mol, path, 2)
+    assert list(ensemble.energies) == [1, 2]
+
+
+def test_rdkit_energies():
+    mol = make_mol()
+    rdkit.SanitizeMol(mol.mol)
+    mol.energy = Energy(mol)
+    ensemble = make_ensemble(mol)
+    energies = ensemble.rdkit_energies('uff')
+    assert np.allclose(ensemble.energies, energies)
+    # Moving and rotating a conformer does not change its energy.
+    assert np.isclose(energies[0], energies[1])
+    assert np.isclose(energies[0], mol.energy.rdkit('uff'))
@@ -2,17 +2,38 @@
 Tests functions which use MacroModel.
 
 These tests are only run when the --macromodel py.test option is used.
-MacroModel is 3rd party software, it does not come with MMEA.
+MacroModel is 3rd party software, it does not come with MMEA. The
+tests of the license handling use a fake ``bmin`` and always run.
 
 """
 
 import pytest
 import sys
 import os
+import time
+import copy
+import gzip
 from os.path import join
+from threading import Thread
+from types import SimpleNamespace
 import numpy as np
+import rdkit.Chem.AllChem as rdkit
 from tempfile import TemporaryDirectory
 from .. import macromodel_opt, macromodel_cage_opt, Molecule
+from ..molecular.energy import batch_energies
+from ..convenience_tools import (FunctionData,
+                                 set_conformer_positions,
+                                 structures_from_mae_file,
+                                 MAEExtractor,
+                                 MAE_HEADER)
+from ..optimization import macromodel as macromodel_module
+from ..optimization.macromodel import (macromodel_batch_opt,
+                                       _write_mae,
+                                       _run_bmin,
+                                       _license_gate,
+                                       _license_metrics,
+                                       set_macromodel_licenses,
+                                       _JobList)
 
 macromodel = pytest.mark.skipif(
     all('macromodel' not in x for x in sys.argv),
@@ -62,3 +83,280 @@ def test_macromodel_eng():
         os.chdir(outdir)
     assert np.allclose(
         c2.energy.macromodel(16, mm_path), 23.48, atol=1e-2)
+
+
+# A stand-in for ``bmin``. The first 2 runs of each job find no
+# license.
+fake_bmin = """#!/bin/sh
+runs=$(cat "$1.runs" 2>/dev/null || echo 0)
+echo $((runs+1)) > "$1.runs"
+if [ "$runs" -lt 2 ]; then
+    echo "FATAL -96: Could not check out a license for mmlibs" > "$1.log"
+    exit 1
+fi
+sleep 0.2
+echo "Done." > "$1.log"
+touch "$1-out.maegz"
+"""
+
+
+# A stand-in for ``structconvert``.
+fake_structconvert = """#!/bin/sh
+echo "converted $1" > "$2"
+"""
+
+
+def make_fake_bmin(path):
+    bmin = join(path, 'bmin')
+    with open(bmin, 'w') as f:
+        f.write(fake_bmin)
+    os.chmod(bmin, 0o755)
+
+
+def test_license_back_off(monkeypatch):
+    monkeypatch.setattr(_license_gate, 'backoff_base', 0.01)
+    retries = _license_metrics.retries
+    with TemporaryDirectory() as tmp_dir:
+        make_fake_bmin(tmp_dir)
+        mol = SimpleNamespace(name='fake', _file=join(tmp_dir, 'a.mol'))
+        _run_bmin(mol, tmp_dir)
+        assert os.path.exists(join(tmp_dir, 'a-out.maegz'))
+    assert _license_metrics.retries - retries == 2
+
+
+def test_license_seats(monkeypatch):
+    monkeypatch.setattr(_license_gate, 'backoff_base', 0.01)
+    with TemporaryDirectory() as tmp_dir:
+        make_fake_bmin(tmp_dir)
+        set_macromodel_licenses(1, join(tmp_dir, 'locks'))
+        mols = [SimpleNamespace(name=name, _file=join(tmp_dir, name))
+                for name in ('a.mol', 'b.mol')]
+        try:
+            start = time.perf_counter()
+            threads = [Thread(target=_run_bmin, args=(mol, tmp_dir))
+                       for mol in mols]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # With a single seat the jobs run one after the other.
+            assert time.perf_counter() - start >= 0.4
+        finally:
+            set_macromodel_licenses(0)
+
+
+# A stand-in for ``jobcontrol -list``. The job is listed the first 3
+# times.
+fake_jobcontrol = """#!/bin/sh
+runs=$(cat "$0.runs" 2>/dev/null || echo 0)
+echo $((runs+1)) > "$0.runs"
+if [ "$runs" -lt 3 ]; then
+    echo "job_name"
+fi
+"""
+
+
+def test_job_list():
+    job_list = _JobList()
+    job_list.min_interval = 0.05
+    with TemporaryDirectory() as tmp_dir:
+        app = join(tmp_dir, 'jobcontrol')
+        with open(app, 'w') as f:
+            f.write(fake_jobcontrol)
+        os.chmod(app, 0o755)
+
+        # Many waiters share the listings.
+        waiters = 5
+        threads = [Thread(target=job_list.wait_until_gone,
+                          args=(app, 'job_name', 10))
+                   for _ in range(waiters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The job is gone on the 4th listing. A waiter which starts
+        # late may need one more, but the waiters never each run
+        # their own listings.
+        with open(app + '.runs', 'r') as f:
+            assert 4 <= int(f.read()) <= waiters + 1
+
+
+# A stand-in for ``bmin``, used to compare batched and per molecule
+# MacroModel jobs. Each run is counted in ``bmin.runs``. The fake
+# ``bmin`` writes the structures in reverse order, so that they must
+# be matched to their molecules by title. If ``FAKE_BMIN_ERROR`` is
+# set, the log reports that ``bmin`` crashed.
+fake_batch_bmin = """#!{python}
+import sys, os, gzip
+with open(__file__ + '.runs', 'a') as f:
+    f.write('.')
+with open(sys.argv[1] + '.com') as f:
+    iname, oname = f.read().split(chr(10))[:2]
+with open(iname) as f:
+    structures = f.read().split('f_m_ct')[1:]
+with gzip.open(oname, 'wt') as f:
+    for structure in reversed(structures):
+        f.write('f_m_ct' + structure)
+with open(sys.argv[1] + '.log', 'w') as f:
+    for i in range(len(structures)):
+        f.write('                   Total Energy =  1.0 kJ/mol\\n')
+    if os.environ.get('FAKE_BMIN_ERROR'):
+        f.write('termination due to error condition           21-')
+"""
+
+
+def make_fake_schrodinger(path):
+    app = join(path, 'bmin')
+    with open(app, 'w') as f:
+        f.write(fake_batch_bmin.format(python=sys.executable))
+    os.chmod(app, 0o755)
+
+
+def bmin_runs(path):
+    runs = join(path, 'bmin.runs')
+    if not os.path.exists(runs):
+        return 0
+    with open(runs, 'r') as f:
+        return len(f.read())
+
+
+def test_batch_opt(tmpdir):
+    make_fake_schrodinger(str(tmpdir))
+    settings = {'restricted': False}
+    mols = []
+    for i in range(4):
+        mol = copy.deepcopy(c2)
+        coords = mol.mol.GetConformer().GetPositions() + i
+        set_conformer_positions(mol.mol.GetConformer(), coords)
+        mols.append(mol)
+    expected = [mol.mol.GetConformer().GetPositions() for mol in mols]
+
+    with tmpdir.as_cwd():
+        for mol in mols:
+            macromodel_opt(mol, str(tmpdir), settings)
+        single = bmin_runs(str(tmpdir))
+
+        optimized = macromodel_batch_opt(mols, str(tmpdir), settings)
+        batch = bmin_runs(str(tmpdir)) - single
+
+    assert optimized == [True]*len(mols)
+    # Each molecule got its own structure back, despite the order of
+    # the output.
+    for mol, coords in zip(mols, expected):
+        assert np.allclose(mol.mol.GetConformer().GetPositions(),
+                           coords,
+                           atol=1e-3)
+    # 1 program is run per molecule, but only 1 per batch.
+    assert single == len(mols)
+    assert batch == 1
+
+
+def test_batch_opt_failures(tmpdir, monkeypatch):
+    make_fake_schrodinger(str(tmpdir))
+    mols = [copy.deepcopy(c2) for _ in range(3)]
+
+    def fail_second(mol, *args, **kwargs):
+        if mol is mols[1]:
+            raise RuntimeError('Force field failed.')
+
+    # The batch job fails, so every molecule is optimized on its own.
+    monkeypatch.setattr(macromodel_module, 'macromodel_opt', fail_second)
+    monkeypatch.setenv('FAKE_BMIN_ERROR', '1')
+    with tmpdir.as_cwd():
+        optimized = macromodel_batch_opt(mols,
+                                         str(tmpdir),
+                                         {'restricted': False})
+
+    # The failure does not stop the molecules after it.
+    assert optimized == [True, False, True]
+    assert bmin_runs(str(tmpdir)) == 1
+
+
+def test_structconvert_fallback(tmpdir):
+    app = tmpdir.mkdir('utilities').join('structconvert')
+    app.write(fake_structconvert)
+    app.chmod(0o755)
+
+    # Atoms with known types are written without structconvert.
+    path = str(tmpdir.join('neutral.mae'))
+    _write_mae(c2, path, str(tmpdir))
+    with open(path, 'r') as f:
+        assert f.read().startswith(MAE_HEADER)
+
+    # Charged atoms are typed by structconvert.
+    charged = Molecule.__new__(Molecule)
+    charged.name = 'charged'
+    charged.mol = rdkit.AddHs(rdkit.MolFromSmiles('C[NH3+]'))
+    rdkit.EmbedMolecule(charged.mol, randomSeed=4)
+    path = str(tmpdir.join('charged.mae'))
+    _write_mae(charged, path, str(tmpdir))
+    with open(path, 'r') as f:
+        assert f.read().strip() == 'converted ' + str(
+                                                tmpdir.join('charged.mol'))
+
+
+def test_batch_energies(tmpdir):
+    make_fake_schrodinger(str(tmpdir))
+    mols = [copy.deepcopy(c2) for _ in range(3)]
+    with tmpdir.as_cwd():
+        batch_energies(mols, FunctionData('macromodel',
+                                          forcefield=16,
+                                          macromodel_path=str(tmpdir)))
+
+    fkey = FunctionData('macromodel', forcefield=16, conformer=-1)
+    assert all(mol.energy.values[fkey] == 1 for mol in mols)
+
+
+def conformer_block(title, energy, x):
+    return (
+        'f_m_ct {\n'
+        ' s_m_title\n'
+        ' r_mmod_Potential_Energy\n'
+        ' :::\n'
+        f' "{title}"\n'
+        f' {energy}\n'
+        ' m_atom[2] {\n'
+        '  # First column is atom index #\n'
+        '  i_m_atomic_number\n'
+        '  r_m_x_coord\n'
+        '  r_m_y_coord\n'
+        '  r_m_z_coord\n'
+        '  :::\n'
+        f'  1 6 {x} 0.0 0.0\n'
+        f'  2 8 {x+1} 0.0 0.0\n'
+        '  :::\n'
+        ' }\n'
+        '}\n\n'
+    )
+
+
+def test_mae_extractor(tmpdir):
+    energies = [5.0, 1.0, 3.0, 1.0, 4.0]
+    with gzip.open(str(tmpdir.join('md-out.maegz')), 'wt') as f:
+        f.write(MAE_HEADER)
+        for i, energy in enumerate(energies):
+            f.write(conformer_block(i, energy, float(i)))
+
+    extractor = MAEExtractor(str(tmpdir.join('md.mae')), 3)
+    # Conformer ids start at 1. Of equal energies, the earlier
+    # conformer comes first.
+    assert [(energy, num) for energy, num, *_ in
+            extractor.conformers] == [(1.0, 2), (1.0, 4), (3.0, 3)]
+    assert extractor.min_energy == 1.0
+    assert len(extractor.energies) == len(energies)
+
+    # The coordinates are held in memory.
+    energy, num, atomic_nums, coords = extractor.conformers[1]
+    assert list(atomic_nums) == [6, 8]
+    assert np.allclose(coords, [[3, 0, 0], [4, 0, 0]])
+
+    # The written file holds only the lowest energy conformer.
+    assert extractor.path == str(tmpdir.join('md-outEXTRACTED_2_conf_0.mae'))
+    structures = structures_from_mae_file(extractor.path)
+    assert len(structures) == 1
+    assert structures[0][0]['s_m_title'] == '1'
+
+    extractor = MAEExtractor(str(tmpdir.join('md.mae')), write=False)
+    assert extractor.path is None
+    assert extractor.conformers[0][:2] == (1.0, 2)
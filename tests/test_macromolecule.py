@@ -1,3 +1,6 @@
+import json
+import pytest
+import numpy as np
 from types import SimpleNamespace
 from os.path import join
 from ..molecular import (MacroMolecule, Molecule, FourPlusSix,
@@ -97,5 +100,69 @@ def test_json_init():
         assert mol.bonds_made == 12
         assert set(mol.bb_counter.values()) == {4, 6}
         assert mol.progress_params == {}
+        assert mol.ensemble is None
+
+        # A dumped and reloaded molecule has all the attributes too.
+        MacroMolecule.cache = {}
+        mol2 = Molecule.from_dict(json.loads(json.dumps(mol.json())))
+        assert mol2 is not mol
+        assert mol2.ensemble is None
+        assert mol2.energy.molecule is mol2
+    finally:
+        MacroMolecule.cache = og_c
+
+
+def test_json_topology_and_fitness():
+    og_c = dict(MacroMolecule.cache)
+    og_fitness = pop[0].unscaled_fitness
+    try:
+        MacroMolecule.cache = {}
+        mol = pop[0]
+        mol.unscaled_fitness = {'cage': np.array([1.5, np.nan]),
+                                'alignments': (0, 1)}
+        json_dict = mol.json()
+
+        # The new format must survive being written to JSON.
+        json_dict = json.loads(json.dumps(json_dict))
+        assert json_dict['topology']['class'] == 'FourPlusSix'
+
+        MacroMolecule.cache = {}
+        mol2 = Molecule.from_dict(json_dict)
+        assert repr(mol2.topology) == repr(mol.topology)
+        assert mol2.unscaled_fitness['alignments'] == (0, 1)
+        assert mol2.unscaled_fitness['cage'][0] == 1.5
+        assert np.isnan(mol2.unscaled_fitness['cage'][1])
+
+        # Building a molecule can change its topology, so identical
+        # topologies are not shared.
+        MacroMolecule.cache = {}
+        mol3 = Molecule.from_dict(json.loads(json.dumps(mol.json())))
+        assert mol3.topology is not mol2.topology
+        assert repr(mol3.topology) == repr(mol2.topology)
+
+        # A fitness value which is a string is not mistaken for the
+        # repr written by older versions.
+        mol.unscaled_fitness = 'fitness'
+        MacroMolecule.cache = {}
+        mol5 = Molecule.from_dict(json.loads(json.dumps(mol.json())))
+        assert mol5.unscaled_fitness == 'fitness'
+
+        # Fitness values which cannot be converted are not written.
+        mol.unscaled_fitness = {'cage': SimpleNamespace(a=1)}
+        with pytest.raises(TypeError):
+            mol.json()
+
+        # Legacy dump files store the repr of the topology and
+        # fitness.
+        MacroMolecule.cache = {}
+        json_dict['topology'] = ('FourPlusSix(A_alignments=(0, 1, 2, 0), '
+                                 'B_alignments=None)')
+        json_dict['unscaled_fitness'] = (
+                            "{'cage': array([  4.72, -73.0, nan])}")
+        mol4 = Molecule.from_dict(json_dict)
+        assert mol4.topology.A_alignments == (0, 1, 2, 0)
+        assert mol4.unscaled_fitness['cage'][1] == -73.0
+
     finally:
         MacroMolecule.cache = og_c
+        pop[0].unscaled_fitness = og_fitness
@@ -1,3 +1,5 @@
+import pytest
+import gzip
 import rdkit.Chem.AllChem as rdkit
 from os.path import join
 import itertools as it
@@ -6,7 +8,15 @@ from scipy.spatial.distance import euclidean
 
 
 from ..molecular import Molecule
-from ..convenience_tools import periodic_table
+from ..convenience_tools import (periodic_table,
+                                 mol_from_mae_file,
+                                 mol_from_mol_file,
+                                 coords_from_mae_file,
+                                 coords_from_mol_file,
+                                 AtomMismatchError,
+                                 AtomTypeError,
+                                 ChargedMolError,
+                                 MolFileError)
 
 
 # Make a loader for a test Molecule object.
@@ -165,6 +175,55 @@ def test_max_diameter():
     assert id2 == 12
 
 
+def test_mdl_mol_block():
+    """
+    Test `mdl_mol_block`.
+
+    """
+
+    block = mol.mdl_mol_block()
+    lines = block.split('\n')
+    assert lines[5] == 'M  V30 COUNTS {} {} 0 0 0'.format(
+                                            mol.mol.GetNumAtoms(),
+                                            mol.mol.GetNumBonds())
+    assert block.endswith('M  END\n\n$$$$\n')
+
+    # Check the atom lines against the coordinates of the conformer.
+    atom_lines = lines[7:7+mol.mol.GetNumAtoms()]
+    for line, atom in zip(atom_lines, mol.mol.GetAtoms()):
+        _, _, id_, sym, *coords, _ = line.split()
+        assert int(id_) == atom.GetIdx() + 1
+        assert sym == periodic_table[atom.GetAtomicNum()]
+        assert np.allclose([float(x) for x in coords],
+                           mol.atom_coords(atom.GetIdx()),
+                           atol=1e-4)
+
+    # The block should be readable by rdkit.
+    new = rdkit.MolFromMolBlock(block, sanitize=False, removeHs=False)
+    assert new.GetNumAtoms() == mol.mol.GetNumAtoms()
+    assert new.GetNumBonds() == mol.mol.GetNumBonds()
+
+
+def test_mdl_mol_block_cache():
+    mol = make_mol()
+    mol.mdl_mol_block()
+    columns = mol._blocks['mdl'][3]
+
+    # Only the coordinates are updated when the molecule is moved.
+    mol.set_position([1, 2, 3])
+    block = mol.mdl_mol_block()
+    assert mol._blocks['mdl'][3] is columns
+    new = rdkit.MolFromMolBlock(block, sanitize=False, removeHs=False)
+    assert np.allclose(new.GetConformer().GetPositions(),
+                       mol.position_matrix().T,
+                       atol=1e-4)
+
+    # A new graph gets new columns.
+    mol.mol = rdkit.Mol(mol.mol)
+    mol.mdl_mol_block()
+    assert mol._blocks['mdl'][3] is not columns
+
+
 def test_position_matrix():
     """
     Test `postion_matrix`.
@@ -252,3 +311,152 @@ def test_update_from_mae():
 
     mol.update_from_mae(join('data', 'molecule', 'molecule.mae'), 1)
     assert mol.max_diameter(0) != mol.max_diameter(1)
+
+    # Updating an existing conformer keeps the atom properties.
+    mol.mol.GetAtomWithIdx(0).SetIntProp('tag', 12)
+    _, coords = coords_from_mae_file(
+                            join('data', 'molecule', 'molecule.mae'))
+    mol.update_from_mae(join('data', 'molecule', 'molecule.mae'), 0)
+    assert mol.mol.GetAtomWithIdx(0).GetIntProp('tag') == 12
+    assert np.allclose(mol.mol.GetConformer(0).GetPositions(), coords)
+
+
+def test_update_from_mae_mismatch():
+    mol = Molecule.__new__(Molecule)
+    mol.mol = rdkit.MolFromMolFile(join('data', 'molecule', 'molecule.mol'),
+                                   removeHs=False,
+                                   sanitize=False)
+    # Swap the elements of two atoms so that the ordering no longer
+    # matches the file. The first atom is a nitrogen and the second a
+    # carbon, swapping atoms of the same element would change nothing.
+    atom1, atom2 = mol.mol.GetAtomWithIdx(0), mol.mol.GetAtomWithIdx(1)
+    num1, num2 = atom1.GetAtomicNum(), atom2.GetAtomicNum()
+    assert (num1, num2) == (7, 6)
+    atom1.SetAtomicNum(num2)
+    atom2.SetAtomicNum(num1)
+
+    with pytest.raises(AtomMismatchError):
+        mol.update_from_mae(join('data', 'molecule', 'molecule.mae'))
+
+
+def test_update_from_pdb_unreadable(tmpdir):
+    path = str(tmpdir.join('broken.pdb'))
+    with open(path, 'w') as f:
+        f.write('MOPAC failed.\n')
+    with pytest.raises(RuntimeError, match='broken.pdb'):
+        make_mol().update_from_pdb(path)
+
+
+def test_mol_from_mae_file():
+    mae = mol_from_mae_file(join('data', 'molecule', 'molecule.mae'))
+    atomic_nums, coords = coords_from_mae_file(
+                                join('data', 'molecule', 'molecule.mae'))
+
+    assert mae.GetNumAtoms() == mol.mol.GetNumAtoms()
+    assert mae.GetNumBonds() == mol.mol.GetNumBonds()
+    assert np.allclose(mae.GetConformer().GetPositions(), coords)
+    assert all(atom.GetAtomicNum() == atomic_num for
+               atom, atomic_num in zip(mae.GetAtoms(), atomic_nums))
+    assert all(atom1.GetAtomicNum() == atom2.GetAtomicNum() for
+               atom1, atom2 in zip(mae.GetAtoms(), mol.mol.GetAtoms()))
+
+
+def test_write_mae(tmpdir):
+    local = make_mol()
+    local.name = 'test'
+    path = str(tmpdir.join('molecule.mae'))
+    local.write(path)
+    with open(path, 'rb') as f:
+        content = f.read()
+    # MacroModel writes compressed files, which are read too.
+    with gzip.open(path + 'gz', 'wb') as f:
+        f.write(content)
+
+    for mae_path in (path, path + 'gz'):
+        mae = mol_from_mae_file(mae_path)
+        assert mae.GetNumAtoms() == local.mol.GetNumAtoms()
+        assert mae.GetNumBonds() == local.mol.GetNumBonds()
+        assert np.allclose(mae.GetConformer().GetPositions(),
+                           local.mol.GetConformer().GetPositions(),
+                           atol=1e-5)
+        assert all(atom1.GetAtomicNum() == atom2.GetAtomicNum() for
+                   atom1, atom2 in zip(mae.GetAtoms(),
+                                       local.mol.GetAtoms()))
+
+
+def read_mmod_types(path):
+    with open(path, 'r') as f:
+        lines = iter(f.read().split('\n'))
+    # Skip to the rows of the atom block.
+    for line in lines:
+        if line.strip().startswith('m_atom['):
+            break
+    for line in lines:
+        if line.strip() == ':::':
+            break
+
+    mmod_types = []
+    for line in lines:
+        if line.strip() == ':::':
+            return mmod_types
+        # The first column is the atom index and the next is the type.
+        mmod_types.append(int(line.split()[1]))
+
+
+def test_mmod_types(tmpdir):
+    # The types match the reference file, written by
+    # ``structconvert``.
+    local = make_mol()
+    local.name = 'test'
+    path = str(tmpdir.join('molecule.mae'))
+    local.write(path)
+    reference = join('data', 'molecule', 'molecule.mae')
+    assert read_mmod_types(path) == read_mmod_types(reference)
+
+    # Charged atoms, metals and hydrogen atoms bonded to sulfur are
+    # left to ``structconvert``.
+    for smiles in ('C[NH3+]', 'CC(=O)[O-]', 'C[Zn]C', 'CS'):
+        untyped = Molecule.__new__(Molecule)
+        untyped.name = smiles
+        untyped.mol = rdkit.AddHs(rdkit.MolFromSmiles(smiles))
+        with pytest.raises(AtomTypeError):
+            untyped.mae_block()
+
+
+def test_mol_from_mol_file():
+    path = join('data', 'molecule', 'molecule.mol')
+    new = mol_from_mol_file(path)
+    atomic_nums, coords = coords_from_mol_file(path)
+
+    assert new.GetNumAtoms() == mol.mol.GetNumAtoms()
+    assert new.GetNumBonds() == mol.mol.GetNumBonds()
+    assert np.allclose(new.GetConformer().GetPositions(),
+                       mol.mol.GetConformer().GetPositions())
+    assert np.allclose(coords, mol.mol.GetConformer().GetPositions())
+    assert list(atomic_nums) == [a.GetAtomicNum() for
+                                 a in mol.mol.GetAtoms()]
+    for bond1, bond2 in zip(new.GetBonds(), mol.mol.GetBonds()):
+        assert bond1.GetBeginAtomIdx() == bond2.GetBeginAtomIdx()
+        assert bond1.GetEndAtomIdx() == bond2.GetEndAtomIdx()
+
+
+def test_mol_file_atom_properties(tmpdir):
+    with open(join('data', 'molecule', 'molecule.mol')) as f:
+        content = f.read()
+    row = 'M  V30 1 N -0.0000 -1.5639 70.7107 0'
+    assert row in content
+
+    # Atom properties other than the charge are reported as a format
+    # error naming the row.
+    path = str(tmpdir.join('mass.mol'))
+    with open(path, 'w') as f:
+        f.write(content.replace(row, row + ' MASS=15'))
+    with pytest.raises(MolFileError) as error:
+        coords_from_mol_file(path)
+    assert 'MASS=15' in error.value.msg
+
+    path = str(tmpdir.join('charged.mol'))
+    with open(path, 'w') as f:
+        f.write(content.replace(row, row + ' CHG=1'))
+    with pytest.raises(ChargedMolError):
+        coords_from_mol_file(path)
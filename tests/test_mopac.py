@@ -12,6 +12,7 @@ import os
 from os.path import join
 import numpy as np
 from .. import mopac_opt, Molecule
+from ..molecular.energy import MOPACResult
 
 mopac = pytest.mark.skipif(
     all('mopac' not in x for x in sys.argv),
@@ -46,3 +47,34 @@ def test_mopac_ip():
         os.chdir(outdir)
     assert np.allclose(
         c2.energy.mopac_ip(mopac_path), 5.3975, atol=1e-2)
+
+
+def test_mopac_result(tmpdir):
+    arc = '''
+          HEAT OF FORMATION       =        -52.37145 KCAL/MOL =    -219.12 KJ/MOL
+          TOTAL ENERGY            =       -546.12345 EV
+          DIPOLE                  =          1.83410 DEBYE   POINT GROUP:     C1
+          HOMO LUMO ENERGIES (EV) =        -10.512  1.204
+'''
+    out = '''
+              NET ATOMIC CHARGES AND DIPOLE CONTRIBUTIONS
+
+  ATOM NO.   TYPE          CHARGE      No. of ELECS.   s-Pop       p-Pop
+    1          C          -0.215160        4.2152     1.09963     3.11553
+    2          O          -0.412000        6.4120     1.84402     4.56798
+    3          H           0.627160        0.3728     0.37284
+ DIPOLE           X         Y         Z       TOTAL
+'''
+    file_root = str(tmpdir.join('mol'))
+    with open(file_root + '.arc', 'w') as f:
+        f.write(arc)
+    with open(file_root + '.out', 'w') as f:
+        f.write(out)
+
+    result = MOPACResult(file_root)
+    assert np.isclose(result.energy, -546.12345)
+    assert np.isclose(result.heat_of_formation, -52.37145)
+    assert np.isclose(result.dipole, 1.83410)
+    assert np.isclose(result.homo, -10.512)
+    assert np.isclose(result.lumo, 1.204)
+    assert np.allclose(result.charges, [-0.21516, -0.412, 0.62716])
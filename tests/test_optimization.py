@@ -0,0 +1,181 @@
+import pytest
+import os
+from functools import partial
+import numpy as np
+import rdkit.Chem.AllChem as rdkit
+from os.path import join
+from types import SimpleNamespace
+
+from ..molecular import Molecule
+from ..convenience_tools import FunctionData
+from ..optimization import optimization as optimization_module
+from ..optimization.optimization import (_CostModel,
+                                         _OptimizationFunc,
+                                         _optimize_batch,
+                                         _share_cores,
+                                         do_not_optimize,
+                                         raiser,
+                                         pipeline,
+                                         rdkit_conformer_search)
+
+
+def make_mol(num_atoms, topology=None, optimized=False):
+    return SimpleNamespace(
+                mol=SimpleNamespace(GetNumAtoms=lambda: num_atoms),
+                topology=topology,
+                optimized=optimized)
+
+
+class Topology1:
+    ...
+
+
+class Topology2:
+    ...
+
+
+def test_cost_model():
+    model = _CostModel()
+    small = make_mol(10, Topology1())
+    big = make_mol(100, Topology1())
+    done = make_mol(1000, Topology1(), True)
+
+    # Without any timings, bigger molecules cost more and optimized
+    # molecules cost nothing.
+    assert model.predict('opt', big) > model.predict('opt', small)
+    assert model.predict('opt', done) == 0
+
+    # Topology1 molecules take 1 second per atom and Topology2
+    # molecules take 10 seconds per atom.
+    model.record('opt', make_mol(20, Topology1()), 20)
+    model.record('opt', make_mol(20, Topology2()), 200)
+    assert model.predict('opt', big) == 100
+    assert model.predict('opt', make_mol(10, Topology2())) == 100
+
+    # Unknown topologies use the mean of the optimization function.
+    assert model.predict('opt', make_mol(10)) == 55
+
+    # Skipped molecules are not recorded.
+    model.record('opt', make_mol(20, Topology1()), 0)
+    assert model.timings[('opt', 'Topology1')] == [1, 1]
+
+
+def fail_second(mols):
+    return [True, False, True]
+
+
+def test_optimize_batch():
+    def make_mols():
+        return [SimpleNamespace(name=i, optimized=False) for i in range(3)]
+
+    # Each molecule is reported as optimized or failed.
+    mols = make_mols()
+    func = _OptimizationFunc(partial(do_not_optimize))
+    _, _, optimized, _ = _optimize_batch(0, func, None, mols)
+    assert optimized == [True]*3
+    func = _OptimizationFunc(partial(raiser, param1=1))
+    _, _, optimized, _ = _optimize_batch(0, func, None, make_mols())
+    assert optimized == [False]*3
+
+    _, _, optimized, _ = _optimize_batch(0, None, fail_second, mols)
+    assert optimized == [True, False, True]
+
+    # If the batch function raises, every molecule failed, but none
+    # are tried again.
+    mols = make_mols()
+    _, _, optimized, _ = _optimize_batch(0,
+                                         None,
+                                         partial(raiser, param1=1),
+                                         mols)
+    assert optimized == [False]*3
+    assert all(mol.optimized for mol in mols)
+
+
+def make_positioned_mol(positions):
+    conformer = SimpleNamespace(GetPositions=lambda: np.array(positions))
+    return SimpleNamespace(
+                name='mol',
+                mol=SimpleNamespace(GetConformer=lambda _: conformer))
+
+
+def test_pipeline():
+    mol = make_positioned_mol([[0, 0, 0], [0, 0, 1]])
+    stages = [FunctionData('do_not_optimize'),
+              FunctionData('atoms_too_close', min_distance=0.5),
+              FunctionData('raiser', param1=1)]
+
+    # The atoms are far enough apart, so the molecule reaches the
+    # raiser.
+    with pytest.raises(Exception):
+        pipeline(mol, stages)
+    assert not hasattr(mol, 'rejected')
+
+    # The molecule is rejected before it reaches the raiser.
+    stages[1] = FunctionData('atoms_too_close', min_distance=2)
+    pipeline(mol, stages)
+    assert mol.rejected
+
+    # Names imported by the rejection module are not stages.
+    with pytest.raises(KeyError):
+        pipeline(mol, [FunctionData('pdist')])
+
+
+def test_pipeline_threads(monkeypatch):
+    calls = []
+
+    def search(mol, n_confs=10, num_threads=0):
+        calls.append(num_threads)
+
+    search.threads = 'num_threads'
+    monkeypatch.setattr(optimization_module,
+                        'rdkit_conformer_search',
+                        search)
+    mol = make_positioned_mol([[0, 0, 0], [0, 0, 1]])
+    stages = [FunctionData('rdkit_conformer_search'),
+              FunctionData('rdkit_conformer_search', num_threads=3)]
+
+    # The pipeline's threads go to the stages which do not set their
+    # own.
+    pipeline(mol, stages, threads=2)
+    pipeline(mol, stages)
+    assert calls == [2, 3, 0, 3]
+
+
+def test_share_cores():
+    params = {'n_confs': 10}
+    cores = os.cpu_count()
+    assert _share_cores(pipeline, params, 1) == {
+                                    'n_confs': 10, 'threads': cores}
+    assert _share_cores(rdkit_conformer_search, params, 1) == {
+                                    'n_confs': 10, 'num_threads': cores}
+    assert _share_cores(rdkit_conformer_search,
+                        params,
+                        2*cores)['num_threads'] == 1
+    # A thread count set by the user is kept.
+    assert _share_cores(rdkit_conformer_search,
+                        {'num_threads': 3},
+                        2) == {'num_threads': 3}
+
+
+def test_rdkit_conformer_search():
+    mols = []
+    for num_threads in (1, 2):
+        mol = Molecule.__new__(Molecule)
+        mol.name = 'molecule'
+        mol.mol = rdkit.MolFromMolFile(
+                            join('data', 'molecule', 'molecule.mol'),
+                            removeHs=False,
+                            sanitize=False)
+        before = mol.mol.GetConformer().GetPositions()
+        rdkit_conformer_search(mol,
+                               n_confs=5,
+                               random_seed=4,
+                               num_threads=num_threads)
+        assert mol.mol.GetNumConformers() == 1
+        assert not np.allclose(mol.mol.GetConformer().GetPositions(),
+                               before)
+        mols.append(mol)
+
+    # The number of threads does not change the result.
+    assert np.allclose(mols[0].mol.GetConformer().GetPositions(),
+                       mols[1].mol.GetConformer().GetPositions())
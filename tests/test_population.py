@@ -7,6 +7,7 @@ import copy
 
 from ..molecular import Cage, MacroMolecule, Molecule
 from ..population import Population
+from ..convenience_tools import FunctionData, ResultStore
 
 pop = Population.load(join('data', 'population', 'population.json'),
                       Molecule.from_dict)
@@ -194,6 +195,80 @@ def test_load():
         assert mem.name
 
 
+def test_load_parallel():
+    pname = join('data', 'population', 'pop2.json')
+    serial = Population.load(pname, Molecule.from_dict)
+    parallel = Population.load(pname, Molecule.from_dict, processes=2)
+
+    assert len(serial) == len(parallel)
+    assert len(serial.populations) == len(parallel.populations)
+    # The decoded members are merged into the cache, so both loads
+    # should give the same instances.
+    for mem1, mem2 in zip(serial, parallel):
+        assert mem1 is mem2
+        assert all(bb is bb.__class__.cache[bb.key] for
+                   bb in mem2.building_blocks)
+
+
+def test_load_overwrite_cache():
+    og_cache = dict(Cage.cache)
+
+    pname = join('data', 'population', 'pop2.json')
+    p1 = Population.load(pname, Molecule.from_dict)
+    for mem in p1:
+        mem.name = 'overwritten'
+
+    p2 = Population.load(pname,
+                         Molecule.from_dict,
+                         overwrite_cache=True)
+    for mem1, mem2 in zip(p1, p2):
+        # The cached instance is kept but its attributes come from
+        # the file.
+        assert mem1 is mem2
+        assert mem2.name != 'overwritten'
+
+    Cage.cache = og_cache
+
+
+def test_calculate_energies():
+    members = list(pop2)[:4]
+    energies = Population(*members)
+    func_data = FunctionData('rdkit', forcefield='uff')
+    energies.calculate_energies(func_data, 2)
+
+    fkey = FunctionData('rdkit', forcefield='uff', conformer=-1)
+    for mem in members:
+        assert np.isclose(mem.energy.values[fkey],
+                          mem.energy.rdkit('uff'))
+
+
+def test_calculate_formation_energies():
+    members = list(pop2)[:4]
+    energies = Population(*members)
+    func_data = FunctionData('rdkit', forcefield='uff')
+    water = members[0].building_blocks[0]
+    products = [(2, water)]
+    result = energies.calculate_formation_energies(func_data,
+                                                   products,
+                                                   2,
+                                                   force_e_calc=True)
+
+    # The results are logged under the same keys as the per molecule
+    # methods use, and match their results.
+    fkey = FunctionData('formation',
+                        func=FunctionData('rdkit',
+                                          forcefield='uff',
+                                          conformer=-1),
+                        products=products,
+                        building_blocks=None,
+                        conformer=-1)
+    for mem, eng in zip(members, result):
+        assert np.isclose(mem.energy.values[fkey], eng)
+        assert np.isclose(mem.energy.formation(func_data, products), eng)
+        assert np.isclose(mem.energy.pseudoformation(func_data),
+                          eng + 2*water.energy.rdkit('uff'))
+
+
 def test_all_members():
     """
     Check that all members, direct and in subpopulations, are returned.
@@ -472,3 +547,62 @@ def test_contains():
 
     pop.add_subpopulation(Population(*subpop_cages))
     assert subpop_cages[2] in pop
+
+
+class FitnessPopulation(Population):
+    def __init__(self, *args, ga_tools=None):
+        super().__init__(*args)
+        self.ga_tools = ga_tools
+
+    def calculate_member_fitness(self, processes):
+        for member in self:
+            member.test_fitness = self.ga_tools.fitness
+
+
+def test_optimize_and_evaluate():
+    members = [copy.deepcopy(mem) for mem in pop]
+    fpop = FitnessPopulation(*members,
+                             ga_tools=SimpleNamespace(fitness=1))
+    fpop.optimize_and_evaluate(FunctionData('do_not_optimize'), 1)
+    assert all(mem.optimized and mem.test_fitness == 1 for
+               mem in fpop)
+
+
+def pipeline(min_distance):
+    return FunctionData('pipeline', stages=[
+                FunctionData('do_not_optimize'),
+                FunctionData('atoms_too_close',
+                             min_distance=min_distance)])
+
+
+def unoptimized_members():
+    members = [copy.deepcopy(mem) for mem in list(pop2)[:3]]
+    for mem in members:
+        mem.optimized = False
+    return members
+
+
+def test_optimize_rejected(tmpdir):
+    store = ResultStore(str(tmpdir))
+
+    # No atoms are 100 A apart, so every molecule is rejected.
+    members = unoptimized_members()
+    rejected = Population(*members)
+    rejected.optimize(pipeline(100), 1, store=store)
+    assert len(rejected) == 0
+    assert all(mem.rejected for mem in members)
+    # Rejected molecules are not stored as optimized.
+    assert not list(store._files())
+
+    members = unoptimized_members()
+    fpop = FitnessPopulation(*members,
+                             ga_tools=SimpleNamespace(fitness=1))
+    fpop.optimize_and_evaluate(pipeline(100), 1)
+    assert len(fpop) == 0
+    assert not any(hasattr(mem, 'test_fitness') for mem in members)
+
+    members = unoptimized_members()
+    kept = Population(*members)
+    kept.optimize(pipeline(0), 1, store=store)
+    assert len(kept) == 3
+    assert len(list(store._files())) == 3
@@ -0,0 +1,48 @@
+"""
+Tests :func:`.run_program`.
+
+"""
+
+import time
+from threading import Thread
+
+from ..convenience_tools import run_program, set_program_limit
+
+
+def test_run_program():
+    result = run_program(['sh', '-c', 'echo out; echo err >&2; exit 3'])
+    assert result.returncode == 3
+    assert result.stdout == 'out\nerr\n'
+    assert not result.timed_out
+
+
+def test_run_program_timeout():
+    start = time.perf_counter()
+    # The program started by the shell is killed too.
+    result = run_program(['sh', '-c', 'sleep 30 & sleep 30'],
+                         timeout=0.5)
+    assert result.timed_out
+    assert time.perf_counter() - start < 10
+
+    stopped = []
+    result = run_program(['sleep', '30'],
+                         timeout=0.5,
+                         stop=lambda: stopped.append(True),
+                         grace=0.5)
+    assert result.timed_out
+    assert stopped == [True]
+
+
+def test_set_program_limit():
+    set_program_limit('test', 2)
+    threads = [Thread(target=run_program,
+                      args=(['sleep', '0.5'], ),
+                      kwargs={'group': 'test'}) for _ in range(4)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Only 2 programs can run at a time, so 2 rounds are needed.
+    assert time.perf_counter() - start >= 1
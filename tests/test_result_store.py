@@ -0,0 +1,58 @@
+import os
+import numpy as np
+from ..convenience_tools import ResultStore
+
+
+def test_result_store(tmpdir):
+    store = ResultStore(str(tmpdir))
+
+    key = store.key('mol', 'macromodel_opt', {'md': True})
+    assert key == store.key('mol', 'macromodel_opt', {'md': True})
+    assert key != store.key('mol', 'macromodel_opt', {'md': False})
+    assert store.key(b'ab', b'c') != store.key(b'a', b'bc')
+
+    assert store.get(key) is None
+    coords = np.arange(12).reshape(4, 3)
+    store.put(key, {'coords': coords})
+    assert np.all(store.get(key)['coords'] == coords)
+
+    # A second store using the same directory sees the result.
+    assert ResultStore(str(tmpdir)).get(key) is not None
+
+    # A corrupt file is treated as missing.
+    with open(store._file(key), 'wb') as f:
+        f.write(b'\x80')
+    assert store.get(key) is None
+
+    # So is a file holding a class which no longer exists.
+    with open(store._file(key), 'wb') as f:
+        f.write(b'\x80\x04c__main__\nMissingClass\n.')
+    assert store.get(key) is None
+
+
+def test_result_store_eviction(tmpdir):
+    store = ResultStore(str(tmpdir), max_size=3500)
+
+    keys = [store.key(i) for i in range(5)]
+    for i, key in enumerate(keys):
+        store.put(key, os.urandom(1000))
+        # Give each result a distinct time of last use.
+        os.utime(store._file(key), (i, i))
+
+    # The oldest results are deleted first.
+    assert store.get(keys[0]) is None
+    assert store.get(keys[-1]) is not None
+    assert store._scan_size() <= store.max_size
+
+
+def test_result_store_size(tmpdir):
+    store = ResultStore(str(tmpdir), max_size=10000)
+    key = store.key(0)
+    store.put(key, os.urandom(1000))
+    size = store._scan_size()
+
+    # Replacing a result does not grow the size estimate.
+    for _ in range(20):
+        store.put(key, os.urandom(1000))
+    assert store._size == size == store._scan_size()
+    assert store.get(key) is not None
@@ -0,0 +1,50 @@
+"""
+Tests :func:`.wait_for_file`.
+
+"""
+
+import time
+from os.path import join
+from threading import Timer
+from tempfile import TemporaryDirectory
+
+from ..convenience_tools import wait_for_file
+from ..convenience_tools.waiting import _wait_by_polling
+
+
+def make_later(path, delay):
+    timer = Timer(delay, lambda: open(path, 'w').close())
+    timer.start()
+    return timer
+
+
+def test_wait_for_file():
+    with TemporaryDirectory() as tmp_dir:
+        path = join(tmp_dir, 'out.maegz')
+        timer = make_later(path, 0.2)
+        start = time.perf_counter()
+        assert wait_for_file(path, 10)
+        assert time.perf_counter() - start < 5
+        timer.join()
+
+        # Files which already exist are found straight away.
+        assert wait_for_file(path, 0)
+        assert not wait_for_file(join(tmp_dir, 'missing'), 0.2)
+
+
+def test_wait_by_polling():
+    with TemporaryDirectory() as tmp_dir:
+        path = join(tmp_dir, 'out.maegz')
+        timer = make_later(path, 0.2)
+        assert _wait_by_polling(path, time.monotonic() + 10)
+        timer.join()
+        assert not _wait_by_polling(join(tmp_dir, 'missing'),
+                                    time.monotonic() + 0.2)
+
+
+def test_wait_for_file_cpu_time():
+    with TemporaryDirectory() as tmp_dir:
+        start = time.process_time()
+        wait_for_file(join(tmp_dir, 'missing'), 1)
+        # Waiting should leave the CPU idle.
+        assert time.process_time() - start < 0.2
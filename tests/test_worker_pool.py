@@ -0,0 +1,121 @@
+"""
+Tests :class:`.WorkerPool`.
+
+The benchmark is only run when the --benchmark py.test option is used.
+
+"""
+
+import pytest
+import sys
+import time
+import operator
+import os
+
+from ..convenience_tools import (WorkerPool, worker_pool, TaskFailure,
+                                 WorkerError)
+
+benchmark = pytest.mark.skipif(
+    all('benchmark' not in x for x in sys.argv),
+    reason="only run when explicitly asked")
+
+
+def test_worker_pool():
+    assert WorkerPool.active is None
+    with WorkerPool(2) as pool:
+        assert WorkerPool.active is pool
+        assert pool.startup_time is not None
+
+        # The active pool is reused.
+        with worker_pool(4) as pool2:
+            assert pool2 is pool
+            assert pool2.starmap(operator.add,
+                                 [(1, 2), (3, 4)]) == [3, 7]
+
+        # The pool is still running after being reused.
+        assert pool.map(abs, [-1, -2, 3]) == [1, 2, 3]
+        # Tasks run in the working directory of the main process.
+        assert pool.map(os.path.abspath, ['.']) == [os.getcwd()]
+
+    assert WorkerPool.active is None
+
+
+def test_temporary_worker_pool():
+    with worker_pool(2) as pool:
+        assert WorkerPool.active is pool
+        assert pool.map(abs, [-1]) == [1]
+    assert WorkerPool.active is None
+
+
+def test_worker_pool_reuse():
+    generations = 5
+    tasks = [()]*20
+
+    # A new pool per generation launches new workers every time.
+    new_pools = set()
+    for _ in range(generations):
+        with WorkerPool(2) as pool:
+            new_pools.update(pool.starmap(os.getpid, tasks))
+
+    # A reused pool launches its workers once.
+    reused_pool = set()
+    with WorkerPool(2) as pool:
+        for _ in range(generations):
+            reused_pool.update(pool.starmap(os.getpid, tasks))
+
+    assert len(reused_pool) <= 2
+    assert len(new_pools) > 2
+
+
+@benchmark
+def test_worker_pool_overhead():
+    """
+    Compares a new pool per generation with a reused pool.
+
+    """
+
+    generations = 5
+
+    start = time.perf_counter()
+    for _ in range(generations):
+        with WorkerPool(2) as pool:
+            pool.map(abs, range(100))
+    new_pools = (time.perf_counter() - start) / generations
+
+    start = time.perf_counter()
+    with WorkerPool(2) as pool:
+        for _ in range(generations):
+            pool.map(abs, range(100))
+    reused_pool = (time.perf_counter() - start) / generations
+
+    assert reused_pool < new_pools, (
+        f'Per generation overhead: {new_pools:.3f} s with a new pool, '
+        f'{reused_pool:.3f} s with a reused pool.')
+
+
+def test_worker_pool_failures():
+    with WorkerPool(2) as pool:
+        # A task which hangs is stopped and does not hold up the
+        # others.
+        results = list(pool.imap_unordered(time.sleep,
+                                           [(60, ), (0, ), (0, )],
+                                           timeout=1))
+        assert results.count(None) == 2
+        failure, = (x for x in results if isinstance(x, TaskFailure))
+        assert failure.args == (60, )
+        assert 'Timed out' in failure.reason
+
+        # A task which kills its worker is reported and the worker is
+        # replaced.
+        failure, = pool.imap_unordered(os._exit, [(3, )])
+        assert 'exit code 3' in failure.reason
+        assert pool.map(abs, [-1, -2, -3, -4]) == [1, 2, 3, 4]
+
+        # More crashing tasks than workers.
+        results = list(pool.imap_unordered(os._exit, [(3, )]*5))
+        assert len(results) == 5
+        assert all('exit code 3' in x.reason for x in results)
+        assert pool.map(abs, [-1, -2, -3, -4]) == [1, 2, 3, 4]
+
+        # Exceptions raised by tasks are passed on.
+        with pytest.raises(WorkerError):
+            pool.map(int, ['x'])